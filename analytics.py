@@ -0,0 +1,256 @@
+import heapq
+import math
+from datetime import date, datetime, timedelta
+
+from flask import request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import Integer, cast, func
+from sqlalchemy.exc import IntegrityError
+from models import db, Project, Task, ArchivedTask, ProjectArchive, AnalyticsDay
+
+DEFAULT_WINDOW_DAYS = 30
+MAX_WINDOW_DAYS = 365
+FORECAST_WINDOW_DAYS = 14
+
+
+def _as_date(value):
+    """func.date() gives a string on SQLite and a date on PostgreSQL"""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _duration_days(start, end):
+    """SQL expression for the number of days between two timestamp columns"""
+    if db.engine.dialect.name == 'sqlite':
+        return func.julianday(end) - func.julianday(start)
+    return func.extract('epoch', end - start) / 86400.0
+
+
+def _count_completions(project_ids, start_day, end_day):
+    """{(project_id, day): completed} for [start_day, end_day], one GROUP BY per table"""
+    counts = {}
+    for model in (Task, ArchivedTask):
+        day = func.date(model.completed_at)
+        rows = (
+            db.session.query(model.project_id, day.label('day'), func.count(model.id))
+            .filter(model.project_id.in_(project_ids),
+                    model.completed_at >= datetime.combine(start_day, datetime.min.time()),
+                    model.completed_at < datetime.combine(end_day + timedelta(days=1), datetime.min.time()))
+            .group_by(model.project_id, day)
+        )
+        for project_id, day_value, count in rows:
+            key = (project_id, _as_date(day_value))
+            counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def daily_completions(project_ids, start_day, today=None):
+    """Completed-task counts per day from start_day to today, summed over project_ids
+
+    Closed days are read from (and saved to) the analytics_day cache, so a
+    repeat call only aggregates today's bucket from the task table.
+    """
+    today = today or datetime.utcnow().date()
+    days = [start_day + timedelta(days=offset) for offset in range((today - start_day).days + 1)]
+    if not project_ids:
+        return [(day, 0) for day in days]
+
+    cached = {
+        (row.project_id, row.day): row.completed for row in
+        AnalyticsDay.query.filter(AnalyticsDay.project_id.in_(project_ids),
+                                  AnalyticsDay.day >= start_day,
+                                  AnalyticsDay.day < today)
+    }
+    missing = [(project_id, day) for project_id in project_ids for day in days[:-1]
+               if (project_id, day) not in cached]
+
+    if missing:
+        first_missing = min(day for _, day in missing)
+        computed = _count_completions(project_ids, first_missing, today - timedelta(days=1))
+        new_rows = [{'project_id': project_id, 'day': day, 'completed': computed.get((project_id, day), 0)}
+                    for project_id, day in missing]
+        try:
+            db.session.execute(db.insert(AnalyticsDay), new_rows)
+            db.session.commit()
+        except IntegrityError:
+            # another worker cached the same days first; our numbers are still valid
+            db.session.rollback()
+        cached.update({(row['project_id'], row['day']): row['completed'] for row in new_rows})
+
+    # Today is still changing, so it is always aggregated fresh
+    for (project_id, day), count in _count_completions(project_ids, today, today).items():
+        cached[(project_id, day)] = count
+
+    totals = dict.fromkeys(days, 0)
+    for (_, day), count in cached.items():
+        if day in totals:
+            totals[day] += count
+    return sorted(totals.items())
+
+
+def invalidate_day(project_id, completed_at):
+    """Drop the cached bucket a completion belonged to (after un-completing or deleting it)"""
+    if completed_at is None:
+        return
+    AnalyticsDay.query.filter_by(project_id=project_id, day=completed_at.date()) \
+        .delete(synchronize_session=False)
+
+
+def _percentile(sorted_values, fraction):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    weight = position - lower
+    return sorted_values[lower] * (1 - weight) + sorted_values[upper] * weight
+
+
+def cycle_times(project_ids, since=None):
+    """Start-to-completion time distribution in days, archived tasks included
+
+    Durations are computed and sorted in SQL and pulled as a single column
+    per table; the histogram is a GROUP BY over whole days.
+    """
+    if not project_ids:
+        return {'count': 0, 'mean': None, 'p50': None, 'p85': None, 'p95': None, 'histogram': []}
+
+    sorted_runs = []
+    buckets = {}
+    for model in (Task, ArchivedTask):
+        duration = _duration_days(model.start_date, model.completed_at)
+        base = db.session.query(model).filter(
+            model.project_id.in_(project_ids),
+            model.completed_at.isnot(None),
+            model.start_date.isnot(None),
+            duration >= 0,
+        )
+        if model is Task:
+            base = base.filter(Task.is_completed.is_(True))
+        if since is not None:
+            base = base.filter(model.completed_at >= since)
+
+        sorted_runs.append([float(row.duration) for row in
+                            base.with_entities(duration.label('duration')).order_by(duration)])
+        bucket = cast(duration, Integer)
+        for days, count in base.with_entities(bucket.label('days'), func.count(model.id)).group_by(bucket):
+            buckets[int(days)] = buckets.get(int(days), 0) + count
+
+    values = list(heapq.merge(*sorted_runs))
+    mean = sum(values) / len(values) if values else None
+    histogram = [{'days': days, 'count': count} for days, count in sorted(buckets.items())]
+
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    return {
+        'count': len(values),
+        'mean': rounded(mean),
+        'p50': rounded(_percentile(values, 0.50)),
+        'p85': rounded(_percentile(values, 0.85)),
+        'p95': rounded(_percentile(values, 0.95)),
+        'histogram': histogram,
+    }
+
+
+def task_totals(project_ids):
+    """(total, completed) task counts over project_ids, plus the precomputed archived counts"""
+    if not project_ids:
+        return 0, 0
+    total, completed = db.session.query(
+        func.count(Task.id),
+        func.coalesce(func.sum(cast(Task.is_completed, Integer)), 0)
+    ).filter(Task.project_id.in_(project_ids)).one()
+    archived = db.session.query(func.coalesce(func.sum(ProjectArchive.archived_tasks), 0)) \
+        .filter(ProjectArchive.project_id.in_(project_ids)).scalar()
+    return int(total) + int(archived), int(completed) + int(archived)
+
+
+def forecast(open_tasks, throughput, today=None):
+    """Projected completion date from the mean daily throughput of the recent window"""
+    today = today or datetime.utcnow().date()
+    recent = [count for _, count in throughput[-FORECAST_WINDOW_DAYS:]]
+    rate = sum(recent) / len(recent) if recent else 0
+    if open_tasks == 0:
+        return {'open_tasks': 0, 'daily_rate': round(rate, 2), 'completion_date': today.isoformat()}
+    if rate == 0:
+        return {'open_tasks': open_tasks, 'daily_rate': 0, 'completion_date': None}
+    return {
+        'open_tasks': open_tasks,
+        'daily_rate': round(rate, 2),
+        'completion_date': (today + timedelta(days=math.ceil(open_tasks / rate))).isoformat(),
+    }
+
+
+def burndown(total, completed, throughput, deadline=None, start=None):
+    """Remaining open tasks at the end of each day, with the ideal line to the deadline"""
+    completed_in_window = sum(count for _, count in throughput)
+    remaining = total - (completed - completed_in_window)
+
+    points = []
+    for day, count in throughput:
+        remaining -= count
+        points.append({'day': day.isoformat(), 'remaining': remaining})
+
+    if deadline is not None and points:
+        start = start or throughput[0][0]
+        first_remaining = points[0]['remaining'] + throughput[0][1]
+        span = max((deadline.date() - start).days, 1)
+        for point in points:
+            elapsed = (date.fromisoformat(point['day']) - start).days
+            point['ideal'] = round(max(first_remaining * (1 - elapsed / span), 0), 2)
+    return points
+
+
+def project_analytics(project, window_days=DEFAULT_WINDOW_DAYS):
+    today = datetime.utcnow().date()
+    start_day = max(today - timedelta(days=window_days - 1), project.created_at.date())
+    throughput = daily_completions([project.id], start_day, today)
+    total, completed = task_totals([project.id])
+
+    return {
+        'project_id': project.id,
+        'throughput': [{'day': day.isoformat(), 'completed': count} for day, count in throughput],
+        'burndown': burndown(total, completed, throughput, project.deadline, start_day),
+        'cycle_time': cycle_times([project.id]),
+        'forecast': forecast(total - completed, throughput, today),
+    }
+
+
+def user_analytics(project_ids, window_days=DEFAULT_WINDOW_DAYS):
+    today = datetime.utcnow().date()
+    start_day = today - timedelta(days=window_days - 1)
+    throughput = daily_completions(project_ids, start_day, today)
+    total, completed = task_totals(project_ids)
+
+    return {
+        'throughput': [{'day': day.isoformat(), 'completed': count} for day, count in throughput],
+        'cycle_time': cycle_times(project_ids),
+        'forecast': forecast(total - completed, throughput, today),
+    }
+
+
+def _window_days():
+    return max(1, min(request.args.get('days', DEFAULT_WINDOW_DAYS, type=int), MAX_WINDOW_DAYS))
+
+
+def register_analytics_routes(app):
+    """Register throughput / burndown analytics routes with the Flask app"""
+
+    @app.route('/projects/<int:project_id>/analytics')
+    @login_required
+    def project_analytics_view(project_id):
+        project = Project.query.get_or_404(project_id)
+        if project.user_id != current_user.id or project.is_deleting:
+            return jsonify({'error': 'Project not found'}), 404
+
+        return jsonify(project_analytics(project, _window_days()))
+
+    @app.route('/analytics')
+    @login_required
+    def user_analytics_view():
+        project_ids = [row.id for row in db.session.query(Project.id)
+                       .filter_by(user_id=current_user.id, is_deleting=False)]
+        return jsonify(user_analytics(project_ids, _window_days()))
@@ -0,0 +1,212 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, render_template, request, redirect, url_for, flash, abort
+from flask.cli import AppGroup
+from flask_login import login_required, current_user
+from sqlalchemy import exists, or_, select
+from models import (db, Project, Task, ArchivedTask, ProjectArchive,
+                    task_dependencies, archived_task_dependencies)
+from jobs import job_handler
+import closure
+from cache import invalidate, project_scope
+
+IMPORTANCE_LEVELS = ('low', 'medium', 'high')
+
+ARCHIVE_PAGE_SIZE = 50
+
+ARCHIVED_COLUMNS = ['id', 'title', 'description', 'start_date', 'expected_completion_date',
+                    'importance', 'completed_at', 'project_id']
+
+
+def _candidates(cutoff, project_id, limit):
+    """Completed tasks finished before cutoff whose prerequisites are all archived already
+
+    Edges to archived prerequisites live in archived_task_dependencies, so
+    any task_dependencies row means a live prerequisite. Waiting for those
+    keeps live tasks from having archived dependents, which reopening,
+    deleting or moving the live task would otherwise leave dangling. A chain
+    of old tasks is archived one link per batch, prerequisites first.
+    """
+    has_live_prerequisite = exists().where(task_dependencies.c.task_id == Task.id)
+    query = (
+        db.session.query(Task.id, Task.project_id, Task.importance)
+        .filter(Task.is_completed.is_(True),
+                Task.completed_at < cutoff,
+                ~has_live_prerequisite)
+        .order_by(Task.id)
+        .limit(limit)
+    )
+    if project_id is not None:
+        query = query.filter(Task.project_id == project_id)
+    return query.all()
+
+
+def _add_counts(rows, now):
+    """Fold one batch into the per-project archived counters"""
+    counts = defaultdict(Counter)
+    for row in rows:
+        counts[row.project_id]['archived_tasks'] += 1
+        if row.importance in IMPORTANCE_LEVELS:
+            counts[row.project_id][f'{row.importance}_archived'] += 1
+
+    existing = {archive.project_id for archive in
+                ProjectArchive.query.filter(ProjectArchive.project_id.in_(counts.keys()))}
+    for project_id, delta in counts.items():
+        if project_id in existing:
+            values = {name: getattr(ProjectArchive, name) + amount for name, amount in delta.items()}
+            values['last_archived_at'] = now
+            ProjectArchive.query.filter_by(project_id=project_id).update(values, synchronize_session=False)
+        else:
+            db.session.add(ProjectArchive(project_id=project_id, last_archived_at=now, **delta))
+
+
+def archive_batch(rows, now=None):
+    """Move one batch of tasks, and every edge touching them, into the archive tables
+
+    Copies are set-based INSERT ... SELECTs. Every archived task's
+    prerequisites are archived already, so the edges that move all run from
+    live dependents to the batch. Those are resolved (the batch is
+    complete), so no live task's blocked_count changes.
+    """
+    now = now or datetime.utcnow()
+    task_ids = [row.id for row in rows]
+    touches_batch = or_(task_dependencies.c.task_id.in_(task_ids),
+                        task_dependencies.c.depends_on_id.in_(task_ids))
+
+    task_columns = [getattr(Task, name) for name in ARCHIVED_COLUMNS]
+    db.session.execute(ArchivedTask.__table__.insert().from_select(
+        ARCHIVED_COLUMNS + ['archived_at'],
+        select(*task_columns, db.literal(now)).where(Task.id.in_(task_ids))
+    ))
+    db.session.execute(archived_task_dependencies.insert().from_select(
+        ['task_id', 'depends_on_id'],
+        select(task_dependencies.c.task_id, task_dependencies.c.depends_on_id).where(touches_batch)
+    ))
+
+    edges = defaultdict(list)
+    if closure.is_enabled():
+        for task_id, depends_on_id, project_id in db.session.execute(
+                select(task_dependencies.c.task_id, task_dependencies.c.depends_on_id, Task.project_id)
+                .join(Task, Task.id == task_dependencies.c.task_id)
+                .where(touches_batch)):
+            edges[project_id].append((task_id, depends_on_id))
+
+    db.session.execute(task_dependencies.delete().where(touches_batch))
+    for project_id, project_edges in edges.items():
+        closure.remove_edges(project_id, project_edges)
+    Task.query.filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
+    _add_counts(rows, now)
+    # Ready/blocked listings only hold open tasks, so only the project pages change
+    invalidate(*{project_scope(row.project_id) for row in rows})
+
+
+def archive_completed(older_than_days=None, project_id=None, batch_size=None):
+    """Archive completed tasks older than the configured age; returns how many moved
+
+    Works in batches, each its own short transaction, so it can run against
+    a busy database and be interrupted and resumed at any point.
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config['ARCHIVE_AFTER_DAYS']
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    archived = 0
+    while True:
+        rows = _candidates(cutoff, project_id, batch_size)
+        if not rows:
+            break
+        archive_batch(rows)
+        db.session.commit()
+        archived += len(rows)
+    return archived
+
+
+def forget_project_archive(project_id, chunk_size):
+    """Remove a project's archived tasks and edges in chunks (used when deleting the project)"""
+    while True:
+        task_ids = [row.id for row in db.session.query(ArchivedTask.id)
+                    .filter(ArchivedTask.project_id == project_id)
+                    .limit(chunk_size)]
+        if not task_ids:
+            break
+        db.session.execute(archived_task_dependencies.delete().where(or_(
+            archived_task_dependencies.c.task_id.in_(task_ids),
+            archived_task_dependencies.c.depends_on_id.in_(task_ids)
+        )))
+        ArchivedTask.query.filter(ArchivedTask.id.in_(task_ids)).delete(synchronize_session=False)
+        db.session.commit()
+    ProjectArchive.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+
+
+def archived_dependent_ids(task_ids):
+    """Archived tasks that depend on any of the given live tasks
+
+    Archiving waits for prerequisites, so this is only ever non-empty for
+    tasks archived before that rule; such prerequisites must not be deleted
+    or moved out from under their history.
+    """
+    return {row.task_id for row in db.session.query(archived_task_dependencies.c.task_id)
+            .filter(archived_task_dependencies.c.depends_on_id.in_(task_ids))}
+
+
+def forget_task_edges(task_id):
+    """Drop archived edges from a live task which is being deleted to its archived prerequisites"""
+    db.session.execute(archived_task_dependencies.delete().where(
+        archived_task_dependencies.c.task_id == task_id
+    ))
+
+
+@job_handler('archive.run')
+def archive_job(older_than_days=None, project_id=None):
+    """Periodic archival of old completed tasks"""
+    return {'archived': archive_completed(older_than_days, project_id)}
+
+
+def register_archive_routes(app):
+    """Register the archived task browser with the Flask app"""
+
+    @app.route('/projects/<int:project_id>/archive')
+    @login_required
+    def view_archive(project_id):
+        project = Project.query.get_or_404(project_id)
+        if project.is_deleting:
+            abort(404)
+
+        # Check if user owns this project
+        if project.user_id != current_user.id:
+            flash('You do not have permission to view this project', 'error')
+            return redirect(url_for('dashboard'))
+
+        # The counter row stands in for COUNT(*) over the archive
+        archive = db.session.get(ProjectArchive, project_id)
+        total = archive.archived_tasks if archive else 0
+        page = max(request.args.get('page', 1, type=int), 1)
+        tasks = (
+            ArchivedTask.query.filter_by(project_id=project_id)
+            .order_by(ArchivedTask.completed_at.desc(), ArchivedTask.id.desc())
+            .offset((page - 1) * ARCHIVE_PAGE_SIZE)
+            .limit(ARCHIVE_PAGE_SIZE)
+            .all()
+        )
+        pages = max((total + ARCHIVE_PAGE_SIZE - 1) // ARCHIVE_PAGE_SIZE, 1)
+        return render_template('archived_tasks.html', project=project, tasks=tasks,
+                               total=total, page=page, pages=pages)
+
+
+def register_archive_commands(app):
+    """Register `flask archive ...` CLI commands with the Flask app"""
+    archive_cli = AppGroup('archive', help='Completed task archive commands')
+
+    @archive_cli.command('run')
+    @click.option('--older-than-days', type=int, default=None,
+                  help='Archive tasks completed this many days ago (default: ARCHIVE_AFTER_DAYS)')
+    @click.option('--project-id', type=int, default=None, help='Only archive this project')
+    def run_command(older_than_days, project_id):
+        """Move old completed tasks into the archive tables"""
+        archived = archive_completed(older_than_days, project_id)
+        click.echo(f'{archived} task(s) archived')
+
+    app.cli.add_command(archive_cli)
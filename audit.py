@@ -0,0 +1,338 @@
+"""Append-only audit log written off the request path
+
+Routes call record(); the event is held on the session and only queued once
+the transaction commits, so rolled-back changes leave no history. A writer
+thread (one per worker process) takes events off the in-process queue and
+inserts them into audit_event in batches of up to AUDIT_BATCH_SIZE, or
+whatever has arrived after AUDIT_FLUSH_INTERVAL seconds.
+
+When the queue is full, or a batch cannot be written, AUDIT_OVERFLOW decides
+what happens to the events: 'spill' appends them as JSON lines to
+AUDIT_SPILL_PATH (load them later with `flask audit replay-spill`), 'drop'
+discards them and counts the loss. On shutdown the writer drains what is
+still queued before the process exits.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_request_context, request, jsonify
+from flask.cli import AppGroup
+from flask_login import login_required, current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, AuditEvent, Project, Task
+from timing import timed
+
+logger = logging.getLogger('taskapp.audit')
+
+PENDING_KEY = 'audit_events'
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+_STOP = object()
+
+
+def record(action, project_id, task_id=None, details=None, user_id=None):
+    """Note an event to be logged if the current transaction commits"""
+    if user_id is None and has_request_context() and current_user.is_authenticated:
+        user_id = current_user.id
+    db.session.info.setdefault(PENDING_KEY, []).append({
+        'occurred_at': datetime.utcnow(),
+        'user_id': user_id,
+        'project_id': project_id,
+        'task_id': task_id,
+        'action': action,
+        'details': details,
+    })
+
+
+def changes(before, after):
+    """{field: [old, new]} for the fields that differ between two dicts"""
+    return {name: [jsonable(before.get(name)), jsonable(after.get(name))]
+            for name in after if before.get(name) != after.get(name)}
+
+
+def jsonable(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class AuditLog:
+    """Bounded queue of events plus the thread that writes them"""
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.queue = queue.Queue(maxsize=config['AUDIT_QUEUE_SIZE'])
+        self.batch_size = config['AUDIT_BATCH_SIZE']
+        self.flush_interval = config['AUDIT_FLUSH_INTERVAL']
+        self.overflow = config['AUDIT_OVERFLOW']
+        self.spill_path = config['AUDIT_SPILL_PATH']
+        self.written = self.dropped = self.spilled = 0
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def enqueue(self, events):
+        if not self.app.config['AUDIT_WRITE_INLINE']:
+            self._ensure_writer()
+        for index, audit_event in enumerate(events):
+            try:
+                self.queue.put_nowait(audit_event)
+            except queue.Full:
+                # A request never waits for the writer
+                self._overflow(events[index:])
+                return
+
+    def _ensure_writer(self):
+        # Threads don't survive fork, so a preloaded app starts one per worker
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _take_batch(self):
+        """Wait for one event, then take whatever else is queued up to batch_size"""
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return [], False
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._take_batch()
+            if batch:
+                self._write(batch)
+        self.flush()  # anything queued behind the stop marker
+
+    def _write(self, batch):
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(AuditEvent.__table__.insert(), batch)
+            self.written += len(batch)
+        except Exception:
+            logger.exception('audit batch of %d event(s) not written', len(batch))
+            self._overflow(batch)
+
+    def _overflow(self, events):
+        if self.overflow != 'spill':
+            self.dropped += len(events)
+            return
+        try:
+            with self._spill_lock, open(self.spill_path, 'a') as spill:
+                for audit_event in events:
+                    spill.write(json.dumps(audit_event, default=jsonable, separators=(',', ':')) + '\n')
+            self.spilled += len(events)
+        except OSError:
+            logger.exception('audit spill to %s failed', self.spill_path)
+            self.dropped += len(events)
+
+    def flush(self):
+        """Write everything queued right now on the calling thread; returns the count"""
+        flushed = 0
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    batch.append(item)
+            if not batch:
+                return flushed
+            self._write(batch)
+            flushed += len(batch)
+
+    def stop(self, timeout=10):
+        """Drain the queue and stop the writer (registered with atexit)"""
+        if self._thread is not None and self._pid == os.getpid():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+            self._thread = None
+            self._pid = None
+        self.flush()
+
+
+def get_audit_log(app=None):
+    app = app or current_app
+    return app.extensions.get('audit')
+
+
+@event.listens_for(Session, 'after_commit')
+def _queue_events(session):
+    events = session.info.pop(PENDING_KEY, None)
+    if events:
+        audit_log = get_audit_log()
+        if audit_log is not None:
+            audit_log.enqueue(events)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_events(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def settled(query, after_id, now=None):
+    """Restrict an audit_event query to IDs past after_id that no later commit can slip under
+
+    IDs are handed out when a batch is inserted but show up when it commits,
+    so on PostgreSQL a batch can appear after a later one has been read and a
+    watermark moved past it. A row inserted more than AUDIT_SETTLE_SECONDS ago
+    means every lower ID has since committed or rolled back, so the query
+    stops short of the first row past after_id written more recently.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=current_app.config['AUDIT_SETTLE_SECONDS'])
+    unsettled = (db.session.query(db.func.min(AuditEvent.id))
+                 .filter(AuditEvent.id > after_id, AuditEvent.written_at > cutoff).scalar())
+    query = query.filter(AuditEvent.id > after_id)
+    return query if unsettled is None else query.filter(AuditEvent.id < unsettled)
+
+
+def replay_spill(audit_log):
+    """Insert spilled events into the table and empty the spill file; returns the count"""
+    path = audit_log.spill_path
+    if not os.path.exists(path):
+        return 0
+    claimed = f'{path}.{os.getpid()}.replay'
+    os.replace(path, claimed)  # new spills go to a fresh file meanwhile
+    events = []
+    with open(claimed) as spill:
+        for line in spill:
+            if line.strip():
+                audit_event = json.loads(line)
+                audit_event['occurred_at'] = datetime.fromisoformat(audit_event['occurred_at'])
+                events.append(audit_event)
+    for start in range(0, len(events), audit_log.batch_size):
+        db.session.execute(AuditEvent.__table__.insert(), events[start:start + audit_log.batch_size])
+    db.session.commit()
+    os.remove(claimed)
+    return len(events)
+
+
+def init_audit(app):
+    """Create the audit queue; the writer thread starts with the first event"""
+    if not app.config['AUDIT_ENABLED']:
+        logger.warning('audit log disabled: no change notifications, and no reminders for due dates '
+                       'set inside an already scanned range')
+        return None
+    if app.config['AUDIT_OVERFLOW'] == 'drop':
+        logger.warning('AUDIT_OVERFLOW=drop: dropped audit events are also lost to notifications, '
+                       'reminders and activity metrics')
+    audit_log = app.extensions['audit'] = AuditLog(app)
+
+    @app.teardown_request
+    def flush_inline(exc):
+        if app.config['AUDIT_WRITE_INLINE']:
+            audit_log.flush()
+
+    return audit_log
+
+
+def _history(query, before, limit):
+    """One page of events, newest first; returns (events, next_before)"""
+    if before is not None:
+        query = query.filter(AuditEvent.id < before)
+    rows = query.order_by(AuditEvent.id.desc()).limit(limit + 1).all()
+    next_before = rows[limit - 1].id if len(rows) > limit else None
+    return [row.to_dict() for row in rows[:limit]], next_before
+
+
+def _page_args():
+    before = request.args.get('before', type=int)
+    limit = max(1, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), MAX_HISTORY_PAGE_SIZE))
+    return before, limit
+
+
+def register_audit_routes(app):
+    """Register the task and project history endpoints with the Flask app"""
+
+    @app.route('/tasks/<int:task_id>/history')
+    @login_required
+    def task_history(task_id):
+        """A task's events, newest first; paged with ?before=<next>, also after the task is deleted"""
+        with timed('ownership'):
+            project_id = db.session.query(Task.project_id).filter(Task.id == task_id).scalar()
+            if project_id is None:
+                project_id = (db.session.query(AuditEvent.project_id)
+                              .filter(AuditEvent.task_id == task_id)
+                              .order_by(AuditEvent.id.desc()).limit(1).scalar())
+            owner_id = db.session.query(Project.user_id).filter(Project.id == project_id).scalar()
+        if owner_id is None or owner_id != current_user.id:
+            return jsonify({'error': 'Task not found'}), 404
+
+        events, next_before = _history(AuditEvent.query.filter(AuditEvent.task_id == task_id), *_page_args())
+        return jsonify({'task_id': task_id, 'events': events, 'next': next_before})
+
+    @app.route('/projects/<int:project_id>/history')
+    @login_required
+    def project_history(project_id):
+        """Every event in a project, newest first; paged with ?before=<next>"""
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.user_id != current_user.id or project.is_deleting:
+            return jsonify({'error': 'Project not found'}), 404
+
+        events, next_before = _history(AuditEvent.query.filter(AuditEvent.project_id == project.id), *_page_args())
+        return jsonify({'project_id': project.id, 'events': events, 'next': next_before})
+
+
+class AuditCollector:
+    """Prometheus collector for the writer's counters and queue depth"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+        audit_log = get_audit_log(self.app)
+        if audit_log is None:
+            return
+        events = CounterMetricFamily('app_audit_events', 'Audit events by outcome', labels=['outcome'])
+        for outcome in ('written', 'spilled', 'dropped'):
+            events.add_metric([outcome], getattr(audit_log, outcome))
+        yield events
+        depth = GaugeMetricFamily('app_audit_queue_depth', 'Audit events waiting for the writer')
+        depth.add_metric([], audit_log.queue.qsize())
+        yield depth
+
+
+def register_audit_metrics(app, registry):
+    registry.register(AuditCollector(app))
+
+
+def register_audit_commands(app):
+    """Register `flask audit ...` CLI commands with the Flask app"""
+    audit_cli = AppGroup('audit', help='Audit log commands')
+
+    @audit_cli.command('replay-spill')
+    def replay_spill_command():
+        """Load events spilled to AUDIT_SPILL_PATH into the audit table"""
+        audit_log = get_audit_log() or AuditLog(current_app)
+        click.echo(f'{replay_spill(audit_log)} event(s) replayed')
+
+    app.cli.add_command(audit_cli)
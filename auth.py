@@ -1,6 +1,23 @@
-from flask import render_template, request, redirect, url_for, flash
+from functools import wraps
+
+import click
+from flask import render_template, request, redirect, url_for, flash, abort
+from flask.cli import AppGroup
 from flask_login import login_user, logout_user, login_required, current_user
-from models import db, User
+from models import db, User, Project
+from stats import get_user_stats, get_project_stats
+
+
+def admin_required(view):
+    """Like login_required, but only for users with is_admin set; anyone else gets a 404"""
+    @wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if not current_user.is_admin:
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapped
+
 
 def register_auth_routes(app):
     """Register authentication routes with the Flask app"""
@@ -102,6 +119,30 @@ def register_auth_routes(app):
     @app.route('/dashboard')
     @login_required
     def dashboard():
-        # Get users projects
-        projects = current_user.projects
-        return render_template('dashboard.html', projects=projects)
+        # Get users projects, leaving out ones that are being deleted in the background
+        projects = Project.query.filter_by(user_id=current_user.id, is_deleting=False).all()
+
+        # Totals come from the rollup tables instead of walking every task
+        user_stats = get_user_stats(current_user.id)
+        project_stats = get_project_stats([project.id for project in projects])
+        return render_template('dashboard.html', projects=projects,
+                               user_stats=user_stats, project_stats=project_stats)
+
+
+def register_auth_commands(app):
+    """Register `flask users ...` CLI commands with the Flask app"""
+    users_cli = AppGroup('users', help='User account commands')
+
+    @users_cli.command('admin')
+    @click.argument('username')
+    @click.option('--revoke', is_flag=True, help='Take admin rights away instead')
+    def admin_command(username, revoke):
+        """Grant (or revoke) access to the /admin pages for an existing user"""
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(f'No user named {username}')
+        user.is_admin = not revoke
+        db.session.commit()
+        click.echo(f'{username} is {"no longer" if revoke else "now"} an admin')
+
+    app.cli.add_command(users_cli)
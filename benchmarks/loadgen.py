@@ -0,0 +1,466 @@
+"""Replay a realistic workload against a running server and report latency per endpoint.
+
+Registers and logs in N synthetic users, gives each a project seeded with a
+small dependency chain, then sends an open-loop stream of requests: arrivals
+follow a fixed rate (Poisson by default) regardless of how fast the server
+answers, so a slow server builds a queue instead of quietly slowing the
+client down. Latency is measured from each request's scheduled start, so
+time spent waiting for a free connection counts against the server too.
+
+Operations (weights set with --mix):
+
+  dashboard   GET  /dashboard
+  project     GET  /projects/<id>       also refreshes the user's view of its tasks
+  create      POST /projects/<id>/tasks/create, with up to two prerequisites
+  toggle      POST /tasks/<id>/complete, with the version last seen
+  edit        POST /tasks/<id>/edit, with the version last seen
+  ready       GET  /tasks/ready
+
+Writes send `Accept: application/json`, so a version conflict comes back as a
+409 and is reported as a conflict, not an error.
+
+Usage:
+  python benchmarks/loadgen.py run --url http://127.0.0.1:8000 --users 50 --rate 100 \\
+      --duration 60 --out before.json
+  python benchmarks/loadgen.py run ... --mix dashboard=20,project=40,toggle=30,edit=10
+  python benchmarks/loadgen.py compare before.json after.json
+"""
+import argparse
+import asyncio
+import html as htmllib
+import json
+import random
+import re
+import sys
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+DEFAULT_MIX = 'dashboard=25,project=35,create=10,toggle=15,edit=10,ready=5'
+SEED_TASKS = 5
+PASSWORD = 'loadgen-password'
+
+# The <h3> holds only the escaped title; anything else in it would end up in the title sent back on edits
+TASK_ROW = re.compile(
+    r'action="/tasks/(\d+)/complete".*?name="is_completed" value="(true|false)"'
+    r'.*?name="version" value="(\d+)".*?<h3>([^<]*)</h3>', re.S)
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection; just enough of the protocol for this app"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, method, path, host, headers, body=b''):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        status = int(status_line.split()[1])
+        response_headers = []
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            response_headers.append((name.strip().lower(), value.strip()))
+        fields = dict(response_headers)
+
+        if fields.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            payload = b''.join(chunks)
+        else:
+            payload = await self.reader.readexactly(int(fields.get('content-length', 0)))
+
+        reusable = fields.get('connection', '').lower() != 'close'
+        return status, response_headers, payload, reusable
+
+    def close(self):
+        self.writer.close()
+
+
+class User:
+    """A synthetic user: session cookie, idle connections and what they last saw"""
+
+    def __init__(self, client, username):
+        self.client = client
+        self.username = username
+        self.cookies = {}
+        self.idle = []
+        self.project_id = None
+        self.tasks = {}  # task id -> {'title', 'completed', 'version', 'dependencies'}
+        self.created = {}  # title -> prerequisites, until the task shows up on a page
+
+    async def send(self, method, path, form=None, accept=None):
+        headers = {}
+        body = b''
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        if form is not None:
+            body = urlencode(form, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if accept:
+            headers['Accept'] = accept
+
+        connection = self.idle.pop() if self.idle else await Connection.open(self.client.host, self.client.port)
+        try:
+            status, response_headers, payload, reusable = await connection.request(
+                method, path, self.client.netloc, headers, body)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            connection.close()
+            raise
+        if reusable:
+            self.idle.append(connection)
+        else:
+            connection.close()
+
+        location = None
+        for name, value in response_headers:
+            if name == 'set-cookie':
+                cookie, _, _ = value.partition(';')
+                cookie_name, _, cookie_value = cookie.partition('=')
+                self.cookies[cookie_name.strip()] = cookie_value.strip()
+            elif name == 'location':
+                location = value
+        return status, payload, location
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle.clear()
+
+    def remember_page(self, html):
+        """Refresh task ids, versions and completion from a rendered project page"""
+        seen = {}
+        for task_id, next_state, version, title in TASK_ROW.findall(html):
+            task_id, title = int(task_id), htmllib.unescape(title)
+            # Edits resend the prerequisites, or they would be dropped
+            dependencies = (self.tasks[task_id]['dependencies'] if task_id in self.tasks
+                            else self.created.pop(title, []))
+            seen[task_id] = {'title': title, 'completed': next_state == 'false', 'version': int(version),
+                             'dependencies': dependencies}
+        self.tasks = seen
+
+
+def _expect(status, allowed, what):
+    if status not in allowed:
+        raise SystemExit(f'{what} failed with HTTP {status}')
+
+
+async def setup_user(client, username, seed_tasks):
+    user = User(client, username)
+    status, _, _ = await user.send('POST', '/register', {
+        'username': username, 'email': f'{username}@loadgen.invalid',
+        'password': PASSWORD, 'confirm_password': PASSWORD})
+    _expect(status, (200, 302), f'registering {username}')
+    status, _, location = await user.send('POST', '/login', {'username': username, 'password': PASSWORD})
+    _expect(status, (302,), f'logging in {username}')
+
+    status, _, location = await user.send('POST', '/projects/create', {
+        'name': f'Load {username}', 'description': 'Created by benchmarks/loadgen.py'})
+    _expect(status, (302,), f'creating a project for {username}')
+    user.project_id = int(location.rstrip('/').rsplit('/', 1)[-1])
+
+    # A chain, so toggles and edits run into real dependency checks
+    previous = []
+    for index in range(seed_tasks):
+        title = f'Seed task {index}'
+        status, _, _ = await user.send('POST', f'/projects/{user.project_id}/tasks/create', {
+            'title': title, 'importance': 'medium', 'dependencies': previous})
+        _expect(status, (302,), f'seeding tasks for {username}')
+        user.created[title] = previous
+        await op_project(user, random.Random(index))
+        previous = [max(user.tasks)]
+    return user
+
+
+# Operations: each returns the HTTP status of its one measured request
+
+async def op_dashboard(user, rng):
+    status, _, _ = await user.send('GET', '/dashboard')
+    return status
+
+
+async def op_project(user, rng):
+    status, payload, _ = await user.send('GET', f'/projects/{user.project_id}')
+    if status == 200:
+        user.remember_page(payload.decode('utf-8', 'replace'))
+    return status
+
+
+async def op_create(user, rng):
+    prerequisites = rng.sample(sorted(user.tasks), min(len(user.tasks), rng.randint(0, 2)))
+    title = f'Task {uuid.uuid4().hex[:8]}'
+    status, _, _ = await user.send('POST', f'/projects/{user.project_id}/tasks/create', {
+        'title': title, 'description': 'loadgen',
+        'importance': rng.choice(['low', 'medium', 'high']), 'dependencies': prerequisites},
+        accept='application/json')
+    if status == 302:
+        user.created[title] = prerequisites
+    return status
+
+
+async def op_toggle(user, rng):
+    if not user.tasks:
+        return await op_project(user, rng)
+    task_id = rng.choice(sorted(user.tasks))
+    task = user.tasks[task_id]
+    status, _, _ = await user.send('POST', f'/tasks/{task_id}/complete', {
+        'is_completed': 'false' if task['completed'] else 'true', 'version': task['version']},
+        accept='application/json')
+    if status == 302:
+        task['version'] += 1
+        task['completed'] = not task['completed']
+    return status
+
+
+async def op_edit(user, rng):
+    if not user.tasks:
+        return await op_project(user, rng)
+    task_id = rng.choice(sorted(user.tasks))
+    task = user.tasks[task_id]
+    status, _, _ = await user.send('POST', f'/tasks/{task_id}/edit', {
+        'title': task['title'], 'description': f'edited {uuid.uuid4().hex[:8]}',
+        'importance': rng.choice(['low', 'medium', 'high']), 'version': task['version'],
+        'dependencies': task['dependencies']},
+        accept='application/json')
+    if status == 302:
+        task['version'] += 1
+    return status
+
+
+async def op_ready(user, rng):
+    status, _, _ = await user.send('GET', '/tasks/ready', accept='application/json')
+    return status
+
+
+OPERATIONS = {
+    'dashboard': op_dashboard,
+    'project': op_project,
+    'create': op_create,
+    'toggle': op_toggle,
+    'edit': op_edit,
+    'ready': op_ready,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}; choose from {", ".join(OPERATIONS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Client:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.netloc = parts.netloc
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(samples, elapsed):
+    """Per-operation throughput, latency percentiles (ms) and error/conflict rates"""
+    by_name = {}
+    for name, latency, outcome in samples:
+        by_name.setdefault(name, []).append((latency, outcome))
+    by_name['all'] = [(latency, outcome) for _, latency, outcome in samples]
+
+    summary = {}
+    for name, rows in by_name.items():
+        latencies = sorted(latency * 1000 for latency, _ in rows)
+        errors = sum(1 for _, outcome in rows if outcome == 'error')
+        conflicts = sum(1 for _, outcome in rows if outcome == 'conflict')
+        summary[name] = {
+            'requests': len(rows),
+            'throughput': len(rows) / elapsed if elapsed else 0,
+            'p50_ms': _percentile(latencies, 0.50),
+            'p95_ms': _percentile(latencies, 0.95),
+            'p99_ms': _percentile(latencies, 0.99),
+            'error_rate': errors / len(rows) if rows else 0,
+            'conflict_rate': conflicts / len(rows) if rows else 0,
+        }
+    return summary
+
+
+def _outcome(status):
+    if status == 409:
+        return 'conflict'
+    if status is None or status >= 400:
+        return 'error'
+    return 'ok'
+
+
+async def run_load(args):
+    client = Client(args.url)
+    rng = random.Random(args.seed)
+    run_id = uuid.uuid4().hex[:6]
+
+    print(f'setting up {args.users} users ...', file=sys.stderr)
+    setup = asyncio.Semaphore(args.setup_concurrency)
+
+    async def bounded_setup(index):
+        async with setup:
+            return await setup_user(client, f'lg{run_id}u{index}', args.seed_tasks)
+
+    users = await asyncio.gather(*(bounded_setup(index) for index in range(args.users)))
+
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    samples = []
+    in_flight = set()
+    dropped = 0
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+
+    async def fire(name, user, scheduled):
+        try:
+            status = await OPERATIONS[name](user, random.Random(rng.random()))
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status = None
+        if scheduled >= measure_from:
+            samples.append((name, time.perf_counter() - scheduled, _outcome(status)))
+
+    print(f'sending {args.rate:g} req/s for {args.warmup:g}s warm-up + {args.duration:g}s ...', file=sys.stderr)
+    scheduled = started
+    while True:
+        gap = rng.expovariate(args.rate) if args.arrival == 'poisson' else 1 / args.rate
+        scheduled += gap
+        if scheduled >= stop_at:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= args.max_in_flight:
+            # The client can't keep up with the schedule; say so instead of skewing latencies
+            if scheduled >= measure_from:
+                dropped += 1
+            continue
+        task = asyncio.create_task(fire(rng.choices(names, weights)[0], rng.choice(users), scheduled))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.wait(in_flight)
+    for user in users:
+        user.close()
+
+    return {
+        'url': args.url,
+        'users': args.users,
+        'rate': args.rate,
+        'arrival': args.arrival,
+        'duration_s': args.duration,
+        'mix': args.mix,
+        'dropped': dropped,
+        'endpoints': summarize(samples, args.duration),
+    }
+
+
+def _ms(value):
+    return f'{value:.1f}' if value is not None else '-'
+
+
+def print_report(result):
+    print(f'{result["users"]} users, {result["rate"]:g} req/s {result["arrival"]} for {result["duration_s"]:g}s'
+          f' against {result["url"]}' + (f'; {result["dropped"]} arrivals dropped (client saturated)'
+                                         if result['dropped'] else ''))
+    print(f'{"endpoint":<11}{"requests":>9}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+          f'{"errors":>8}{"409s":>8}')
+    for name, row in result['endpoints'].items():
+        print(f'{name:<11}{row["requests"]:>9}{row["throughput"]:>9.1f}{_ms(row["p50_ms"]):>9}'
+              f'{_ms(row["p95_ms"]):>9}{_ms(row["p99_ms"]):>9}'
+              f'{row["error_rate"]:>8.1%}{row["conflict_rate"]:>8.1%}')
+
+
+def _change(before, after):
+    if before is None or after is None:
+        return '-'
+    if not before:
+        return f'{after:.1f}'
+    return f'{(after - before) / before:+.0%}'
+
+
+def compare(before, after):
+    print(f'{"endpoint":<11}{"req/s":>22}{"p50 ms":>22}{"p95 ms":>22}{"p99 ms":>22}{"errors":>16}')
+    for name in after['endpoints']:
+        old = before['endpoints'].get(name)
+        new = after['endpoints'][name]
+        if old is None:
+            print(f'{name:<11}  (not in the first run)')
+            continue
+        cells = []
+        for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+            cells.append(f'{_ms(old[key])}->{_ms(new[key])} {_change(old[key], new[key]):>5}')
+        cells.append(f'{old["error_rate"]:.1%}->{new["error_rate"]:.1%}')
+        print(f'{name:<11}' + ''.join(f'{cell:>22}' for cell in cells[:-1]) + f'{cells[-1]:>16}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='generate load and report per-endpoint results')
+    run.add_argument('--url', default='http://127.0.0.1:8000')
+    run.add_argument('--users', type=int, default=20)
+    run.add_argument('--rate', type=float, default=50, help='arrivals per second across all users')
+    run.add_argument('--arrival', choices=['poisson', 'uniform'], default='poisson')
+    run.add_argument('--duration', type=float, default=30, help='measured seconds')
+    run.add_argument('--warmup', type=float, default=5, help='seconds of load sent before measuring')
+    run.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    run.add_argument('--seed-tasks', type=int, default=SEED_TASKS, help='tasks created per user before the run')
+    run.add_argument('--setup-concurrency', type=int, default=10)
+    run.add_argument('--max-in-flight', type=int, default=1000)
+    run.add_argument('--seed', type=int, default=None)
+    run.add_argument('--out', help='write the results as JSON, for `compare`')
+
+    diff = commands.add_parser('compare', help='compare two saved runs')
+    diff.add_argument('before')
+    diff.add_argument('after')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        with open(args.before) as f, open(args.after) as g:
+            compare(json.load(f), json.load(g))
+        return
+
+    result = asyncio.run(run_load(args))
+    print_report(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Measure gunicorn cold start and per-worker memory with gunicorn.conf.py.
+
+Starts gunicorn with the shipped config, times how long it takes until the
+first request is answered, sends some warm-up traffic, then reads each
+worker's memory from /proc/<pid>/smaps_rollup:
+
+  rss      resident pages, shared ones counted in full
+  pss      proportional share (shared pages split between the processes)
+  private  pages only this worker holds; what a new worker really costs
+
+Runs once with preload on and once with it off unless --preload is given.
+
+Usage:
+  DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/server_bench.py --workers 4
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _memory_kb(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return fields.get('Rss', 0), fields.get('Pss', 0), private
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def run(preload, workers, port, requests):
+    env = dict(os.environ, GUNICORN_PRELOAD=str(preload), GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS='1', GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_ACCESSLOG='')
+    url = f'http://127.0.0.1:{port}/login'
+
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise SystemExit('gunicorn exited during startup; run it by hand to see why')
+            try:
+                _get(url)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+        first_response = time.perf_counter() - started
+
+        # Every worker must finish booting before its memory means anything
+        while len(_children(server.pid)) < workers:
+            time.sleep(0.05)
+        time.sleep(1)
+        ready = time.perf_counter() - started
+
+        for _ in range(requests):
+            _get(url)
+
+        samples = [_memory_kb(pid) for pid in _children(server.pid)]
+        master = _memory_kb(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    count = len(samples)
+    return {
+        'preload': preload,
+        'first_response_s': first_response,
+        'all_workers_s': ready,
+        'master_rss_mb': master[0] / 1024,
+        'worker_rss_mb': sum(s[0] for s in samples) / count / 1024,
+        'worker_pss_mb': sum(s[1] for s in samples) / count / 1024,
+        'worker_private_mb': sum(s[2] for s in samples) / count / 1024,
+        'total_pss_mb': (master[1] + sum(s[1] for s in samples)) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--requests', type=int, default=200, help='warm-up requests before sampling memory')
+    parser.add_argument('--preload', choices=['on', 'off', 'both'], default='both')
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        parser.error('DATABASE_URL must point at an upgraded database')
+
+    modes = {'on': [True], 'off': [False], 'both': [True, False]}[args.preload]
+    print(f'{"preload":<9}{"first s":>9}{"ready s":>9}{"master":>9}'
+          f'{"rss":>9}{"pss":>9}{"private":>9}{"total pss":>11}   (MB per worker)')
+    for preload in modes:
+        r = run(preload, args.workers, args.port, args.requests)
+        print(f'{"on" if preload else "off":<9}{r["first_response_s"]:>9.2f}{r["all_workers_s"]:>9.2f}'
+              f'{r["master_rss_mb"]:>9.1f}{r["worker_rss_mb"]:>9.1f}{r["worker_pss_mb"]:>9.1f}'
+              f'{r["worker_private_mb"]:>9.1f}{r["total_pss_mb"]:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
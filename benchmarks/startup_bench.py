@@ -0,0 +1,139 @@
+"""Measure startup costs: per-worker schema bootstrap and process cold start.
+
+Schema modes start N fresh interpreter processes at once, like gunicorn
+workers without preload, and time the schema step each one runs on boot:
+
+  create_all  the old behaviour (inspect every table, create missing ones)
+  check       the schema_version lookup create_app now does
+
+The cold-start mode runs N fresh interpreters one after another and times
+each phase of getting to a served request, plus a one-shot CLI command:
+
+  import      `import run`
+  web app     create_app()
+  db app      create_app(web=False), as used by init_db.py
+  first req   first GET /login through the test client
+  cli         `flask --app run db current`, end to end
+
+Usage:
+  DATABASE_URL=postgresql://... python benchmarks/startup_bench.py --workers 32
+  DATABASE_URL=postgresql://... python benchmarks/startup_bench.py --mode cold-start --workers 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+COLD_START = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import run
+imported = time.perf_counter()
+app = run.create_app()
+built = time.perf_counter()
+run.create_app(web=False)
+db_built = time.perf_counter()
+app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({{'import': imported - started, 'web app': built - imported,
+                  'db app': db_built - built, 'first req': served - db_built}}))
+"""
+
+
+def _boot(mode, results):
+    os.environ['SCHEMA_CHECK_ON_STARTUP'] = 'False'
+    os.environ['TESTING'] = 'True'  # don't register Prometheus metrics in every child
+    from run import create_app
+    from models import db
+    from schema import check_schema
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        if mode == 'create_all':
+            db.create_all()
+        else:
+            check_schema()
+        elapsed = time.perf_counter() - started
+        db.session.remove()
+        db.engine.dispose()
+    results.put(elapsed)
+
+
+def run(mode, workers):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_boot, args=(mode, results)) for _ in range(workers)]
+
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    timings = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    wall = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'mode': mode,
+        'workers': workers,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'wall_s': wall,
+    }
+
+
+def cold_start(runs):
+    env = dict(os.environ, SCHEMA_CHECK_ON_STARTUP='True')
+    code = COLD_START.format(root=str(ROOT))
+    phases = {}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        for phase, seconds in json.loads(output.splitlines()[-1]).items():
+            phases.setdefault(phase, []).append(seconds)
+
+        started = time.perf_counter()
+        subprocess.run(['flask', '--app', 'run', 'db', 'current'], cwd=ROOT, env=env, check=True,
+                       capture_output=True)
+        phases.setdefault('cli', []).append(time.perf_counter() - started)
+
+    return {phase: (statistics.median(timings) * 1000, max(timings) * 1000)
+            for phase, timings in phases.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--mode', choices=['create_all', 'check', 'both', 'cold-start'], default='both')
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        parser.error('DATABASE_URL must point at an upgraded database')
+
+    if args.mode == 'cold-start':
+        print(f'{"phase":<12}{"median ms":>11}{"max ms":>10}')
+        for phase, (median, worst) in cold_start(args.workers).items():
+            print(f'{phase:<12}{median:>11.1f}{worst:>10.1f}')
+        return
+
+    modes = ['create_all', 'check'] if args.mode == 'both' else [args.mode]
+    print(f'{"mode":<12}{"workers":>8}{"mean ms":>10}{"p95 ms":>10}{"max ms":>10}{"wall s":>9}')
+    for mode in modes:
+        result = run(mode, args.workers)
+        print(f'{result["mode"]:<12}{result["workers"]:>8}{result["mean_ms"]:>10.2f}'
+              f'{result["p95_ms"]:>10.2f}{result["max_ms"]:>10.2f}{result["wall_s"]:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
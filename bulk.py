@@ -0,0 +1,259 @@
+"""Bulk task operations: update, delete or move a selection of tasks at once
+
+The whole selection is checked with a handful of set-based queries (one IN
+query for ownership, one each for the dependency edges that would block the
+change) and then applied with single UPDATE / DELETE statements. Statistics
+are recounted per project afterwards instead of per task.
+
+Every selected task must belong to the project in the URL. Deleting is
+refused while a task outside the selection depends on one inside it, and
+moving is refused while any edge links the selection to the tasks left
+behind, so edges never cross project boundaries. Archived tasks count as
+left behind for both.
+"""
+from datetime import datetime
+
+from flask import request, redirect, url_for, flash, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import and_, or_
+from models import (db, AnalyticsDay, Project, Task, TaskClosure,
+                    task_dependencies, archived_task_dependencies)
+from stats import refresh_project
+from analytics import _as_date
+from timing import timed
+from cache import invalidate_project
+import audit
+
+MAX_BULK_TASKS = 1000
+
+IMPORTANCE_LEVELS = ('low', 'medium', 'high')
+
+BULK_DONE = {'update': 'updated', 'delete': 'deleted', 'move': 'moved'}
+
+
+class BulkError(ValueError):
+    """The selection or the requested change was rejected; nothing was written"""
+
+
+def _selected_ids(project_id, raw_ids):
+    """Validate the selection with one IN query; returns the task IDs"""
+    task_ids = set()
+    for raw_id in raw_ids:
+        try:
+            task_ids.add(int(raw_id))
+        except (TypeError, ValueError):
+            raise BulkError(f'Invalid task ID: {raw_id}')
+    if not task_ids:
+        raise BulkError('No tasks selected')
+    if len(task_ids) > MAX_BULK_TASKS:
+        raise BulkError(f'At most {MAX_BULK_TASKS} tasks can be changed at once')
+
+    found = {row.id for row in db.session.query(Task.id)
+             .filter(Task.id.in_(task_ids), Task.project_id == project_id)}
+    missing = task_ids - found
+    if missing:
+        raise BulkError(f'Invalid task ID: {min(missing)}')
+    return sorted(task_ids)
+
+
+def _edge_titles(condition, limit=5):
+    """Titles of tasks at the dependent end of edges matching condition, for error messages"""
+    rows = (db.session.query(Task.title)
+            .join(task_dependencies, task_dependencies.c.task_id == Task.id)
+            .filter(condition)
+            .distinct()
+            .order_by(Task.title)
+            .limit(limit))
+    return [row.title for row in rows]
+
+
+def _archived_edge_titles(condition, *task_columns, limit=5):
+    """Titles of live tasks at either listed end of archived edges matching condition"""
+    rows = (db.session.query(Task.title)
+            .join(archived_task_dependencies, or_(*[column == Task.id for column in task_columns]))
+            .filter(condition)
+            .distinct()
+            .order_by(Task.title)
+            .limit(limit))
+    return [row.title for row in rows]
+
+
+def _completion_days(task_ids):
+    """Days on which selected tasks were completed (their analytics buckets change)"""
+    return {_as_date(row.day) for row in db.session.query(db.func.date(Task.completed_at).label('day'))
+            .filter(Task.id.in_(task_ids), Task.completed_at.isnot(None)).distinct()}
+
+
+def _forget_days(project_id, days):
+    """Drop the project's cached analytics buckets for these days"""
+    if days:
+        AnalyticsDay.query.filter(AnalyticsDay.project_id == project_id, AnalyticsDay.day.in_(days)) \
+            .delete(synchronize_session=False)
+
+
+def bulk_update(project, raw_ids, importance=None, expected_completion_date=None, clear_due=False):
+    """Set importance and/or due date on the selection with one UPDATE; returns the count"""
+    task_ids = _selected_ids(project.id, raw_ids)
+    values = {}
+    if importance is not None:
+        if importance not in IMPORTANCE_LEVELS:
+            raise BulkError('Invalid importance level')
+        values['importance'] = importance
+    if expected_completion_date is not None or clear_due:
+        values['expected_completion_date'] = expected_completion_date
+    if not values:
+        raise BulkError('Nothing to change')
+
+    # Bumping version makes any edit form opened before this a conflict
+    values['version'] = Task.version + 1
+    updated = Task.query.filter(Task.id.in_(task_ids)).update(values, synchronize_session=False)
+    changed = {name: audit.jsonable(value) for name, value in values.items() if name != 'version'}
+    for task_id in task_ids:
+        audit.record('edit', project.id, task_id, {**changed, 'bulk': True})
+    refresh_project(project.id, project.user_id)
+    invalidate_project(project.id, project.user_id)
+    return updated
+
+
+def bulk_delete(project, raw_ids):
+    """Delete the selection and every edge touching it; returns the count"""
+    task_ids = _selected_ids(project.id, raw_ids)
+
+    # Only tasks outside the selection can be left with a missing prerequisite
+    blocked = _edge_titles(and_(task_dependencies.c.depends_on_id.in_(task_ids),
+                                task_dependencies.c.task_id.notin_(task_ids)))
+    if blocked:
+        raise BulkError(f'Cannot delete. Tasks outside the selection depend on it: {", ".join(blocked)}')
+    prerequisites = _archived_edge_titles(archived_task_dependencies.c.depends_on_id.in_(task_ids),
+                                          archived_task_dependencies.c.depends_on_id)
+    if prerequisites:
+        raise BulkError(f'Cannot delete. Archived tasks depend on: {", ".join(prerequisites)}')
+
+    days = _completion_days(task_ids)
+    touches = or_(task_dependencies.c.task_id.in_(task_ids), task_dependencies.c.depends_on_id.in_(task_ids))
+    # No path runs from the selection to a task left behind, so every closure
+    # row that involves the selection goes and no other row changes
+    TaskClosure.query.filter(or_(TaskClosure.ancestor_id.in_(task_ids),
+                                 TaskClosure.descendant_id.in_(task_ids))).delete(synchronize_session=False)
+    db.session.execute(task_dependencies.delete().where(touches))
+    db.session.execute(archived_task_dependencies.delete().where(archived_task_dependencies.c.task_id.in_(task_ids)))
+    deleted = Task.query.filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
+    for task_id in task_ids:
+        audit.record('delete', project.id, task_id, {'bulk': True})
+
+    _forget_days(project.id, days)
+    refresh_project(project.id, project.user_id)
+    invalidate_project(project.id, project.user_id)
+    return deleted
+
+
+def bulk_move(project, raw_ids, target):
+    """Move the selection, with the edges among it, into target; returns the count"""
+    task_ids = _selected_ids(project.id, raw_ids)
+    if target.id == project.id:
+        raise BulkError('Tasks are already in this project')
+
+    inside = task_dependencies.c.task_id.in_(task_ids)
+    prerequisite_inside = task_dependencies.c.depends_on_id.in_(task_ids)
+    crossing = _edge_titles(or_(and_(inside, ~prerequisite_inside), and_(~inside, prerequisite_inside)))
+    # Archived tasks stay where they are, so any edge to one would cross too
+    crossing += _archived_edge_titles(or_(archived_task_dependencies.c.task_id.in_(task_ids),
+                                           archived_task_dependencies.c.depends_on_id.in_(task_ids)),
+                                       archived_task_dependencies.c.task_id, archived_task_dependencies.c.depends_on_id)
+    if crossing:
+        raise BulkError('Cannot move. Dependencies would cross projects for: ' + ', '.join(crossing))
+
+    days = _completion_days(task_ids)
+    # Edges reference task IDs, so the selection's internal edges move with it;
+    # closure rows only need their project relabelled
+    TaskClosure.query.filter(TaskClosure.ancestor_id.in_(task_ids)) \
+        .update({'project_id': target.id}, synchronize_session=False)
+    moved = Task.query.filter(Task.id.in_(task_ids)) \
+        .update({'project_id': target.id, 'version': Task.version + 1}, synchronize_session=False)
+    for task_id in task_ids:
+        audit.record('move', target.id, task_id, {'from_project_id': project.id, 'bulk': True})
+
+    for affected in (project, target):
+        _forget_days(affected.id, days)
+        refresh_project(affected.id, affected.user_id)
+        invalidate_project(affected.id, affected.user_id)
+    return moved
+
+
+def _parse_due(raw):
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, '%Y-%m-%d')
+    except ValueError:
+        raise BulkError('Invalid expected completion date format')
+
+
+def register_bulk_routes(app):
+    """Register the bulk task endpoint with the Flask app"""
+
+    @app.route('/projects/<int:project_id>/tasks/bulk', methods=['POST'])
+    @login_required
+    def bulk_tasks(project_id):
+        """Apply `action` (update, delete or move) to the selected tasks
+
+        Takes a form post from the project page (task_ids repeated) or a JSON
+        body {"action", "task_ids", ...}; answers in kind.
+        """
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        wants_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+        if project.user_id != current_user.id or project.is_deleting:
+            if wants_json:
+                return jsonify({'error': 'Project not found'}), 404
+            flash('You do not have permission to modify this project', 'error')
+            return redirect(url_for('dashboard'))
+
+        if request.is_json:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                data = {}
+            raw_ids = data.get('task_ids') or []
+        else:
+            data = request.form
+            raw_ids = request.form.getlist('task_ids')
+        action = data.get('action')
+
+        try:
+            # A string would be iterated character by character, a number not at all
+            if not isinstance(raw_ids, list):
+                raise BulkError('task_ids must be a list')
+            if action == 'update':
+                due = data.get('expected_completion_date') or None
+                changed = bulk_update(project, raw_ids,
+                                      importance=data.get('importance') or None,
+                                      expected_completion_date=_parse_due(due),
+                                      clear_due=bool(data.get('clear_due')))
+            elif action == 'delete':
+                changed = bulk_delete(project, raw_ids)
+            elif action == 'move':
+                target = db.session.get(Project, _target_id(data.get('target_project_id')))
+                if target is None or target.user_id != current_user.id or target.is_deleting:
+                    raise BulkError('Invalid target project')
+                changed = bulk_move(project, raw_ids, target)
+            else:
+                raise BulkError('Unknown bulk action')
+        except BulkError as error:
+            db.session.rollback()
+            if wants_json:
+                return jsonify({'error': str(error)}), 400
+            flash(str(error), 'error')
+            return redirect(url_for('view_project', project_id=project_id))
+
+        db.session.commit()
+        if wants_json:
+            return jsonify({'action': action, 'changed': changed})
+        flash(f'{changed} task(s) {BULK_DONE[action]}', 'success')
+        return redirect(url_for('view_project', project_id=project_id))
+
+
+def _target_id(raw):
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise BulkError('Invalid target project')
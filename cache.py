@@ -0,0 +1,369 @@
+"""Two-tier read cache: a per-worker LRU and a file shared by the workers on a node
+
+  local   an in-process LRU (per worker)
+  shared  a SQLite file in a private directory on /dev/shm that every worker
+          on the node reads and writes; no outside service needed
+
+Entries live under a scope such as "project:12". Writes don't delete
+entries; they bump the scope's generation, which is kept in the main
+database (cache_generation) and is part of every key. So a bump made by one
+worker hides the stale entries in every worker's tiers on every node, and
+those entries simply age out. The bump is written in the same transaction
+as the change it invalidates, so a reader sees the new generation exactly
+when it can see the new data.
+
+The shared file is named after the database URL, so two deployments on one
+host never read each other's entries, and it is only created in a directory
+that belongs to this user and no one else can write to. Entries are signed
+with SECRET_KEY and checked before they are unpickled.
+
+CACHE_BACKEND selects "shared" (both tiers), "local" (LRU only) or "null"
+(no caching).
+"""
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger('taskapp.cache')
+
+# Bump when the shape of cached values changes, so old entries are never read
+CACHE_FORMAT = 1
+
+PENDING_KEY = 'cache_invalidations'
+
+# Generation row that every key includes; bumping it hides all entries everywhere
+EPOCH_SCOPE = '*'
+
+BUMP_GENERATION = text('INSERT INTO cache_generation (scope, value) VALUES (:scope, 1) '
+                       'ON CONFLICT (scope) DO UPDATE SET value = cache_generation.value + 1')
+
+
+class LRUTier:
+    """Thread-safe in-process LRU with a fixed entry budget"""
+    name = 'local'
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """Node-local store in a SQLite file shared by every worker process
+
+    Any SQLite error is treated as a miss: the cache must never fail a request.
+    Values are pickled behind an HMAC, and one that fails the check is a miss.
+    """
+    name = 'shared'
+
+    # Prune expired and oldest entries once every this many writes
+    PRUNE_EVERY = 200
+
+    def __init__(self, path, max_entries, secret):
+        self.path = path
+        self.max_entries = max_entries
+        self._key = hmac.new(secret.encode(), b'taskapp-cache', hashlib.sha256).digest()
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # A forked worker must not reuse its parent's connection
+        if connection is None or self._local.pid != os.getpid():
+            # Owner-only from the start; SQLite gives its -wal/-shm files the same mode
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            connection = sqlite3.connect(self.path, timeout=0.5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_entry ('
+                               'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                               'expires_at REAL NOT NULL, stored_at REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_stored_at ON cache_entry (stored_at)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_generation ('
+                               'scope TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _sign(self, key, payload):
+        return hmac.new(self._key, key.encode() + b'\0' + payload, hashlib.sha256).digest()
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM cache_entry WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone()
+        except (OSError, sqlite3.Error):
+            row = None
+        if row is not None:
+            signature, payload = row[0][:32], row[0][32:]
+            if not hmac.compare_digest(signature, self._sign(key, payload)):
+                logger.warning('Dropping a shared cache entry with a bad signature')
+                row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(payload)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        payload = pickle.dumps(value)
+        try:
+            connection = self._connection()
+            connection.execute('INSERT OR REPLACE INTO cache_entry (key, value, expires_at, stored_at) '
+                               'VALUES (?, ?, ?, ?)', (key, self._sign(key, payload) + payload, now + ttl, now))
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(connection, now)
+        except (OSError, sqlite3.Error):
+            pass
+
+    def _prune(self, connection, now):
+        expired = connection.execute('DELETE FROM cache_entry WHERE expires_at <= ?', (now,)).rowcount
+        excess = self.size() - self.max_entries
+        if excess > 0:
+            connection.execute('DELETE FROM cache_entry WHERE key IN '
+                               '(SELECT key FROM cache_entry ORDER BY stored_at LIMIT ?)', (excess,))
+        self.evictions += expired + max(excess, 0)
+
+    def clear(self):
+        try:
+            self._connection().execute('DELETE FROM cache_entry')
+        except (OSError, sqlite3.Error):
+            pass
+
+    def size(self):
+        try:
+            return self._connection().execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+        except (OSError, sqlite3.Error):
+            return 0
+
+
+class Cache:
+    def __init__(self, local=None, shared=None, ttl=300):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+
+    @property
+    def tiers(self):
+        return [tier for tier in (self.local, self.shared) if tier is not None]
+
+    def generation(self, scope):
+        """'<epoch>.<generation>' for a scope, read from the main database"""
+        from models import db, CacheGeneration
+
+        values = dict(db.session.query(CacheGeneration.scope, CacheGeneration.value)
+                      .filter(CacheGeneration.scope.in_((EPOCH_SCOPE, scope))))
+        return f'{values.get(EPOCH_SCOPE, 0)}.{values.get(scope, 0)}'
+
+    def get_or_set(self, scope, name, compute, ttl=None):
+        """Return the cached value of compute() for (scope, name), filling both tiers on a miss"""
+        if not self.tiers:
+            return compute()
+
+        key = f'{CACHE_FORMAT}:{scope}:{self.generation(scope)}:{name}'
+        ttl = ttl or self.ttl
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                if self.local is not None:
+                    self.local.set(key, value, ttl)
+                return value
+
+        value = compute()
+        for tier in self.tiers:
+            tier.set(key, value, ttl)
+        return value
+
+    def clear(self):
+        """Hide every entry on every node (bumps the epoch; commits), and empty this node's tiers"""
+        from models import db
+
+        db.session.execute(BUMP_GENERATION, {'scope': EPOCH_SCOPE})
+        db.session.commit()
+        for tier in self.tiers:
+            tier.clear()
+
+
+def _private_directory(path):
+    """Create path owner-only, or refuse one that someone else could write to"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f'{path} must be a directory owned by this user with mode 0700')
+    return path
+
+
+def shared_path(config):
+    """The shared tier's file: one per database, in a private directory on /dev/shm"""
+    directory = config.get('CACHE_SHARED_DIR')
+    if not directory:
+        base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        directory = os.path.join(base, f'taskapp-cache-{os.getuid()}')
+    database = hashlib.sha256((config.get('SQLALCHEMY_DATABASE_URI') or '').encode()).hexdigest()[:16]
+    return os.path.join(_private_directory(directory), f'{database}.sqlite3')
+
+
+def create_cache(config):
+    backend = config.get('CACHE_BACKEND', 'shared')
+    ttl = config.get('CACHE_TTL', 300)
+    if backend == 'null':
+        return Cache(ttl=ttl)
+    local = LRUTier(config.get('CACHE_LOCAL_MAX_ENTRIES', 1024))
+    if backend == 'local':
+        return Cache(local=local, ttl=ttl)
+    try:
+        path = shared_path(config)
+    except OSError:
+        logger.exception('Shared cache directory is unusable; caching in this worker only')
+        return Cache(local=local, ttl=ttl)
+    shared = SQLiteTier(path, config.get('CACHE_SHARED_MAX_ENTRIES', 20000), config['SECRET_KEY'])
+    return Cache(local=local, shared=shared, ttl=ttl)
+
+
+def get_cache(app=None):
+    """The app's cache, built from its config on first use"""
+    app = app or current_app._get_current_object()
+    cache = app.extensions.get('cache')
+    if cache is None:
+        cache = app.extensions['cache'] = create_cache(app.config)
+    return cache
+
+
+def cached(scope, name, compute, ttl=None):
+    return get_cache().get_or_set(scope, name, compute, ttl)
+
+
+def project_scope(project_id):
+    return f'project:{project_id}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def invalidate(*scopes):
+    """Hide cached entries for these scopes when the current transaction commits"""
+    from models import db
+
+    db.session.info.setdefault(PENDING_KEY, set()).update(scopes)
+
+
+def invalidate_project(project_id, user_id):
+    """A project's data changed: drop its views and its owner's cross-project listings"""
+    invalidate(project_scope(project_id), user_scope(user_id))
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_invalidations(session):
+    scopes = session.info.pop(PENDING_KEY, None)
+    if scopes:
+        # Sorted, so two writers bumping the same scopes lock them in the same order
+        session.execute(BUMP_GENERATION, [{'scope': scope} for scope in sorted(scopes)])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+class CacheCollector:
+    """Prometheus collector reading the tier counters at scrape time"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+        tiers = get_cache(self.app).tiers
+        metrics = [
+            (CounterMetricFamily('app_cache_hits', 'Cache lookups answered by the tier', labels=['tier']), 'hits'),
+            (CounterMetricFamily('app_cache_misses', 'Cache lookups the tier could not answer', labels=['tier']), 'misses'),
+            (CounterMetricFamily('app_cache_evictions', 'Entries dropped for space or expiry', labels=['tier']), 'evictions'),
+        ]
+        for family, attribute in metrics:
+            for tier in tiers:
+                family.add_metric([tier.name], getattr(tier, attribute))
+            yield family
+
+        ratio = GaugeMetricFamily('app_cache_hit_ratio', 'Hits / lookups since start', labels=['tier'])
+        size = GaugeMetricFamily('app_cache_entries', 'Entries currently stored', labels=['tier'])
+        for tier in tiers:
+            lookups = tier.hits + tier.misses
+            ratio.add_metric([tier.name], tier.hits / lookups if lookups else 0)
+            size.add_metric([tier.name], tier.size())
+        yield ratio
+        yield size
+
+
+def register_cache_metrics(app, registry):
+    registry.register(CacheCollector(app))
+
+
+def register_cache_commands(app):
+    """Register `flask cache ...` CLI commands with the Flask app"""
+    cache_cli = AppGroup('cache', help='Shared cache commands')
+
+    @cache_cli.command('clear')
+    def clear_command():
+        """Hide every cached entry on every node and empty this node's file"""
+        get_cache().clear()
+        click.echo('cache cleared')
+
+    @cache_cli.command('stats')
+    def stats_command():
+        """Show entry counts for each tier"""
+        for tier in get_cache().tiers:
+            click.echo(f'{tier.name}: {tier.size()} entries')
+
+    app.cli.add_command(cache_cli)
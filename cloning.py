@@ -0,0 +1,160 @@
+"""Project clone and template instantiation, done in the database
+
+A clone copies the project row, then its tasks, dependency edges and (when
+enabled) closure rows with one INSERT ... SELECT each, so the cost does not
+grow with a round trip per task. Each copied task records the task it came
+from in cloned_from_id; edges and closure rows are remapped by looking
+copies up through that column (ix_task_project_cloned_from). Dates are shifted by a
+whole number of days and every copy starts incomplete. Everything happens in
+the caller's transaction.
+
+Archived tasks are not copied: they are complete, and a clone starts over.
+"""
+from datetime import datetime, timedelta
+
+from flask import render_template, request, redirect, url_for, flash, abort
+from flask_login import login_required, current_user
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from models import db, Project, Task, TaskClosure, task_dependencies
+from stats import refresh_project
+from timing import timed
+from cache import invalidate_project
+import audit
+import closure
+
+MAX_SHIFT_DAYS = 3650
+
+COPIED_COLUMNS = ['title', 'description', 'importance']
+
+
+def _shifted(column, days):
+    """SQL expression for a timestamp column moved by a number of days (NULL stays NULL)"""
+    if not days:
+        return column
+    if db.engine.dialect.name == 'sqlite':
+        return func.datetime(column, f'{days:+d} days', type_=db.DateTime)
+    return column + func.make_interval(0, 0, 0, days, type_=db.Interval)
+
+
+def _copy_of(source_task_id, project_id):
+    """Scalar subquery: ID of the task in project_id that was copied from source_task_id
+
+    A correlated index lookup per row rather than a join, so the plan does
+    not depend on the planner knowing how many tasks the new project has.
+    """
+    copy = aliased(Task)
+    return (select(copy.id)
+            .where(copy.project_id == project_id, copy.cloned_from_id == source_task_id)
+            .scalar_subquery())
+
+
+def template_offset(source, start):
+    """Days to shift source's dates so its earliest task starts on `start` (a date)"""
+    earliest = db.session.query(func.min(Task.start_date)).filter(Task.project_id == source.id).scalar()
+    anchor = earliest or source.created_at
+    return (start - anchor.date()).days
+
+
+def clone_project(source, name, user_id, shift_days=0, as_template=False):
+    """Copy source's tasks and dependencies into a new project; returns the new Project
+
+    The caller commits.
+    """
+    project = Project(
+        name=name,
+        description=source.description,
+        deadline=source.deadline + timedelta(days=shift_days) if source.deadline else None,
+        user_id=user_id,
+        is_template=as_template,
+        cloned_from_id=source.id,
+    )
+    db.session.add(project)
+    db.session.flush()
+
+    # Every copy is open, so its blocked_count is simply its number of prerequisites
+    prerequisites = (select(func.count())
+                     .where(task_dependencies.c.task_id == Task.id)
+                     .correlate(Task).scalar_subquery())
+    db.session.execute(Task.__table__.insert().from_select(
+        COPIED_COLUMNS + ['start_date', 'expected_completion_date', 'is_completed',
+                          'project_id', 'blocked_count', 'cloned_from_id'],
+        select(*[getattr(Task, column) for column in COPIED_COLUMNS],
+               _shifted(Task.start_date, shift_days),
+               _shifted(Task.expected_completion_date, shift_days),
+               db.false(), db.literal(project.id), prerequisites, Task.id)
+        .where(Task.project_id == source.id)
+        .order_by(Task.id)
+    ))
+
+    source_task = aliased(Task)
+    db.session.execute(task_dependencies.insert().from_select(
+        ['task_id', 'depends_on_id'],
+        select(_copy_of(task_dependencies.c.task_id, project.id),
+               _copy_of(task_dependencies.c.depends_on_id, project.id))
+        .select_from(task_dependencies)
+        .join(source_task, source_task.id == task_dependencies.c.task_id)
+        .where(source_task.project_id == source.id)
+    ))
+
+    if closure.is_enabled():
+        # Same graph shape, so the source's closure rows (and path counts) carry over
+        db.session.execute(TaskClosure.__table__.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'project_id', 'path_count'],
+            select(_copy_of(TaskClosure.ancestor_id, project.id),
+                   _copy_of(TaskClosure.descendant_id, project.id),
+                   db.literal(project.id), TaskClosure.path_count)
+            .where(TaskClosure.project_id == source.id)
+        ))
+
+    audit.record('clone', project.id, details={'from_project_id': source.id, 'shift_days': shift_days,
+                                               'as_template': as_template}, user_id=user_id)
+    refresh_project(project.id, user_id)
+    invalidate_project(project.id, user_id)
+    return project
+
+
+def register_clone_routes(app):
+    """Register project clone / template routes with the Flask app"""
+
+    @app.route('/projects/<int:project_id>/clone', methods=['GET', 'POST'])
+    @login_required
+    def clone_project_view(project_id):
+        """Copy a project, or start a new project from a template"""
+        with timed('ownership'):
+            source = Project.query.get_or_404(project_id)
+        if source.is_deleting:
+            abort(404)
+        if source.user_id != current_user.id:
+            flash('You do not have permission to copy this project', 'error')
+            return redirect(url_for('dashboard'))
+
+        if request.method == 'POST':
+            name = request.form.get('name', '').strip()
+            start_date_str = request.form.get('start_date', '').strip()
+            shift_days = request.form.get('shift_days', 0, type=int)
+            as_template = request.form.get('as_template') == 'on'
+
+            errors = []
+            if not name or len(name) < 3:
+                errors.append('Project name must be at least 3 characters long')
+            if start_date_str:
+                try:
+                    shift_days = template_offset(source, datetime.strptime(start_date_str, '%Y-%m-%d').date())
+                except ValueError:
+                    errors.append('Invalid start date format')
+            if abs(shift_days) > MAX_SHIFT_DAYS:
+                errors.append(f'Dates can be moved by at most {MAX_SHIFT_DAYS} days')
+
+            if errors:
+                for error in errors:
+                    flash(error, 'error')
+                return render_template('clone_project.html', project=source)
+
+            project = clone_project(source, name, current_user.id, shift_days, as_template)
+            db.session.commit()
+
+            flash(f'{"Template" if as_template else "Project"} "{project.name}" created from "{source.name}"', 'success')
+            return redirect(url_for('view_project', project_id=project.id))
+
+        return render_template('clone_project.html', project=source)
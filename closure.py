@@ -0,0 +1,216 @@
+from collections import Counter, defaultdict, deque
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam
+from models import db, Task, TaskClosure, task_dependencies
+
+closure_table = TaskClosure.__table__
+
+INSERT_CHUNK_SIZE = 5000
+
+# Path counts multiply through diamonds, so they can outgrow a BIGINT on a
+# dense enough graph. They saturate here instead: a stored PATH_COUNT_CAP
+# means "at least this many", and removing an edge through such a pair
+# rebuilds the project rather than subtracting from an unknown count.
+PATH_COUNT_CAP = 2 ** 63 - 1
+
+
+def is_enabled():
+    """The closure table is optional; when off, graph questions fall back to walking edges"""
+    return current_app.config.get('TASK_CLOSURE_ENABLED', False)
+
+
+def _edge_delta(task_id, depends_on_id):
+    """Path-count change for every (ancestor, descendant) pair touched by one edge
+
+    Everything upstream of depends_on_id (and itself) becomes upstream of
+    everything downstream of task_id (and itself).
+    """
+    ancestors = {depends_on_id: 1}
+    ancestors.update(
+        db.session.query(TaskClosure.ancestor_id, TaskClosure.path_count)
+        .filter(TaskClosure.descendant_id == depends_on_id)
+    )
+    descendants = {task_id: 1}
+    descendants.update(
+        db.session.query(TaskClosure.descendant_id, TaskClosure.path_count)
+        .filter(TaskClosure.ancestor_id == task_id)
+    )
+
+    existing = {
+        (row.ancestor_id, row.descendant_id): row.path_count for row in
+        db.session.query(TaskClosure.ancestor_id, TaskClosure.descendant_id, TaskClosure.path_count)
+        .filter(TaskClosure.ancestor_id.in_(ancestors.keys()),
+                TaskClosure.descendant_id.in_(descendants.keys()))
+    }
+    delta = {
+        (ancestor_id, descendant_id): ancestor_paths * descendant_paths
+        for ancestor_id, ancestor_paths in ancestors.items()
+        for descendant_id, descendant_paths in descendants.items()
+    }
+    return delta, existing
+
+
+def _write_counts(project_id, counts, existing):
+    """Persist new path counts, inserting, updating or deleting rows as needed"""
+    inserts, updates, deletes = [], [], []
+    for (ancestor_id, descendant_id), count in counts.items():
+        row = {'a': ancestor_id, 'd': descendant_id, 'count': count}
+        if (ancestor_id, descendant_id) not in existing:
+            inserts.append({'ancestor_id': ancestor_id, 'descendant_id': descendant_id,
+                            'project_id': project_id, 'path_count': count})
+        elif count > 0:
+            updates.append(row)
+        else:
+            deletes.append(row)
+
+    match = (closure_table.c.ancestor_id == bindparam('a')) & \
+            (closure_table.c.descendant_id == bindparam('d'))
+    if inserts:
+        db.session.execute(closure_table.insert(), inserts)
+    if updates:
+        db.session.execute(closure_table.update().where(match).values(path_count=bindparam('count')), updates)
+    if deletes:
+        db.session.execute(closure_table.delete().where(match), deletes)
+
+
+def add_edge(project_id, task_id, depends_on_id):
+    """Update the closure for a new edge task_id -> depends_on_id"""
+    delta, existing = _edge_delta(task_id, depends_on_id)
+    counts = {pair: min(existing.get(pair, 0) + paths, PATH_COUNT_CAP) for pair, paths in delta.items()}
+    _write_counts(project_id, counts, existing)
+
+
+def remove_edges(project_id, edges):
+    """Update the closure for removed edges [(task_id, depends_on_id), ...]
+
+    Call after the edges are gone from task_dependencies: if a saturated path
+    count is involved, the project is rebuilt from what is left.
+    """
+    for task_id, depends_on_id in edges:
+        delta, existing = _edge_delta(task_id, depends_on_id)
+        if any(paths >= PATH_COUNT_CAP or existing.get(pair, 0) >= PATH_COUNT_CAP
+               for pair, paths in delta.items()):
+            rebuild(project_id)
+            return
+        counts = {pair: existing[pair] - paths for pair, paths in delta.items() if pair in existing}
+        _write_counts(project_id, counts, existing)
+
+
+def descendants_among(ancestor_id, candidate_ids):
+    """Which of candidate_ids depend on ancestor_id (single indexed lookup)"""
+    return {
+        row.descendant_id for row in
+        db.session.query(TaskClosure.descendant_id)
+        .filter(TaskClosure.ancestor_id == ancestor_id,
+                TaskClosure.descendant_id.in_(candidate_ids))
+    }
+
+
+def ancestor_ids(task_id):
+    """Every task that must be completed before task_id"""
+    return {row.ancestor_id for row in
+            db.session.query(TaskClosure.ancestor_id).filter(TaskClosure.descendant_id == task_id)}
+
+
+def descendant_ids(task_id):
+    """Every task that is waiting, directly or indirectly, on task_id"""
+    return {row.descendant_id for row in
+            db.session.query(TaskClosure.descendant_id).filter(TaskClosure.ancestor_id == task_id)}
+
+
+def compute_project_closure(project_id):
+    """Compute {(ancestor, descendant): path_count} for a project from its edges"""
+    edges = (
+        db.session.query(task_dependencies.c.task_id, task_dependencies.c.depends_on_id)
+        .join(Task, Task.id == task_dependencies.c.task_id)
+        .filter(Task.project_id == project_id)
+        .all()
+    )
+    prerequisites = defaultdict(list)
+    dependents = defaultdict(list)
+    for task_id, depends_on_id in edges:
+        prerequisites[task_id].append(depends_on_id)
+        dependents[depends_on_id].append(task_id)
+
+    # Kahn's algorithm, so each task is visited after all of its prerequisites
+    waiting = {task_id: len(deps) for task_id, deps in prerequisites.items()}
+    ready = deque(task_id for task_id in dependents if task_id not in waiting)
+    ancestors = defaultdict(Counter)
+    closure = {}
+
+    while ready:
+        current = ready.popleft()
+        for ancestor_id, paths in ancestors[current].items():
+            closure[(ancestor_id, current)] = min(paths, PATH_COUNT_CAP)
+        for dependent_id in dependents.get(current, ()):
+            counter = ancestors[dependent_id]
+            counter[current] += 1
+            for ancestor_id, paths in ancestors[current].items():
+                counter[ancestor_id] += paths
+            waiting[dependent_id] -= 1
+            if waiting[dependent_id] == 0:
+                ready.append(dependent_id)
+        del ancestors[current]
+
+    return closure
+
+
+def rebuild(project_id):
+    """Replace a project's closure rows with ones computed in bulk from task_dependencies"""
+    closure = compute_project_closure(project_id)
+    db.session.execute(closure_table.delete().where(closure_table.c.project_id == project_id))
+
+    rows = [{'ancestor_id': ancestor_id, 'descendant_id': descendant_id,
+             'project_id': project_id, 'path_count': paths}
+            for (ancestor_id, descendant_id), paths in closure.items()]
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.session.execute(closure_table.insert(), rows[start:start + INSERT_CHUNK_SIZE])
+    return len(rows)
+
+
+def check(project_id):
+    """Number of closure rows that differ from a fresh computation"""
+    expected = compute_project_closure(project_id)
+    stored = {
+        (row.ancestor_id, row.descendant_id): row.path_count for row in
+        db.session.query(TaskClosure.ancestor_id, TaskClosure.descendant_id, TaskClosure.path_count)
+        .filter(TaskClosure.project_id == project_id)
+    }
+    return sum(1 for pair in expected.keys() | stored.keys() if expected.get(pair) != stored.get(pair))
+
+
+def _project_ids(project_id):
+    if project_id is not None:
+        return [project_id]
+    return [row.project_id for row in db.session.query(Task.project_id).distinct()]
+
+
+def register_closure_commands(app):
+    """Register `flask closure ...` CLI commands with the Flask app"""
+    closure_cli = AppGroup('closure', help='Task dependency closure table commands')
+
+    @closure_cli.command('rebuild')
+    @click.option('--project-id', type=int, default=None, help='Only rebuild this project')
+    def rebuild_command(project_id):
+        """Rebuild closure rows from task_dependencies"""
+        for pid in _project_ids(project_id):
+            count = rebuild(pid)
+            db.session.commit()
+            click.echo(f'project {pid}: {count} closure row(s)')
+
+    @closure_cli.command('check')
+    @click.option('--project-id', type=int, default=None, help='Only check this project')
+    def check_command(project_id):
+        """Report projects whose closure rows are out of date"""
+        bad = 0
+        for pid in _project_ids(project_id):
+            mismatches = check(pid)
+            if mismatches:
+                bad += 1
+                click.echo(f'project {pid}: {mismatches} mismatched row(s)')
+        click.echo('closure OK' if not bad else f'{bad} project(s) need a rebuild')
+
+    app.cli.add_command(closure_cli)
@@ -0,0 +1,25 @@
+from flask import request, jsonify, flash, redirect
+from models import db
+
+
+def submitted_version():
+    """The version the client last saw (hidden form field or JSON body), if it sent one"""
+    if request.is_json:
+        version = (request.get_json(silent=True) or {}).get('version')
+        return version if isinstance(version, int) else None
+    return request.form.get('version', type=int)
+
+
+def conflict_response(record, message, location):
+    """Undo the request's writes and tell the client to re-fetch
+
+    API clients get 409 with the current version; browsers get the message
+    flashed and a redirect to a freshly loaded page.
+    """
+    model, record_id = type(record), record.id
+    db.session.rollback()
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        current = db.session.query(model.version).filter(model.id == record_id).scalar()
+        return jsonify({'error': 'conflict', 'message': message, 'version': current}), 409
+    flash(message, 'error')
+    return redirect(location, code=303)
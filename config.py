@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,3 +12,79 @@ class Config:
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SCHEMA_CHECK_ON_STARTUP = os.getenv('SCHEMA_CHECK_ON_STARTUP', 'True').lower() == 'true'
+
+    # Keep the task_closure table in sync (run `flask closure rebuild` before enabling)
+    TASK_CLOSURE_ENABLED = os.getenv('TASK_CLOSURE_ENABLED', 'False').lower() == 'true'
+
+    # Background job queue
+    JOB_WORKER_THREADS = int(os.getenv('JOB_WORKER_THREADS', '2'))
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+    JOB_RETRY_BACKOFF = int(os.getenv('JOB_RETRY_BACKOFF', '10'))  # seconds, doubled per attempt
+    JOB_LOCK_TIMEOUT = int(os.getenv('JOB_LOCK_TIMEOUT', '900'))  # seconds without a heartbeat, then presumed dead
+    PROJECT_DELETE_CHUNK_SIZE = int(os.getenv('PROJECT_DELETE_CHUNK_SIZE', '1000'))
+    JOBS_RUN_INLINE = os.getenv('JOBS_RUN_INLINE', 'False').lower() == 'true'
+
+    # Completed task archive (`flask archive run`)
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+
+    # Read cache: "shared" (per-worker LRU + a SQLite file shared by the node's workers), "local" or "null"
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'shared')
+    CACHE_TTL = int(os.getenv('CACHE_TTL', '300'))  # seconds; writes invalidate sooner
+    CACHE_LOCAL_MAX_ENTRIES = int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', '1024'))
+    CACHE_SHARED_DIR = os.getenv('CACHE_SHARED_DIR')  # owner-only; defaults to /dev/shm/taskapp-cache-<uid>
+    CACHE_SHARED_MAX_ENTRIES = int(os.getenv('CACHE_SHARED_MAX_ENTRIES', '20000'))
+
+    # Request profiler (off when both are 0); profiles are listed at /admin/profiles
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # fraction run under cProfile
+    PROFILE_SLOW_MS = int(os.getenv('PROFILE_SLOW_MS', '0'))  # keep stack samples of slower requests
+    PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'taskapp-profiles'))
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+
+    # Per-request timing: Server-Timing header and a JSON line per request (stderr unless a path is set)
+    SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', 'True').lower() == 'true'
+    TIMING_LOG_ENABLED = os.getenv('TIMING_LOG_ENABLED', 'True').lower() == 'true'
+    TIMING_LOG_PATH = os.getenv('TIMING_LOG_PATH', '')
+    TIMING_LOG_BUFFER = int(os.getenv('TIMING_LOG_BUFFER', '10000'))  # lines queued before new ones are dropped
+
+    # Audit log: events are queued in-process and written in batches by a background thread.
+    # Notifications, reminders for changed due dates and activity metrics are read from it, so
+    # turning it off or dropping overflow loses those too
+    AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', 'True').lower() == 'true'
+    AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0'))  # seconds a partial batch waits
+    AUDIT_OVERFLOW = os.getenv('AUDIT_OVERFLOW', 'spill')  # full queue or failed write: 'spill' to a file or 'drop'
+    AUDIT_SPILL_PATH = os.getenv('AUDIT_SPILL_PATH', os.path.join(tempfile.gettempdir(), 'taskapp-audit-spill.jsonl'))
+    AUDIT_WRITE_INLINE = os.getenv('AUDIT_WRITE_INLINE', 'False').lower() == 'true'  # flush at the end of each request (tests)
+    # Readers of audit_event trail the newest writes by this many seconds; keep it above the
+    # longest audit insert transaction plus clock skew between nodes
+    AUDIT_SETTLE_SECONDS = float(os.getenv('AUDIT_SETTLE_SECONDS', '30'))
+
+    # Outbound change notifications, read from the audit log and delivered as jobs
+    NOTIFY_COALESCE_SECONDS = float(os.getenv('NOTIFY_COALESCE_SECONDS', '5'))  # events this recent wait to be merged
+    NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '100'))  # events per delivery request
+    NOTIFY_TIMEOUT = float(os.getenv('NOTIFY_TIMEOUT', '5'))  # seconds per delivery request
+    NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '8'))  # retries back off via JOB_RETRY_BACKOFF
+    # Allow receivers on private, loopback and link-local addresses (internal networks only)
+    NOTIFY_ALLOW_PRIVATE_URLS = os.getenv('NOTIFY_ALLOW_PRIVATE_URLS', 'False').lower() == 'true'
+
+    # Due-soon reminders, sent as task.due_soon / project.due_soon notifications
+    REMINDER_LEAD_HOURS = float(os.getenv('REMINDER_LEAD_HOURS', '24'))  # how long before the due date
+
+    # Periodic work: one leader per job across all workers and nodes (see leader.py)
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'True').lower() == 'true'  # gunicorn workers compete to lead
+    LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', '30'))  # a silent leader is replaced after this
+    LEADER_HEARTBEAT_SECONDS = float(os.getenv('LEADER_HEARTBEAT_SECONDS', '10'))  # renew / try to take over
+    # Seconds between runs of each periodic job; 0 turns one off
+    NOTIFY_DISPATCH_INTERVAL = float(os.getenv('NOTIFY_DISPATCH_INTERVAL', '10'))
+    REMINDER_SCAN_INTERVAL = float(os.getenv('REMINDER_SCAN_INTERVAL', '60'))
+    STATS_REFRESH_INTERVAL = float(os.getenv('STATS_REFRESH_INTERVAL', '3600'))
+    ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', '86400'))
+    METRICS_SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '60'))
+
+    # With PROMETHEUS_MULTIPROC_DIR set, how often each worker copies its own collectors for /metrics
+    METRICS_PUBLISH_INTERVAL = float(os.getenv('METRICS_PUBLISH_INTERVAL', '5'))
@@ -0,0 +1,150 @@
+"""Due-soon and overdue items across all of a user's projects
+
+Open tasks (by expected_completion_date) and project deadlines are listed
+in one timeline ordered by (due, kind, id). Each source is read with a
+single range query joined through Project.user_id and served by an index
+that starts with the join key and continues with the due date
+(ix_task_open_due, ix_project_user_deadline). Pages are keyset-paginated:
+the cursor is the last row's sort key, so page 50 costs the same as page 1.
+Templates are not live work and are left out.
+"""
+import base64
+import heapq
+from datetime import datetime, timedelta
+
+from flask import render_template, request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import and_, or_
+from models import db, Project, Task
+
+DEFAULT_WITHIN_DAYS = 7
+MAX_WITHIN_DAYS = 365
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+KINDS = ('project', 'task')  # tie-break order for rows due at the same moment
+
+
+class CursorError(ValueError):
+    """The pagination cursor could not be decoded"""
+
+
+def encode_cursor(due, kind, item_id):
+    return base64.urlsafe_b64encode(f'{due.isoformat()}|{kind}|{item_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        due, kind, item_id = raw.split('|')
+        if kind not in KINDS:
+            raise ValueError(kind)
+        return datetime.fromisoformat(due), kind, int(item_id)
+    except (ValueError, UnicodeDecodeError) as error:
+        raise CursorError('Invalid cursor') from error
+
+
+def _after(due_column, id_column, kind, cursor):
+    """Keyset condition: rows of this kind sorting after the cursor's (due, kind, id)"""
+    if cursor is None:
+        return None
+    cursor_due, cursor_kind, cursor_id = cursor
+    if KINDS.index(kind) > KINDS.index(cursor_kind):
+        return due_column >= cursor_due
+    if kind == cursor_kind:
+        return or_(due_column > cursor_due, and_(due_column == cursor_due, id_column > cursor_id))
+    return due_column > cursor_due
+
+
+def _task_rows(user_id, start, end, cursor, limit):
+    due = Task.expected_completion_date
+    query = (
+        db.session.query(due.label('due'), Task.id, Task.title, Task.importance,
+                         Task.project_id, Project.name.label('project_name'))
+        .join(Project, Project.id == Task.project_id)
+        .filter(Project.user_id == user_id,
+                Project.is_deleting.is_(False),
+                Project.is_template.is_(False),
+                # Written like the index predicate, so the partial index qualifies
+                Task.is_completed == db.false(),
+                due < end)
+    )
+    if start is not None:
+        query = query.filter(due >= start)
+    after = _after(due, Task.id, 'task', cursor)
+    if after is not None:
+        query = query.filter(after)
+    return [{'kind': 'task', **row._asdict()} for row in query.order_by(due, Task.id).limit(limit)]
+
+
+def _project_rows(user_id, start, end, cursor, limit):
+    due = Project.deadline
+    query = (
+        db.session.query(due.label('due'), Project.id, Project.name.label('title'),
+                         Project.id.label('project_id'), Project.name.label('project_name'))
+        .filter(Project.user_id == user_id,
+                Project.is_deleting.is_(False),
+                Project.is_template.is_(False),
+                due < end)
+    )
+    if start is not None:
+        query = query.filter(due >= start)
+    after = _after(due, Project.id, 'project', cursor)
+    if after is not None:
+        query = query.filter(after)
+    return [{'kind': 'project', 'importance': None, **row._asdict()}
+            for row in query.order_by(due, Project.id).limit(limit)]
+
+
+def upcoming(user_id, within_days=DEFAULT_WITHIN_DAYS, include_overdue=True, cursor=None,
+             limit=PAGE_SIZE, now=None):
+    """One page of the user's deadlines up to now + within_days; returns (items, next_cursor)"""
+    now = now or datetime.utcnow()
+    end = now + timedelta(days=within_days)
+    start = None if include_overdue else now
+
+    # Each source returns at most limit + 1 rows already in order; merging them
+    # and keeping limit + 1 tells us whether another page exists
+    sources = [_project_rows(user_id, start, end, cursor, limit + 1),
+               _task_rows(user_id, start, end, cursor, limit + 1)]
+    merged = list(heapq.merge(*sources, key=lambda item: (item['due'], KINDS.index(item['kind']), item['id'])))
+    page = merged[:limit]
+    for item in page:
+        item['overdue'] = item['due'] < now
+    next_cursor = None
+    if len(merged) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last['due'], last['kind'], last['id'])
+    return page, next_cursor
+
+
+def _serialize(item):
+    return {**item, 'due': item['due'].isoformat()}
+
+
+def register_deadline_routes(app):
+    """Register the due-soon / overdue view with the Flask app"""
+
+    @app.route('/deadlines')
+    @login_required
+    def deadlines():
+        """Open tasks and project deadlines due within ?within= days, overdue first"""
+        within_days = max(1, min(request.args.get('within', DEFAULT_WITHIN_DAYS, type=int), MAX_WITHIN_DAYS))
+        limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+        include_overdue = request.args.get('overdue', '1') != '0'
+        wants_json = request.accept_mimetypes.best == 'application/json'
+
+        cursor = request.args.get('after')
+        try:
+            cursor = decode_cursor(cursor) if cursor else None
+        except CursorError as error:
+            if wants_json:
+                return jsonify({'error': str(error)}), 400
+            return render_template('deadlines.html', items=[], next_cursor=None, within=within_days,
+                                   include_overdue=include_overdue, error=str(error)), 400
+
+        items, next_cursor = upcoming(current_user.id, within_days, include_overdue, cursor, limit)
+        if wants_json:
+            return jsonify({'items': [_serialize(item) for item in items], 'next': next_cursor})
+        return render_template('deadlines.html', items=items, next_cursor=next_cursor,
+                               within=within_days, include_overdue=include_overdue, error=None)
@@ -0,0 +1,236 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import and_, func, select
+from models import db, Task, TaskClosure, task_dependencies
+import closure
+
+
+def load_dependents_graph(project_id):
+    """Map each task in a project to the IDs of tasks that directly depend on it (one query)"""
+    rows = (
+        db.session.query(task_dependencies.c.task_id, task_dependencies.c.depends_on_id)
+        .join(Task, Task.id == task_dependencies.c.task_id)
+        .filter(Task.project_id == project_id)
+        .all()
+    )
+    dependents = defaultdict(set)
+    for task_id, depends_on_id in rows:
+        dependents[depends_on_id].add(task_id)
+    return dependents
+
+
+def load_prerequisites_graph(project_id):
+    """Map each task in a project to the IDs of the tasks it directly depends on (one query)"""
+    prerequisites = defaultdict(set)
+    for dependent_id, dependency_ids in load_dependents_graph(project_id).items():
+        for task_id in dependency_ids:
+            prerequisites[task_id].add(dependent_id)
+    return prerequisites
+
+
+def _walk(graph, start_id):
+    found = set()
+    stack = [start_id]
+    while stack:
+        for next_id in graph.get(stack.pop(), ()):
+            if next_id not in found:
+                found.add(next_id)
+                stack.append(next_id)
+    return found
+
+
+def find_dependents(project_id, task_id):
+    """IDs of every task that depends on task_id, directly or indirectly"""
+    if closure.is_enabled():
+        return closure.descendant_ids(task_id)
+    return _walk(load_dependents_graph(project_id), task_id)
+
+
+def find_prerequisites(project_id, task_id):
+    """IDs of every task that task_id depends on, directly or indirectly"""
+    if closure.is_enabled():
+        return closure.ancestor_ids(task_id)
+    return _walk(load_prerequisites_graph(project_id), task_id)
+
+
+def validate_dependency_ids(project_id, raw_ids, task_id=None):
+    """Validate submitted dependency IDs with a single IN query
+
+    Returns (dependencies, errors) where dependencies maps task ID to Task.
+    When task_id is given (editing an existing task) self-dependencies and
+    dependencies that would create a cycle are rejected as well.
+    """
+    errors = []
+    wanted = []
+    for raw_id in raw_ids:
+        try:
+            dep_id = int(raw_id)
+        except (TypeError, ValueError):
+            errors.append(f'Invalid dependency task ID: {raw_id}')
+            continue
+        if task_id is not None and dep_id == task_id:
+            errors.append('Task cannot depend on itself')
+            continue
+        if dep_id not in wanted:
+            wanted.append(dep_id)
+
+    if not wanted:
+        return {}, errors
+
+    found = {
+        dep_task.id: dep_task
+        for dep_task in Task.query.filter(Task.id.in_(wanted), Task.project_id == project_id)
+    }
+
+    # Anything that already depends on this task would close a loop
+    if task_id is None:
+        blocked = set()
+    elif closure.is_enabled():
+        blocked = closure.descendants_among(task_id, wanted)
+    else:
+        blocked = find_dependents(project_id, task_id)
+
+    dependencies = {}
+    for dep_id in wanted:
+        dep_task = found.get(dep_id)
+        if dep_task is None:
+            errors.append(f'Invalid dependency task ID: {dep_id}')
+        elif dep_id in blocked:
+            errors.append(f'Cannot add dependency on "{dep_task.title}" - would create circular dependency')
+        else:
+            dependencies[dep_id] = dep_task
+
+    return dependencies, errors
+
+
+CANDIDATE_LIMIT = 20
+MAX_CANDIDATE_LIMIT = 50
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _title_starts_with(prefix):
+    """Case-insensitive prefix match on Task.title that the title index can serve"""
+    lowered = func.lower(Task.title)
+    matches = lowered.like(func.lower(_escape_like(prefix)) + '%', escape='\\')
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite only uses an index for LIKE when it is case sensitive; a range
+        # on the same expression narrows the scan and LIKE checks the rest
+        return and_(lowered >= func.lower(prefix), lowered < func.lower(prefix) + '\U0010ffff', matches)
+    return matches
+
+
+def dependency_candidates(project_id, prefix='', task_id=None, limit=CANDIDATE_LIMIT):
+    """Tasks in the project whose title starts with prefix and that task_id may depend on
+
+    For an existing task, the task itself and everything that already
+    depends on it are left out, since picking them would close a cycle.
+    """
+    query = db.session.query(Task.id, Task.title, Task.is_completed).filter(Task.project_id == project_id)
+    if prefix:
+        query = query.filter(_title_starts_with(prefix))
+    if task_id is not None:
+        query = query.filter(Task.id != task_id)
+        if closure.is_enabled():
+            would_cycle = (select(TaskClosure.descendant_id)
+                           .where(TaskClosure.ancestor_id == task_id,
+                                  TaskClosure.descendant_id == Task.id))
+            query = query.filter(~would_cycle.exists())
+        else:
+            dependents = find_dependents(project_id, task_id)
+            if dependents:
+                query = query.filter(Task.id.notin_(dependents))
+    rows = query.order_by(func.lower(Task.title), Task.id).limit(limit)
+    return [{'id': row.id, 'title': row.title, 'is_completed': row.is_completed} for row in rows]
+
+
+def current_dependency_ids(task_id):
+    """IDs of the tasks task_id directly depends on"""
+    return {
+        row.depends_on_id for row in
+        db.session.query(task_dependencies.c.depends_on_id)
+        .filter(task_dependencies.c.task_id == task_id)
+    }
+
+
+def _count_incomplete(task_ids):
+    return (db.session.query(func.count(Task.id))
+            .filter(Task.id.in_(task_ids), Task.is_completed.is_(False))
+            .scalar())
+
+
+def _adjust_blocked_count(task_id, delta):
+    if delta:
+        Task.query.filter_by(id=task_id).update(
+            {'blocked_count': Task.blocked_count + delta}, synchronize_session=False)
+
+
+def add_dependencies(project_id, task_id, dependency_ids):
+    """Insert task_dependencies rows for new edges task_id -> dependency_ids"""
+    if not dependency_ids:
+        return
+    db.session.execute(task_dependencies.insert(), [
+        {'task_id': task_id, 'depends_on_id': dep_id} for dep_id in dependency_ids
+    ])
+    _adjust_blocked_count(task_id, _count_incomplete(dependency_ids))
+    if closure.is_enabled():
+        for dep_id in dependency_ids:
+            closure.add_edge(project_id, task_id, dep_id)
+
+
+def remove_dependencies(project_id, task_id, dependency_ids):
+    """Delete task_dependencies rows for edges task_id -> dependency_ids"""
+    if not dependency_ids:
+        return
+    _adjust_blocked_count(task_id, -_count_incomplete(dependency_ids))
+    db.session.execute(task_dependencies.delete().where(
+        task_dependencies.c.task_id == task_id,
+        task_dependencies.c.depends_on_id.in_(dependency_ids)
+    ))
+    if closure.is_enabled():
+        closure.remove_edges(project_id, [(task_id, dep_id) for dep_id in dependency_ids])
+
+
+def sync_dependencies(project_id, task_id, dependency_ids):
+    """Make task_id depend on exactly dependency_ids, writing only the changed rows
+
+    Returns (added, removed) sets of dependency IDs.
+    """
+    current = current_dependency_ids(task_id)
+    wanted = set(dependency_ids)
+    added = wanted - current
+    removed = current - wanted
+
+    remove_dependencies(project_id, task_id, removed)
+    add_dependencies(project_id, task_id, added)
+    return added, removed
+
+
+def set_completion(task, completed):
+    """Complete or re-open a task and keep its dependents' blocked_count in step"""
+    if task.is_completed == completed:
+        return
+    task.is_completed = completed
+    task.completed_at = datetime.utcnow() if completed else None
+
+    dependent_ids = select(task_dependencies.c.task_id).where(task_dependencies.c.depends_on_id == task.id)
+    Task.query.filter(Task.id.in_(dependent_ids)).update(
+        {'blocked_count': Task.blocked_count + (-1 if completed else 1)}, synchronize_session=False)
+
+
+def repair_blocked_counts(project_id=None):
+    """Recompute blocked_count for every task in one set-based UPDATE; returns rows changed"""
+    prerequisite = db.aliased(Task)
+    actual = (
+        select(func.count())
+        .select_from(task_dependencies)
+        .join(prerequisite, prerequisite.id == task_dependencies.c.depends_on_id)
+        .where(task_dependencies.c.task_id == Task.id, prerequisite.is_completed.is_(False))
+        .scalar_subquery()
+    )
+    query = Task.query.filter(Task.blocked_count != actual)
+    if project_id is not None:
+        query = query.filter(Task.project_id == project_id)
+    return query.update({'blocked_count': actual}, synchronize_session=False)
@@ -4,6 +4,7 @@ set -e
 APP_NAME="taskapp"
 APP_DIR="/opt/taskapp"
 CONTAINER_NAME="${APP_NAME}_production"
+WORKER_NAME="${APP_NAME}_worker"
 IMAGE_TAG="${1:-latest}"
 APP_PORT="8000"
 
@@ -18,6 +19,7 @@ fi
 
 echo "Image: ${IMAGE_TAG}"
 echo "Container: ${CONTAINER_NAME}"
+echo "Worker: ${WORKER_NAME}"
 echo ""
 
 cd $APP_DIR
@@ -28,9 +30,15 @@ if [ ! -f ".env" ]; then
     exit 1
 fi
 
-echo "Stopping existing container..."
-docker stop $CONTAINER_NAME 2>/dev/null || true
-docker rm $CONTAINER_NAME 2>/dev/null || true
+echo "Applying database schema upgrades..."
+docker run --rm \
+    --env-file $APP_DIR/.env \
+    $IMAGE_TAG \
+    flask --app run db upgrade
+
+echo "Stopping existing containers..."
+docker stop $CONTAINER_NAME $WORKER_NAME 2>/dev/null || true
+docker rm $CONTAINER_NAME $WORKER_NAME 2>/dev/null || true
 
 echo "Starting new container..."
 docker run -d \
@@ -40,9 +48,23 @@ docker run -d \
     --env-file $APP_DIR/.env \
     $IMAGE_TAG
 
+# Background jobs (project deletes, webhook deliveries) only run in a worker
+echo "Starting job worker..."
+docker run -d \
+    --name $WORKER_NAME \
+    --restart unless-stopped \
+    --env-file $APP_DIR/.env \
+    $IMAGE_TAG \
+    flask --app run jobs worker
+
 sleep 5
 
 echo "Checking container status..."
+if ! docker ps | grep -q $WORKER_NAME; then
+    echo "ERROR: Job worker failed to start"
+    echo "Check logs with: docker logs $WORKER_NAME"
+    exit 1
+fi
 if docker ps | grep -q $CONTAINER_NAME; then
     echo "Container is running!"
 
@@ -63,6 +85,7 @@ if docker ps | grep -q $CONTAINER_NAME; then
     echo "Port: $APP_PORT"
     echo ""
     echo "View logs: docker logs -f $CONTAINER_NAME"
+    echo "Worker logs: docker logs -f $WORKER_NAME"
     echo "Stop app: docker stop $CONTAINER_NAME"
     echo "Restart app: docker restart $CONTAINER_NAME"
 else
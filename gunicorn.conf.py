@@ -0,0 +1,134 @@
+"""Gunicorn settings for production.
+
+Start with:  gunicorn -c gunicorn.conf.py run:app
+
+Workers and threads are sized from the CPUs and memory available to the
+container. The app is loaded once in the master and the heap is frozen
+before forking, so workers share those pages copy-on-write. Each worker
+drops the database pool it inherited and is recycled after a jittered
+number of requests to bound memory growth.
+
+Every setting can be overridden with the GUNICORN_* variables read below.
+"""
+import gc
+import math
+import os
+import shutil
+import tempfile
+
+
+def _cpu_count():
+    """CPUs this process may use, honouring cgroup v2 quotas and CPU affinity"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _memory_bytes():
+    """Memory limit of the container, falling back to the host's available memory"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value != 'max' and int(value) < 1 << 60:
+                return int(value)
+        except (OSError, ValueError):
+            pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def size_pool(cpus, memory_bytes, worker_memory_mb, concurrency_per_cpu):
+    """(workers, threads): 2*CPU+1 processes unless memory allows fewer, then threads make up concurrency"""
+    workers = 2 * cpus + 1
+    if memory_bytes:
+        budget = int(memory_bytes * 0.75) // (worker_memory_mb * 1024 * 1024)
+        workers = max(1, min(workers, budget))
+    threads = max(1, math.ceil(cpus * concurrency_per_cpu / workers))
+    return workers, threads
+
+
+_workers, _threads = size_pool(
+    _cpu_count(),
+    _memory_bytes(),
+    int(os.getenv('GUNICORN_WORKER_MEMORY_MB', '150')),
+    int(os.getenv('GUNICORN_CONCURRENCY_PER_CPU', '4')),
+)
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', _workers))
+threads = int(os.getenv('GUNICORN_THREADS', _threads))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Build the app once in the master; workers inherit it copy-on-write
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Recycle workers to bound memory growth; jitter stops them all restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Worker heartbeat files on tmpfs rather than the container's overlay disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-') or None
+
+# Workers write their metric samples here and /metrics merges them (see metrics.py).
+# Must be set before the app imports prometheus_client; emptied once per master start
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    _metrics_dir = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                'taskapp-metrics')
+    shutil.rmtree(_metrics_dir, ignore_errors=True)
+    os.makedirs(_metrics_dir)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = _metrics_dir
+
+
+def when_ready(server):
+    """Runs in the master after the app is preloaded, just before the first fork"""
+    if preload_app:
+        # Move everything allocated so far out of the collector's reach, so
+        # GC passes in the workers don't touch (and un-share) those pages
+        gc.collect()
+        gc.freeze()
+    server.log.info('Serving with %s worker(s) x %s thread(s)', workers, threads)
+
+
+def post_fork(server, worker):
+    """Drop connections inherited from the master, then start the worker's background threads"""
+    from models import db
+    from leader import start_scheduler
+    from metrics import start_worker_metrics
+
+    app = worker.app.wsgi()
+    if preload_app:
+        # Each worker opens its own connections
+        with app.app_context():
+            db.engine.dispose(close=False)
+    # Every worker on every node competes; one leads each periodic job
+    start_scheduler(app)
+    start_worker_metrics(app)
+
+
+def child_exit(server, worker):
+    """Stop counting a dead worker's live gauges (its counters still add up)"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,16 @@
-from run import app
+import os
+
+# This script creates the schema, so the startup version check would always fail here
+os.environ.setdefault('SCHEMA_CHECK_ON_STARTUP', 'False')
+
+from run import create_app
 from models import db, User, Project, Task
+from schema import upgrade
+from dependencies import add_dependencies
+from cache import get_cache
+
+# Only the database is needed here, not routes or metrics
+app = create_app(web=False)
 
 def init_database():
     """initialise the database with tables"""
@@ -7,7 +18,9 @@ def init_database():
         #BE CAREFUL WITH THIS!!!
         #THIS WILL DROP ALL THE TABLES
         db.drop_all()
-        db.create_all()
+        upgrade()
+        # Cached pages would otherwise outlive the rows they were built from
+        get_cache(app).clear()
         print("database tables created successfully!")
 
 def seed_sample_data():
@@ -54,8 +67,7 @@ def seed_sample_data():
         db.session.commit()
 
         # Add dependency: task3 depends on task1 and task2
-        task3.dependencies.append(task1)
-        task3.dependencies.append(task2)
+        add_dependencies(project.id, task3.id, [task1.id, task2.id])
         db.session.commit()
 
         print(f"sample tasks created with dependencies")
@@ -0,0 +1,382 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, jsonify
+from flask.cli import AppGroup
+from flask_login import login_required, current_user
+from sqlalchemy import func
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+# job type -> JobHandler, filled in by the @job_handler decorator at import time
+_handlers = {}
+
+# serialises "pick an eligible job type and claim a row" between threads of one process
+_claim_lock = threading.Lock()
+
+
+class JobHandler:
+    def __init__(self, job_type, func, concurrency, max_attempts):
+        self.job_type = job_type
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+
+def job_handler(job_type, concurrency=1, max_attempts=None):
+    """Register a function as the handler for a job type
+
+    The payload passed to enqueue() is handed to the function as keyword
+    arguments. At most `concurrency` jobs of this type run at once across
+    all workers sharing the database.
+    """
+    def decorator(func):
+        _handlers[job_type] = JobHandler(job_type, func, concurrency, max_attempts)
+        return func
+    return decorator
+
+
+def get_handler(job_type):
+    return _handlers.get(job_type)
+
+
+def enqueue(job_type, payload=None, user_id=None, run_at=None, max_attempts=None):
+    """Queue a job and commit it, together with any pending changes in the session"""
+    handler = _handlers.get(job_type)
+    if handler is None:
+        raise ValueError(f'Unknown job type: {job_type}')
+
+    job = Job(
+        job_type=job_type,
+        payload=payload or {},
+        user_id=user_id,
+        run_at=run_at or datetime.utcnow(),
+        max_attempts=max_attempts or handler.max_attempts or current_app.config['JOB_MAX_ATTEMPTS']
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    # Inline mode runs the job straight away in this process (tests, single-user dev setups)
+    if current_app.config.get('JOBS_RUN_INLINE'):
+        job_id = job.id
+        if claim_job(job_id, 'inline'):
+            execute_job(job_id)
+        db.session.expire_all()
+
+    return job
+
+
+def enqueue_many(job_type, payloads, run_at=None, max_attempts=None):
+    """Queue several jobs of one type with a single commit (with any pending changes)"""
+    handler = _handlers.get(job_type)
+    if handler is None:
+        raise ValueError(f'Unknown job type: {job_type}')
+
+    jobs = [Job(
+        job_type=job_type,
+        payload=payload,
+        run_at=run_at or datetime.utcnow(),
+        max_attempts=max_attempts or handler.max_attempts or current_app.config['JOB_MAX_ATTEMPTS']
+    ) for payload in payloads]
+    db.session.add_all(jobs)
+    db.session.commit()
+
+    if current_app.config.get('JOBS_RUN_INLINE'):
+        for job_id in [job.id for job in jobs]:
+            if claim_job(job_id, 'inline'):
+                execute_job(job_id)
+        db.session.expire_all()
+
+    return jobs
+
+
+def claim_job(job_id, worker_id):
+    """Atomically move a queued job to running; returns False if another worker won the race"""
+    claimed = Job.query.filter_by(id=job_id, status='queued').update({
+        'status': 'running',
+        'locked_by': worker_id,
+        'locked_at': datetime.utcnow(),
+        'attempts': Job.attempts + 1,
+    }, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def claim_next(worker_id, job_types=None):
+    """Claim the oldest runnable job whose type is below its concurrency limit"""
+    with _claim_lock:
+        running = dict(
+            db.session.query(Job.job_type, func.count(Job.id))
+            .filter(Job.status == 'running')
+            .group_by(Job.job_type)
+            .all()
+        )
+        eligible = [
+            job_type for job_type, handler in _handlers.items()
+            if (not job_types or job_type in job_types)
+            and running.get(job_type, 0) < handler.concurrency
+        ]
+        if not eligible:
+            return None
+
+        candidates = (
+            db.session.query(Job.id, Job.job_type)
+            .filter(Job.status == 'queued',
+                    Job.run_at <= datetime.utcnow(),
+                    Job.job_type.in_(eligible))
+            .order_by(Job.run_at, Job.id)
+            .limit(10)
+            .all()
+        )
+        for job_id, job_type in candidates:
+            if not claim_job(job_id, worker_id):
+                continue
+
+            # Another process may have claimed the same type between our count and our claim
+            now_running = Job.query.filter_by(job_type=job_type, status='running').count()
+            if now_running > _handlers[job_type].concurrency:
+                _release(job_id)
+                continue
+
+            return job_id
+
+    return None
+
+
+def _release(job_id):
+    """Hand a claimed job back to the queue without counting it as an attempt"""
+    Job.query.filter_by(id=job_id, status='running').update({
+        'status': 'queued',
+        'locked_by': None,
+        'locked_at': None,
+        'attempts': Job.attempts - 1,
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+class _Heartbeat:
+    """Refreshes a running job's locked_at from a side thread, so requeue_stale_jobs
+    only takes back jobs whose worker has really gone (a long project delete
+    can outlast JOB_LOCK_TIMEOUT)
+    """
+
+    def __init__(self, job_id, worker_id):
+        self.app = current_app._get_current_object()
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = self.app.config['JOB_LOCK_TIMEOUT'] / 3
+        self.stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f'job-heartbeat-{self.job_id}', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        jobs = Job.__table__
+        while not self.stop_event.wait(self.interval):
+            try:
+                with self.app.app_context(), db.engine.begin() as connection:
+                    connection.execute(jobs.update()
+                                       .where(jobs.c.id == self.job_id, jobs.c.status == 'running',
+                                              jobs.c.locked_by == self.worker_id)
+                                       .values(locked_at=datetime.utcnow()))
+            except Exception:
+                logger.exception('Heartbeat for job %s failed', self.job_id)
+
+
+def execute_job(job_id):
+    """Run a claimed job and record its outcome, scheduling a retry on failure"""
+    job = db.session.get(Job, job_id)
+    handler = _handlers.get(job.job_type)
+
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job type {job.job_type}')
+        with _Heartbeat(job_id, job.locked_by):
+            result = handler.func(**(job.payload or {}))
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=5)
+        logger.warning('Job %s (%s) failed on attempt %s', job_id, job.job_type, job.attempts, exc_info=True)
+
+        job = db.session.get(Job, job_id)
+        job.last_error = error[-4000:]
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            # exponential backoff between attempts
+            delay = current_app.config['JOB_RETRY_BACKOFF'] * (2 ** (job.attempts - 1))
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+        db.session.commit()
+        return False
+
+    job = db.session.get(Job, job_id)
+    job.status = 'succeeded'
+    job.result = result
+    job.finished_at = datetime.utcnow()
+    job.locked_by = None
+    job.locked_at = None
+    db.session.commit()
+    return True
+
+
+def requeue_stale_jobs():
+    """Put jobs back on the queue whose worker died while running them
+
+    A running job's heartbeat keeps locked_at fresh, so a stale lock means the
+    worker is gone. That run counts as an attempt: a job that has used up its
+    attempts (say, one that kills or hangs every worker it runs on) fails.
+    """
+    now = datetime.utcnow()
+    stale = Job.query.filter(Job.status == 'running',
+                             Job.locked_at < now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT']))
+    stale.filter(Job.attempts >= Job.max_attempts).update({
+        'status': 'failed',
+        'locked_by': None,
+        'locked_at': None,
+        'finished_at': now,
+        'last_error': 'Worker stopped responding while running the job',
+    }, synchronize_session=False)
+    count = stale.update({
+        'status': 'queued',
+        'locked_by': None,
+        'locked_at': None,
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def run_pending(job_types=None, worker_id=None):
+    """Run runnable jobs in the current thread until the queue is empty; returns the number run"""
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:once'
+    count = 0
+    while True:
+        job_id = claim_next(worker_id, job_types)
+        if job_id is None:
+            return count
+        execute_job(job_id)
+        count += 1
+
+
+class Worker:
+    """Pool of threads that poll the job table and run jobs"""
+
+    def __init__(self, app, threads=None, poll_interval=None, job_types=None):
+        self.app = app
+        self.threads = threads or app.config['JOB_WORKER_THREADS']
+        self.poll_interval = poll_interval or app.config['JOB_POLL_INTERVAL']
+        self.job_types = job_types or None
+        self.stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._loop, args=(index,),
+                                      name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_forever(self):
+        """Start the pool and block until SIGINT/SIGTERM, letting running jobs finish"""
+        signal.signal(signal.SIGTERM, lambda *_: self.stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop_event.set())
+        self.start()
+        logger.info('Job worker started with %s thread(s)', self.threads)
+        while not self.stop_event.wait(1):
+            pass
+        self.stop()
+
+    def _loop(self, index):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}:{index}'
+        # one thread per process is enough to look after crashed workers
+        reap_every = 60 if index == 0 else None
+        last_reap = 0.0
+
+        while not self.stop_event.is_set():
+            job_id = None
+            try:
+                with self.app.app_context():
+                    now = datetime.utcnow().timestamp()
+                    if reap_every and now - last_reap > reap_every:
+                        requeue_stale_jobs()
+                        last_reap = now
+
+                    job_id = claim_next(worker_id, self.job_types)
+                    if job_id is not None:
+                        execute_job(job_id)
+            except Exception:
+                logger.exception('Job worker %s crashed while polling', worker_id)
+
+            if job_id is None:
+                self.stop_event.wait(self.poll_interval)
+
+
+def register_job_routes(app):
+    """Register job status polling routes with the Flask app"""
+
+    @app.route('/jobs/<int:job_id>')
+    @login_required
+    def job_status(job_id):
+        job = db.session.get(Job, job_id)
+
+        # Users can only poll their own jobs
+        if job is None or job.user_id != current_user.id:
+            return jsonify({'error': 'Job not found'}), 404
+
+        return jsonify(job.to_dict())
+
+
+def register_job_commands(app):
+    """Register `flask jobs ...` CLI commands with the Flask app"""
+    jobs_cli = AppGroup('jobs', help='Background job queue commands')
+
+    @jobs_cli.command('worker')
+    @click.option('--threads', type=int, default=None, help='Number of worker threads')
+    @click.option('--type', 'job_types', multiple=True, help='Only run jobs of these types')
+    def worker_command(threads, job_types):
+        """Run a job worker until interrupted"""
+        Worker(current_app._get_current_object(), threads=threads,
+               job_types=list(job_types)).run_forever()
+
+    @jobs_cli.command('run-pending')
+    @click.option('--type', 'job_types', multiple=True, help='Only run jobs of these types')
+    def run_pending_command(job_types):
+        """Run every runnable job once and exit"""
+        count = run_pending(list(job_types))
+        click.echo(f'{count} job(s) run')
+
+    @jobs_cli.command('show')
+    @click.argument('job_id', type=int)
+    def show_command(job_id):
+        """Show a job's state and the traceback of its last failure"""
+        job = db.session.get(Job, job_id)
+        if job is None:
+            raise click.ClickException(f'Job {job_id} not found')
+        for key, value in job.to_dict().items():
+            click.echo(f'{key:<14} {value}')
+        if job.last_error:
+            click.echo(job.last_error)
+
+    app.cli.add_command(jobs_cli)
@@ -0,0 +1,283 @@
+"""Leader election for singleton background work
+
+Every gunicorn worker on every node starts a Scheduler (see gunicorn.conf.py),
+and for each periodic job they compete for a lease row in leader_lease. The
+holder renews it every LEADER_HEARTBEAT_SECONDS. If the holder stops renewing
+(crashed, hung, lost its database connection) the lease runs out after
+LEADER_LEASE_SECONDS and the next process to try takes it over; a clean
+shutdown releases its leases so failover is immediate. Each change of leader
+bumps the lease's term.
+
+Leases are plain rows updated with conditional UPDATEs, so the same code runs
+on PostgreSQL and on SQLite (where all workers share one database file). They
+compare the processes' own clocks, which NTP keeps far closer together than
+the lease length.
+
+The leader of a job runs it every interval on a thread of its own, so a long
+run doesn't hold up heartbeats. When it last ran is kept in the
+'periodic:<job>' watermark, so a new leader carries on the schedule instead
+of starting over.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import db, LeaderLease, Watermark
+from jobs import get_handler
+
+logger = logging.getLogger('taskapp.leader')
+
+
+def default_holder(suffix=''):
+    return f'{socket.gethostname()}:{os.getpid()}{suffix}'
+
+
+def acquire(name, holder, lease_seconds, now=None):
+    """Take or renew the lease on name; returns the term held, or None if another process leads"""
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(seconds=lease_seconds)
+    lease = LeaderLease.query.filter_by(name=name)
+
+    renewed = lease.filter(LeaderLease.holder == holder, LeaderLease.expires_at > now) \
+        .update({'renewed_at': now, 'expires_at': expires_at}, synchronize_session=False)
+    if not renewed:
+        # Free, released or run out: whoever gets this UPDATE in first leads
+        taken = lease.filter(or_(LeaderLease.holder.is_(None), LeaderLease.expires_at <= now)) \
+            .update({'holder': holder, 'term': LeaderLease.term + 1, 'acquired_at': now,
+                     'renewed_at': now, 'expires_at': expires_at}, synchronize_session=False)
+        if not taken and db.session.get(LeaderLease, name) is None:
+            db.session.add(LeaderLease(name=name, holder=holder, term=1, acquired_at=now,
+                                       renewed_at=now, expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another process created the row first
+        return None
+
+    term, current = db.session.query(LeaderLease.term, LeaderLease.holder).filter_by(name=name).one()
+    return term if current == holder else None
+
+
+def release(name, holder, now=None):
+    """Give up the lease on name if holder has it, so another process can take over at once"""
+    LeaderLease.query.filter_by(name=name, holder=holder) \
+        .update({'holder': None, 'expires_at': now or datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+
+def lease_name(job_type):
+    """Name of a periodic job's lease, and of the watermark recording its last run"""
+    return f'periodic:{job_type}'
+
+
+def periodic_jobs(config):
+    """{job type: seconds between runs} for the periodic jobs that are switched on"""
+    intervals = {
+        'notifications.dispatch': config['NOTIFY_DISPATCH_INTERVAL'],
+        'reminders.scan': config['REMINDER_SCAN_INTERVAL'],
+        'stats.refresh': config['STATS_REFRESH_INTERVAL'],
+        'archive.run': config['ARCHIVE_INTERVAL'],
+        'metrics.snapshot': config['METRICS_SNAPSHOT_INTERVAL'],
+    }
+    return {job_type: interval for job_type, interval in intervals.items() if interval > 0}
+
+
+class Scheduler:
+    """Competes for leadership of each periodic job and runs the ones it leads when due"""
+
+    def __init__(self, app, jobs=None, holder=None):
+        self.app = app
+        self.jobs = jobs if jobs is not None else periodic_jobs(app.config)
+        self.holder = holder or default_holder()
+        self.lease_seconds = app.config['LEADER_LEASE_SECONDS']
+        self.heartbeat = app.config['LEADER_HEARTBEAT_SECONDS']
+        self.terms = {}  # job type -> term while this process leads it
+        self.transitions = {(job_type, change): 0 for job_type in self.jobs for change in ('acquired', 'lost')}
+        self.runs = {job_type: 0 for job_type in self.jobs}
+        self.stop_event = threading.Event()
+        self._running = {}
+        self._thread = None
+
+    def is_leader(self, job_type):
+        return job_type in self.terms
+
+    def tick(self, now=None):
+        """Renew or try for every lease, then start the due jobs this process leads; returns them"""
+        now = now or datetime.utcnow()
+        started = []
+        for job_type, interval in self.jobs.items():
+            try:
+                term = acquire(lease_name(job_type), self.holder, self.lease_seconds, now)
+            except Exception:
+                db.session.rollback()
+                logger.exception('Leader check for %s failed', job_type)
+                term = None  # can't prove we still lead, so stop acting as leader
+            self._note(job_type, term)
+            if term is not None and self._due(job_type, interval, now):
+                self._start(job_type)
+                started.append(job_type)
+        return started
+
+    def _note(self, job_type, term):
+        held = self.terms.get(job_type)
+        if term == held:
+            return
+        if held is not None:
+            self.transitions[(job_type, 'lost')] += 1
+            logger.warning('%s lost leadership of %s (term %s)', self.holder, job_type, held)
+            del self.terms[job_type]
+        if term is not None:
+            self.transitions[(job_type, 'acquired')] += 1
+            logger.info('%s leads %s (term %s)', self.holder, job_type, term)
+            self.terms[job_type] = term
+
+    def _due(self, job_type, interval, now):
+        """True (and the run recorded) if the job last started at least interval seconds ago"""
+        running = self._running.get(job_type)
+        if running is not None and running.is_alive():
+            return False
+        mark = db.session.get(Watermark, lease_name(job_type))
+        if mark is None:
+            mark = Watermark(name=lease_name(job_type), last_id=0)
+            db.session.add(mark)
+        elif mark.last_at is not None and (now - mark.last_at).total_seconds() < interval:
+            return False
+        mark.last_at = mark.updated_at = now
+        db.session.commit()
+        return True
+
+    def _start(self, job_type):
+        thread = threading.Thread(target=self._run, args=(job_type,), name=f'periodic-{job_type}', daemon=True)
+        self._running[job_type] = thread
+        thread.start()
+
+    def _run(self, job_type):
+        handler = get_handler(job_type)
+        try:
+            with self.app.app_context():
+                result = handler.func()
+            self.runs[job_type] += 1
+            logger.info('Periodic %s finished: %s', job_type, result)
+        except Exception:
+            logger.exception('Periodic %s failed', job_type)
+
+    def join(self, timeout=None):
+        """Wait for job runs in progress"""
+        for thread in list(self._running.values()):
+            thread.join(timeout)
+
+    def start(self):
+        """Run tick() every heartbeat on a daemon thread"""
+        if self._thread is None and self.jobs:
+            self._thread = threading.Thread(target=self._loop, name='leader-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    self.tick()
+            except Exception:
+                logger.exception('Scheduler tick failed')
+            self.stop_event.wait(self.heartbeat)
+
+    def run_forever(self):
+        """Start and block until SIGINT/SIGTERM, then hand leadership over"""
+        signal.signal(signal.SIGTERM, lambda *_: self.stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop_event.set())
+        self.start()
+        logger.info('Scheduler %s started for %s', self.holder, ', '.join(self.jobs))
+        while not self.stop_event.wait(1):
+            pass
+        self.stop()
+
+    def stop(self, timeout=None):
+        """Stop trying for leases and release the ones held"""
+        self.stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.join(timeout)
+        with self.app.app_context():
+            for job_type in list(self.terms):
+                release(lease_name(job_type), self.holder)
+                self._note(job_type, None)
+
+
+def get_scheduler(app=None):
+    app = app or current_app
+    return app.extensions.get('scheduler')
+
+
+def start_scheduler(app):
+    """Start this process's scheduler (call after fork; threads don't survive it)"""
+    if not app.config['SCHEDULER_ENABLED']:
+        return None
+    import atexit
+
+    scheduler = app.extensions['scheduler'] = Scheduler(app).start()
+    atexit.register(scheduler.stop, 5)
+    return scheduler
+
+
+class LeaderCollector:
+    """Prometheus collector for this process's leadership of each periodic job"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+        scheduler = get_scheduler(self.app)
+        if scheduler is None:
+            return
+        leading = GaugeMetricFamily('app_leader_is_leader', 'Whether this process leads the job', labels=['job'])
+        term = GaugeMetricFamily('app_leader_term', 'Lease term held by this process', labels=['job'])
+        changes = CounterMetricFamily('app_leader_transitions', 'Leadership gained or lost', labels=['job', 'change'])
+        runs = CounterMetricFamily('app_leader_runs', 'Periodic job runs completed by this process', labels=['job'])
+        for job_type in scheduler.jobs:
+            leading.add_metric([job_type], int(scheduler.is_leader(job_type)))
+            term.add_metric([job_type], scheduler.terms.get(job_type, 0))
+            runs.add_metric([job_type], scheduler.runs[job_type])
+        for (job_type, change), count in scheduler.transitions.items():
+            changes.add_metric([job_type, change], count)
+        yield from (leading, term, changes, runs)
+
+
+def register_leader_metrics(app, registry):
+    registry.register(LeaderCollector(app))
+
+
+def register_leader_commands(app):
+    """Register `flask scheduler ...` CLI commands with the Flask app"""
+    scheduler_cli = AppGroup('scheduler', help='Periodic job scheduler commands')
+
+    @scheduler_cli.command('status')
+    def status_command():
+        """Show who leads each periodic job"""
+        now = datetime.utcnow()
+        leases = {lease.name: lease for lease in LeaderLease.query}
+        for job_type, interval in periodic_jobs(current_app.config).items():
+            lease = leases.get(lease_name(job_type))
+            if lease is None or lease.holder is None or lease.expires_at <= now:
+                leader = 'no leader'
+            else:
+                leader = f'{lease.holder} (term {lease.term}, expires {lease.expires_at:%H:%M:%S})'
+            click.echo(f'{job_type:<24} {f"every {interval:g}s":<14} {leader}')
+
+    @scheduler_cli.command('run')
+    def run_command():
+        """Compete for leadership and run periodic jobs until interrupted (instead of in gunicorn)"""
+        Scheduler(current_app._get_current_object()).run_forever()
+
+    app.cli.add_command(scheduler_cli)
@@ -0,0 +1,268 @@
+"""Business metrics and multi-worker aggregation for /metrics
+
+Task, user and project counts are never computed at scrape time. The leader
+of the periodic 'metrics.snapshot' job (see leader.py) sums the statistics
+rollups (user_stats, kept current by the task write paths) and a few small
+counts into the metric_snapshot table every METRICS_SNAPSHOT_INTERVAL
+seconds. A scrape reads those few rows by primary key. User activity comes
+from the audit log: each snapshot moves users' last_active_at forward for
+the events since the last one, so "active in the last day" is an index
+range count on user.last_active_at.
+
+Under gunicorn every worker keeps its own request counters, and a scrape
+reaches only one of them. With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py
+sets it), prometheus_client writes each worker's samples to files there and
+/metrics merges them. The app's own collectors (cache, audit, leader) read
+in-process state, which the merge can't see, so each worker mirrors them into
+multiprocess metrics every METRICS_PUBLISH_INTERVAL seconds: counters are
+summed across workers, and gauges are summed or maxed over live workers as
+MULTIPROCESS_GAUGE_MODES says. Snapshot gauges are the same in every worker
+and are served directly.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from models import db, AuditEvent, MetricSnapshot, Project, User, UserStats, Watermark
+from jobs import job_handler
+from audit import settled
+
+logger = logging.getLogger('taskapp.metrics')
+
+WATERMARK = 'metrics'
+ACTIVE_WINDOWS = {'1d': timedelta(days=1), '7d': timedelta(days=7)}
+
+# How each mirrored gauge combines across workers; anything else takes the live maximum
+MULTIPROCESS_GAUGE_MODES = {
+    'app_audit_queue_depth': 'livesum',
+    'app_leader_is_leader': 'livesum',
+    'app_cache_entries': 'livemax',  # the shared tier is the same file in every worker
+}
+
+
+def multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+def _record_activity(now):
+    """Move users' last_active_at forward from settled audit events past the watermark"""
+    mark = db.session.get(Watermark, WATERMARK)
+    if mark is None:
+        mark = Watermark(name=WATERMARK, last_id=0)
+        db.session.add(mark)
+        db.session.flush()
+    latest = settled(db.session.query(db.func.max(AuditEvent.id)), mark.last_id, now).scalar() or 0
+    if latest <= mark.last_id:
+        return
+    rows = (db.session.query(AuditEvent.user_id, db.func.max(AuditEvent.occurred_at))
+            .filter(AuditEvent.id > mark.last_id, AuditEvent.id <= latest, AuditEvent.user_id.isnot(None))
+            .group_by(AuditEvent.user_id).all())
+    users = User.__table__
+    if rows:
+        db.session.execute(users.update()
+                           .where(users.c.id == db.bindparam('uid'),
+                                  db.or_(users.c.last_active_at.is_(None),
+                                         users.c.last_active_at < db.bindparam('seen')))
+                           .values(last_active_at=db.bindparam('seen')),
+                           [{'uid': user_id, 'seen': seen} for user_id, seen in rows])
+    mark.last_id = latest
+    mark.updated_at = datetime.utcnow()
+
+
+def take_snapshot(now=None):
+    """Recompute every business metric into metric_snapshot; returns {name: value}"""
+    now = now or datetime.utcnow()
+    _record_activity(now)
+
+    total, completed, overdue = db.session.query(
+        *[db.func.coalesce(db.func.sum(column), 0)
+          for column in (UserStats.total_tasks, UserStats.completed_tasks, UserStats.overdue_tasks)]).one()
+    projects = dict(db.session.query(Project.is_template, db.func.count())
+                    .filter(Project.is_deleting.is_(False)).group_by(Project.is_template).all())
+    values = {
+        'tasks_open': total - completed,
+        'tasks_completed': completed,
+        'tasks_overdue': overdue,
+        'users': db.session.query(db.func.count(User.id)).scalar(),
+        'projects': projects.get(False, 0),
+        'templates': projects.get(True, 0),
+    }
+    for window, length in ACTIVE_WINDOWS.items():
+        values[f'users_active_{window}'] = (db.session.query(db.func.count(User.id))
+                                            .filter(User.last_active_at >= now - length).scalar())
+
+    MetricSnapshot.query.delete(synchronize_session=False)
+    db.session.add_all([MetricSnapshot(name=name, value=value, taken_at=now) for name, value in values.items()])
+    db.session.commit()
+    return values
+
+
+@job_handler('metrics.snapshot')
+def snapshot_job():
+    """Periodic: refresh the business metric snapshot"""
+    return take_snapshot()
+
+
+class BusinessCollector:
+    """Prometheus collector serving the latest snapshot (a primary-key read, no counting)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def describe(self):
+        # Registering must not touch the database (it may not be set up yet)
+        return []
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+
+        try:
+            with self.app.app_context():
+                rows = {row.name: row for row in MetricSnapshot.query}
+        except Exception:
+            logger.exception('Business metric snapshot could not be read')
+            return
+        if not rows:
+            return
+
+        def value(name):
+            row = rows.get(name)
+            return row.value if row else 0
+
+        tasks = GaugeMetricFamily('app_tasks', 'Tasks by state, archived ones included, templates left out',
+                                  labels=['state'])
+        for state in ('open', 'completed'):
+            tasks.add_metric([state], value(f'tasks_{state}'))
+        yield tasks
+        yield GaugeMetricFamily('app_tasks_overdue', 'Open tasks past their expected completion date',
+                                value=value('tasks_overdue'))
+        yield GaugeMetricFamily('app_users', 'Registered users', value=value('users'))
+        active = GaugeMetricFamily('app_users_active', 'Users with a recorded change within the window',
+                                   labels=['window'])
+        for window in ACTIVE_WINDOWS:
+            active.add_metric([window], value(f'users_active_{window}'))
+        yield active
+        projects = GaugeMetricFamily('app_projects', 'Projects by kind', labels=['kind'])
+        projects.add_metric(['project'], value('projects'))
+        projects.add_metric(['template'], value('templates'))
+        yield projects
+        taken_at = max(row.taken_at for row in rows.values())
+        yield GaugeMetricFamily('app_metrics_snapshot_age_seconds', 'Seconds since the business metrics were taken',
+                                value=(datetime.utcnow() - taken_at).total_seconds())
+
+
+def register_business_metrics(app, registry):
+    registry.register(BusinessCollector(app))
+
+
+class WorkerMetrics:
+    """Mirrors in-process collectors into multiprocess metrics so every worker is counted
+
+    Stands in for a registry: register_*_metrics(app, registry) call
+    register() on it as they would on a CollectorRegistry.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.collectors = []
+        self._metrics = {}
+        self._published = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def register(self, collector):
+        self.collectors.append(collector)
+
+    def _metric(self, family):
+        from prometheus_client import Counter, Gauge
+
+        key = (family.name, family.type)
+        metric = self._metrics.get(key)
+        if metric is None:
+            labels = sorted({name for sample in family.samples for name in sample.labels})
+            if family.type == 'counter':
+                metric = Counter(family.name, family.documentation, labels, registry=None)
+            else:
+                metric = Gauge(family.name, family.documentation, labels, registry=None,
+                               multiprocess_mode=MULTIPROCESS_GAUGE_MODES.get(family.name, 'livemax'))
+            self._metrics[key] = metric
+        return metric
+
+    def publish(self):
+        """Copy every collector's current values into this worker's multiprocess files"""
+        with self._lock:
+            for collector in self.collectors:
+                for family in collector.collect():
+                    if not family.samples:
+                        continue
+                    metric = self._metric(family)
+                    for sample in family.samples:
+                        if sample.name.endswith('_created'):
+                            continue
+                        child = metric.labels(**sample.labels) if sample.labels else metric
+                        if family.type == 'counter':
+                            key = (sample.name, tuple(sorted(sample.labels.items())))
+                            # Counters only move by what happened since the last copy
+                            child.inc(max(sample.value - self._published.get(key, 0), 0))
+                            self._published[key] = sample.value
+                        else:
+                            child.set(sample.value)
+
+    def start(self):
+        """Publish every interval on a daemon thread (call after fork)"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='metrics-publisher', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish()
+            except Exception:
+                logger.exception('Publishing worker metrics failed')
+
+
+def init_multiprocess_metrics(app):
+    """Serve /metrics merged across workers; returns (registry served as is, per-worker registry)"""
+    from flask import Response
+    from prometheus_client import CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client.multiprocess import MultiProcessCollector
+
+    served = CollectorRegistry()
+    MultiProcessCollector(served)
+    worker_metrics = app.extensions['worker_metrics'] = WorkerMetrics(app.config['METRICS_PUBLISH_INTERVAL'])
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        # The worker answering the scrape is never behind
+        worker_metrics.publish()
+        return Response(generate_latest(served), mimetype=CONTENT_TYPE_LATEST)
+
+    return served, worker_metrics
+
+
+def start_worker_metrics(app):
+    """Start this worker's publisher, if /metrics is merged across workers"""
+    worker_metrics = app.extensions.get('worker_metrics')
+    if worker_metrics is not None:
+        worker_metrics.start()
+    return worker_metrics
+
+
+def register_metrics_commands(app):
+    """Register `flask metrics ...` CLI commands with the Flask app"""
+    metrics_cli = AppGroup('metrics', help='Business metrics commands')
+
+    @metrics_cli.command('snapshot')
+    def snapshot_command():
+        """Take the business metric snapshot now"""
+        for name, value in take_snapshot().items():
+            click.echo(f'{name:<20} {value:g}')
+
+    app.cli.add_command(metrics_cli)
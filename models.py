@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
@@ -8,7 +9,9 @@ db = SQLAlchemy()
 # many 2 many- assoication table for dependeices
 task_dependencies = db.Table('task_dependencies',
     db.Column('task_id', db.Integer, db.ForeignKey('task.id'), primary_key=True),
-    db.Column('depends_on_id', db.Integer, db.ForeignKey('task.id'), primary_key=True)
+    db.Column('depends_on_id', db.Integer, db.ForeignKey('task.id'), primary_key=True),
+    # reverse lookups ("who depends on this task") would otherwise scan the whole table
+    db.Index('ix_task_dependencies_depends_on_id', 'depends_on_id')
 )
 
 
@@ -18,6 +21,8 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_active_at = db.Column(db.DateTime, index=True)  # from the audit log, by the metrics snapshot
+    is_admin = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # set with `flask users admin`
 
     #relationship to projects
     projects = db.relationship('Project', backref='owner', lazy=True, cascade='all, delete-orphan')
@@ -34,33 +39,72 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
 
-class Project(db.Model):
+class Versioned:
+    """Optimistic concurrency: each write bumps `version` with a conditional UPDATE"""
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    def claim_version(self, expected=None):
+        """UPDATE ... SET version = version + 1 WHERE id = ? AND version = ?
+
+        expected is the version the client last saw (defaults to the one
+        loaded in this request). Returns False if another writer got there
+        first; the caller should roll back and ask the client to re-fetch.
+        """
+        expected = self.version if expected is None else expected
+        model = type(self)
+        claimed = model.query.filter(model.id == self.id, model.version == expected) \
+            .update({'version': model.version + 1}, synchronize_session=False)
+        if claimed:
+            set_committed_value(self, 'version', expected + 1)
+        return bool(claimed)
+
+
+class Project(Versioned, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     deadline = db.Column(db.DateTime)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    is_deleting = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # set while a background job removes the project
+    is_template = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # starting point for new projects, not live work
+    cloned_from_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+
+    __table_args__ = (
+        db.Index('ix_project_user_deadline', 'user_id', 'deadline'),
+        # Reminder scan: deadlines in a time window across all users
+        db.Index('ix_project_deadline', 'deadline'),
+    )
 
     #relationship to tasks
     tasks = db.relationship('Task', backref='project', lazy=True, cascade='all, delete-orphan')
 
+    def _task_totals(self):
+        """(total, completed) counted in SQL, including archived tasks"""
+        total, completed = db.session.query(
+            db.func.count(Task.id),
+            db.func.coalesce(db.func.sum(db.case((Task.is_completed.is_(True), 1), else_=0)), 0)
+        ).filter(Task.project_id == self.id).one()
+        archive = db.session.get(ProjectArchive, self.id)
+        archived = archive.archived_tasks if archive else 0
+        return total + archived, completed + archived
+
     def get_completion_percentage(self):
         """Calculate project completion based on completed tasks"""
-        if not self.tasks:
+        total, completed = self._task_totals()
+        if not total:
             return 0
-        completed = sum(1 for task in self.tasks if task.is_completed)
-        return round((completed / len(self.tasks)) * 100)
+        return round((completed / total) * 100)
 
     def get_task_count(self):
         """Get total number of tasks in this project"""
-        return len(self.tasks)
+        return self._task_totals()[0]
 
     def __repr__(self):
         return f'<Project {self.name}>'
 
 
-class Task(db.Model):
+class Task(Versioned, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
@@ -69,7 +113,29 @@ class Task(db.Model):
     importance = db.Column(db.String(20), default='medium')  # importance can be set to low, medium, high
     is_completed = db.Column(db.Boolean, default=False)
     completed_at = db.Column(db.DateTime)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
+    blocked_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # incomplete prerequisites
+    cloned_from_id = db.Column(db.Integer)  # source task when copied by a project clone; used to remap edges
+
+    # "ready" (open, nothing blocking) and "blocked" task lists are served from this index
+    __table_args__ = (
+        db.Index('ix_task_project_ready', 'project_id', 'is_completed', 'blocked_count'),
+        db.Index('ix_task_project_completed_at', 'project_id', 'completed_at'),
+        # Upcoming deadlines: open tasks with a due date only, ordered for keyset pages
+        db.Index('ix_task_open_due', 'project_id', 'expected_completion_date', 'id',
+                 sqlite_where=db.and_(is_completed == db.false(), expected_completion_date.isnot(None)),
+                 postgresql_where=db.and_(is_completed == db.false(), expected_completion_date.isnot(None))),
+        # Reminder scan: open tasks coming due in a time window across all projects
+        db.Index('ix_task_due_open', 'expected_completion_date', 'id',
+                 sqlite_where=db.and_(is_completed == db.false(), expected_completion_date.isnot(None)),
+                 postgresql_where=db.and_(is_completed == db.false(), expected_completion_date.isnot(None))),
+        # Project clone: map a source task to its copy in the new project
+        db.Index('ix_task_project_cloned_from', 'project_id', 'cloned_from_id'),
+        # Dependency picker typeahead: case-insensitive title prefix within a project
+        db.Index('ix_task_project_title', 'project_id', db.func.lower(title)).ddl_if(dialect='sqlite'),
+        db.Index('ix_task_project_title_pattern', 'project_id',
+                 db.text('lower(title) text_pattern_ops')).ddl_if(dialect='postgresql'),
+    )
 
     #Self referential many-to-many relationship for dependencies
     dependencies = db.relationship(
@@ -83,7 +149,8 @@ class Task(db.Model):
 
     def can_be_completed(self):
         """Check if all dependency tasks are completed"""
-        return all(dep.is_completed for dep in self.dependencies)
+        # A single EXISTS query; blocked_count is the cached answer used for listings
+        return not db.session.query(self.dependencies.filter_by(is_completed=False).exists()).scalar()
 
     def toggle_completion(self):
         """Toggle task completion status"""
@@ -96,3 +163,328 @@ class Task(db.Model):
 
     def __repr__(self):
         return f'<Task {self.title}>'
+
+
+# Dependency edges that touch an archived task; the other end may be live or archived
+archived_task_dependencies = db.Table('archived_task_dependencies',
+    db.Column('task_id', db.Integer, primary_key=True),
+    db.Column('depends_on_id', db.Integer, primary_key=True),
+    db.Index('ix_archived_task_dependencies_depends_on_id', 'depends_on_id')
+)
+
+
+class ArchivedTask(db.Model):
+    """A completed task moved out of the task table, keeping its original ID"""
+    __tablename__ = 'archived_task'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    start_date = db.Column(db.DateTime)
+    expected_completion_date = db.Column(db.DateTime)
+    importance = db.Column(db.String(20))
+    completed_at = db.Column(db.DateTime)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # the archive page and throughput analytics read a project's tasks by completion time
+    __table_args__ = (
+        db.Index('ix_archived_task_project_completed_at', 'project_id', 'completed_at'),
+    )
+
+    def __repr__(self):
+        return f'<ArchivedTask {self.title}>'
+
+
+class ProjectArchive(db.Model):
+    """Precomputed counts of a project's archived tasks, added into its statistics"""
+    __tablename__ = 'project_archive'
+
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    archived_tasks = db.Column(db.Integer, nullable=False, default=0)
+    low_archived = db.Column(db.Integer, nullable=False, default=0)
+    medium_archived = db.Column(db.Integer, nullable=False, default=0)
+    high_archived = db.Column(db.Integer, nullable=False, default=0)
+    last_archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ProjectArchive {self.project_id} {self.archived_tasks}>'
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    # workers poll for the oldest runnable job, so keep that lookup on an index
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    @property
+    def error_class(self):
+        """Exception class of the last failure; the traceback itself stays in logs and the CLI"""
+        if not self.last_error:
+            return None
+        return self.last_error.strip().splitlines()[-1].split(':', 1)[0].rsplit('.', 1)[-1]
+
+    def to_dict(self):
+        """Serialise job state for the status polling endpoint"""
+        return {
+            'id': self.id,
+            'type': self.job_type,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'error': self.error_class,
+            'result': self.result,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.job_type} {self.status}>'
+
+
+class TaskClosure(db.Model):
+    """Transitive closure of task_dependencies: ancestor must be done before descendant
+
+    path_count is the number of distinct dependency paths between the two
+    tasks, which lets an edge be removed incrementally without a rebuild. It
+    saturates at closure.PATH_COUNT_CAP.
+    """
+    __tablename__ = 'task_closure'
+
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('task.id'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('task.id'), primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
+    path_count = db.Column(db.BigInteger, nullable=False, default=1)
+
+    __table_args__ = (
+        db.Index('ix_task_closure_descendant', 'descendant_id', 'ancestor_id'),
+    )
+
+    def __repr__(self):
+        return f'<TaskClosure {self.ancestor_id} -> {self.descendant_id}>'
+
+
+class StatsCounters:
+    """Counter columns shared by the per-user and per-project statistics rollups"""
+    total_tasks = db.Column(db.Integer, nullable=False, default=0)
+    completed_tasks = db.Column(db.Integer, nullable=False, default=0)
+    overdue_tasks = db.Column(db.Integer, nullable=False, default=0)
+    due_this_week = db.Column(db.Integer, nullable=False, default=0)
+    low_total = db.Column(db.Integer, nullable=False, default=0)
+    low_completed = db.Column(db.Integer, nullable=False, default=0)
+    medium_total = db.Column(db.Integer, nullable=False, default=0)
+    medium_completed = db.Column(db.Integer, nullable=False, default=0)
+    high_total = db.Column(db.Integer, nullable=False, default=0)
+    high_completed = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def get_task_count(self):
+        return self.total_tasks
+
+    def get_completion_percentage(self):
+        if not self.total_tasks:
+            return 0
+        return round((self.completed_tasks / self.total_tasks) * 100)
+
+    def get_importance_breakdown(self):
+        """(level, completed, total) for each importance level"""
+        return [(level, getattr(self, f'{level}_completed'), getattr(self, f'{level}_total'))
+                for level in ('high', 'medium', 'low')]
+
+
+class UserStats(StatsCounters, db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+    def __repr__(self):
+        return f'<UserStats {self.user_id}>'
+
+
+class ProjectStats(StatsCounters, db.Model):
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ProjectStats {self.project_id}>'
+
+
+class AnalyticsDay(db.Model):
+    """Cached count of tasks completed on one (closed) day in a project"""
+    __tablename__ = 'analytics_day'
+
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AnalyticsDay {self.project_id} {self.day}>'
+
+
+class AuditEvent(db.Model):
+    """Append-only record of who did what to a task or project
+
+    Rows are written in batches by the audit writer thread and never updated.
+    IDs are kept as plain integers so history outlives deleted tasks.
+    written_at is when the row was inserted (occurred_at is when the change
+    was made); readers that keep a watermark on id use it, see audit.settled.
+    """
+    __tablename__ = 'audit_event'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    written_at = db.Column(db.DateTime, default=datetime.utcnow)  # NULL on rows from before schema 16
+    user_id = db.Column(db.Integer)
+    project_id = db.Column(db.Integer)
+    task_id = db.Column(db.Integer)
+    action = db.Column(db.String(32), nullable=False)
+    details = db.Column(db.JSON)
+
+    # history pages are read newest first per task and per project
+    __table_args__ = (
+        db.Index('ix_audit_event_task', 'task_id', 'id'),
+        db.Index('ix_audit_event_project', 'project_id', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'occurred_at': self.occurred_at.isoformat(),
+            'user_id': self.user_id,
+            'project_id': self.project_id,
+            'task_id': self.task_id,
+            'action': self.action,
+            'details': self.details,
+        }
+
+    def __repr__(self):
+        return f'<AuditEvent {self.id} {self.action}>'
+
+
+class Subscription(db.Model):
+    """A project's outbound webhook: which change events to POST, and where"""
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
+    url = db.Column(db.String(500), nullable=False)
+    events = db.Column(db.JSON, nullable=False)  # event types, e.g. ["task.completed"]
+    secret = db.Column(db.String(64), nullable=False)  # HMAC key for the X-Signature header
+    is_active = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'url': self.url,
+            'events': self.events,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Subscription {self.id} {self.url}>'
+
+
+class Watermark(db.Model):
+    """How far a periodic consumer has read through an append-only source"""
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    last_at = db.Column(db.DateTime)  # for consumers that advance through time rather than IDs
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Watermark {self.name} {self.last_id}>'
+
+
+class LeaderLease(db.Model):
+    """Which process currently leads a named singleton job, and until when"""
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(200))  # host:pid of the leader; NULL once released
+    term = db.Column(db.Integer, nullable=False, default=0)  # bumped on every change of leader
+    acquired_at = db.Column(db.DateTime)
+    renewed_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'holder': self.holder,
+            'term': self.term,
+            'acquired_at': self.acquired_at.isoformat() if self.acquired_at else None,
+            'renewed_at': self.renewed_at.isoformat() if self.renewed_at else None,
+            'expires_at': self.expires_at.isoformat(),
+        }
+
+    def __repr__(self):
+        return f'<LeaderLease {self.name} {self.holder} term={self.term}>'
+
+
+class Reminder(db.Model):
+    """A due-soon reminder that has been sent, so it never fires twice for the same due date"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'task' or 'project'
+    target_id = db.Column(db.Integer, nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False)
+    project_id = db.Column(db.Integer, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # A moved due date is a new reminder; the same one again is rejected
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'target_id', 'due_at', name='uq_reminder_target_due'),
+    )
+
+    def __repr__(self):
+        return f'<Reminder {self.kind} {self.target_id} {self.due_at}>'
+
+
+class MetricSnapshot(db.Model):
+    """Latest value of a business metric, taken periodically so /metrics never counts rows"""
+    __tablename__ = 'metric_snapshot'
+
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Float, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<MetricSnapshot {self.name}={self.value}>'
+
+
+class CacheGeneration(db.Model):
+    """Generation of a cache scope; part of every cache key, so bumping it hides the scope's entries
+
+    The '*' row is an epoch shared by every scope. The schema upgrade seeds
+    it with a random value, so a recreated database never meets entries
+    cached for the one it replaced.
+    """
+    __tablename__ = 'cache_generation'
+
+    scope = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CacheGeneration {self.scope}={self.value}>'
+
+
+class SchemaVersion(db.Model):
+    """Single-row table recording which schema upgrade steps have been applied"""
+    __tablename__ = 'schema_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
@@ -0,0 +1,322 @@
+"""Outbound change notifications for project subscribers
+
+Nothing here runs on the request path. The dispatcher reads the audit log
+(audit_event) past a stored watermark, turns the events subscribers care
+about into notifications, coalesces repeats for the same task within the
+window, and queues one delivery job per subscription batch. The job table is
+the persistent retry queue: a failed POST is retried with exponential
+backoff (JOB_RETRY_BACKOFF, doubled per attempt) up to NOTIFY_MAX_ATTEMPTS,
+and at most DELIVERY_CONCURRENCY deliveries run at once across all workers.
+
+Only events older than NOTIFY_COALESCE_SECONDS are read, so a burst of edits
+to one task goes out as a single notification carrying the latest state, and
+the read stops short of rows inserted in the last AUDIT_SETTLE_SECONDS, so a
+batch that commits late is not skipped (see audit.settled).
+
+Each POST body is {"subscription_id", "project_id", "events": [...]}, signed
+with the subscription's secret in X-Signature: sha256=<hex HMAC of the body>.
+
+Receivers must be on public addresses: a URL whose host resolves to a
+private, loopback or link-local address is refused when subscribing, and
+every delivery connection (redirects included) checks the address it
+actually reached, so a name re-pointed later gets nowhere.
+NOTIFY_ALLOW_PRIVATE_URLS lifts both checks for receivers on an internal
+network.
+
+The audit log is the only source of events, so notifications are exactly as
+complete as it is: with AUDIT_ENABLED=False nothing is sent (and no
+subscription can be created), and events discarded under AUDIT_OVERFLOW=drop
+are never notified. Use AUDIT_OVERFLOW=spill and replay the spill file.
+"""
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import secrets
+import socket
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app, request, jsonify
+from flask.cli import AppGroup
+from flask_login import login_required, current_user
+from models import db, AuditEvent, Project, Subscription, Watermark
+from jobs import job_handler, enqueue_many
+from audit import settled
+from timing import timed
+
+EVENT_TYPES = ('task.completed', 'task.reopened', 'task.deadline_changed',
+               'task.due_soon', 'project.due_soon')  # due_soon comes from reminders.py
+DELIVERY_CONCURRENCY = 4
+WATERMARK = 'notifications'
+READ_LIMIT = 5000
+
+
+class DeliveryError(RuntimeError):
+    """The receiver did not accept a batch; the job will be retried"""
+
+
+def _notification(row):
+    """The notification an audit event stands for, or None"""
+    if row.action == 'complete':
+        event_type, extra = 'task.completed', {}
+    elif row.action == 'reopen':
+        event_type, extra = 'task.reopened', {}
+    elif row.action == 'edit' and row.details and 'expected_completion_date' in row.details:
+        due = row.details['expected_completion_date']
+        # Single edits log [old, new]; bulk edits log the new value
+        event_type, extra = 'task.deadline_changed', {'expected_completion_date': due[-1] if isinstance(due, list) else due}
+    else:
+        return None
+    return {'type': event_type, 'task_id': row.task_id, 'project_id': row.project_id,
+            'occurred_at': row.occurred_at.isoformat(), 'audit_id': row.id, **extra}
+
+
+def coalesce(notifications):
+    """Keep the latest notification per (task, type), in order of first appearance"""
+    latest = {}
+    for notification in notifications:
+        key = (notification['task_id'], notification['type'])
+        if key in latest:
+            notification = {**notification, 'coalesced': latest[key].get('coalesced', 1) + 1}
+        latest[key] = notification
+    return list(latest.values())
+
+
+def delivery_payloads(by_project):
+    """Job payloads for {project_id: [notification, ...]}: one per subscription batch"""
+    if not by_project:
+        return []
+    subscriptions = Subscription.query.filter(Subscription.project_id.in_(by_project.keys()),
+                                              Subscription.is_active.is_(True))
+    batch_size = current_app.config['NOTIFY_BATCH_SIZE']
+    payloads = []
+    for subscription in subscriptions:
+        wanted = [notification for notification in coalesce(by_project[subscription.project_id])
+                  if notification['type'] in subscription.events]
+        for offset in range(0, len(wanted), batch_size):
+            payloads.append({'subscription_id': subscription.id, 'events': wanted[offset:offset + batch_size]})
+    return payloads
+
+
+def _watermark():
+    mark = db.session.get(Watermark, WATERMARK)
+    if mark is None:
+        mark = Watermark(name=WATERMARK, last_id=0)
+        db.session.add(mark)
+        db.session.flush()
+    return mark
+
+
+def dispatch_pending(now=None):
+    """Turn audit events past the watermark into queued deliveries; returns jobs queued
+
+    The watermark moves with a compare-and-set in the same commit as the
+    jobs, so two dispatchers can't send the same events twice.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=current_app.config['NOTIFY_COALESCE_SECONDS'])
+    mark = _watermark()
+    start = mark.last_id
+
+    rows = settled(AuditEvent.query, start, now).order_by(AuditEvent.id).limit(READ_LIMIT).all()
+    # Stop at the first event still inside the window; it and later ones wait
+    ready = []
+    for row in rows:
+        if row.occurred_at > cutoff:
+            break
+        ready.append(row)
+    if not ready:
+        db.session.commit()
+        return 0
+
+    by_project = {}
+    for row in ready:
+        notification = _notification(row)
+        if notification is not None:
+            by_project.setdefault(row.project_id, []).append(notification)
+
+    payloads = delivery_payloads(by_project)
+    moved = Watermark.query.filter_by(name=WATERMARK, last_id=start) \
+        .update({'last_id': ready[-1].id, 'updated_at': now}, synchronize_session=False)
+    if not moved:
+        db.session.rollback()
+        return 0
+    if payloads:
+        enqueue_many('notifications.deliver', payloads,
+                     max_attempts=current_app.config['NOTIFY_MAX_ATTEMPTS'])
+    else:
+        db.session.commit()
+    return len(payloads)
+
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _is_public(address):
+    ip = ipaddress.ip_address(address.split('%')[0])  # without an IPv6 zone
+    return ip.is_global and not ip.is_multicast
+
+
+def _connect_public(address, *args, **kwargs):
+    """socket.create_connection that refuses a peer on a non-public address"""
+    sock = socket.create_connection(address, *args, **kwargs)
+    peer = sock.getpeername()[0]
+    if not _is_public(peer):
+        sock.close()
+        raise DeliveryError(f'{address[0]} resolves to non-public address {peer}')
+    return sock
+
+
+class _PublicOnly:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPConnection(_PublicOnly, http.client.HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicOnly, http.client.HTTPSConnection):
+    pass
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+# No proxies: the address check has to see the receiver, not the proxy
+_public_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}),
+                                             _PublicHTTPHandler, _PublicHTTPSHandler)
+
+
+def deliver(subscription, events):
+    """POST one batch; raises DeliveryError unless the receiver answers 2xx"""
+    body = json.dumps({'subscription_id': subscription.id, 'project_id': subscription.project_id,
+                       'events': events}, separators=(',', ':')).encode()
+    outgoing = urllib.request.Request(subscription.url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'User-Agent': 'taskapp-notifications',
+        'X-Signature': sign(subscription.secret, body),
+    })
+    urlopen = urllib.request.urlopen if current_app.config['NOTIFY_ALLOW_PRIVATE_URLS'] else _public_opener.open
+    try:
+        with urlopen(outgoing, timeout=current_app.config['NOTIFY_TIMEOUT']) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        if error.code == 410:
+            return error.code  # receiver asked us to stop; handled by the caller
+        raise DeliveryError(f'{subscription.url} answered {error.code}') from error
+    except (urllib.error.URLError, OSError) as error:
+        raise DeliveryError(f'{subscription.url} unreachable: {error}') from error
+
+
+@job_handler('notifications.deliver', concurrency=DELIVERY_CONCURRENCY)
+def deliver_job(subscription_id, events):
+    """Send one batch to a subscriber; a raised error schedules a retry with backoff"""
+    subscription = db.session.get(Subscription, subscription_id)
+    if subscription is None or not subscription.is_active:
+        return {'skipped': len(events)}
+    status = deliver(subscription, events)
+    if status == 410:
+        subscription.is_active = False
+        db.session.commit()
+        return {'deactivated': True}
+    return {'delivered': len(events), 'status': status}
+
+
+@job_handler('notifications.dispatch')
+def dispatch_job():
+    """Periodic: queue deliveries for new audit events"""
+    return {'queued': dispatch_pending()}
+
+
+def _url_problem(url):
+    """Why url can't be subscribed, or None"""
+    parts = urlsplit(url or '')
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return 'url must be an http(s) URL'
+    if current_app.config['NOTIFY_ALLOW_PRIVATE_URLS']:
+        return None
+    try:
+        resolved = socket.getaddrinfo(parts.hostname, parts.port or 80, type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError):
+        return 'url host does not resolve'
+    if not all(_is_public(info[4][0]) for info in resolved):
+        return 'url must point at a public address'
+    return None
+
+
+def register_notification_routes(app):
+    """Register per-project subscription management with the Flask app"""
+
+    def owned_project(project_id):
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.user_id != current_user.id or project.is_deleting:
+            return None
+        return project
+
+    @app.route('/projects/<int:project_id>/subscriptions', methods=['GET', 'POST'])
+    @login_required
+    def project_subscriptions(project_id):
+        """List a project's webhooks, or add one: {"url", "events": [...]}"""
+        project = owned_project(project_id)
+        if project is None:
+            return jsonify({'error': 'Project not found'}), 404
+
+        if request.method == 'GET':
+            rows = Subscription.query.filter_by(project_id=project.id).order_by(Subscription.id)
+            return jsonify({'project_id': project.id, 'subscriptions': [row.to_dict() for row in rows]})
+
+        if not current_app.config['AUDIT_ENABLED']:
+            return jsonify({'error': 'Notifications are built from the audit log, which is turned off'}), 409
+        data = request.get_json(silent=True) or {}
+        events = data.get('events') or list(EVENT_TYPES)
+        problem = _url_problem(data.get('url'))
+        if problem:
+            return jsonify({'error': problem}), 400
+        if not isinstance(events, list) or not set(events) <= set(EVENT_TYPES):
+            return jsonify({'error': f'events must be a list drawn from {", ".join(EVENT_TYPES)}'}), 400
+
+        subscription = Subscription(project_id=project.id, url=data['url'], events=sorted(set(events)),
+                                    secret=secrets.token_hex(32))
+        db.session.add(subscription)
+        db.session.commit()
+        # The secret is only ever shown here
+        return jsonify({**subscription.to_dict(), 'secret': subscription.secret}), 201
+
+    @app.route('/projects/<int:project_id>/subscriptions/<int:subscription_id>', methods=['DELETE'])
+    @login_required
+    def delete_subscription(project_id, subscription_id):
+        project = owned_project(project_id)
+        subscription = db.session.get(Subscription, subscription_id)
+        if project is None or subscription is None or subscription.project_id != project.id:
+            return jsonify({'error': 'Subscription not found'}), 404
+        db.session.delete(subscription)
+        db.session.commit()
+        return '', 204
+
+
+def register_notification_commands(app):
+    """Register `flask notifications ...` CLI commands with the Flask app"""
+    notifications_cli = AppGroup('notifications', help='Outbound change notification commands')
+
+    @notifications_cli.command('dispatch')
+    def dispatch_command():
+        """Queue deliveries for audit events since the last run"""
+        click.echo(f'{dispatch_pending()} delivery job(s) queued')
+
+    app.cli.add_command(notifications_cli)
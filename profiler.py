@@ -0,0 +1,216 @@
+"""Per-request profiling, switched on by config and off (no hooks at all) by default
+
+  PROFILE_SAMPLE_RATE  fraction of requests run under cProfile; saved as .pstats
+  PROFILE_SLOW_MS      stack-sample every request and keep the samples of any that
+                       take longer than this; saved as folded stacks (.folded),
+                       which flamegraph.pl and speedscope read directly
+
+Profiles go to PROFILE_DIR with a .json sidecar holding the endpoint, view
+arguments, query string and timing. The directory is a ring buffer: once it
+holds PROFILE_MAX_FILES profiles the oldest are deleted. Admin users (see
+`flask users admin`) can list and download them under /admin/profiles.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request, jsonify, send_from_directory, abort, Response
+from auth import admin_required
+
+PROFILE_EXTENSIONS = ('.pstats', '.folded')
+MAX_STACK_DEPTH = 128
+
+
+class StackSampler:
+    """One background thread sampling the stacks of registered request threads
+
+    The thread only runs while at least one request is registered; between
+    requests it blocks on an event, so an idle worker pays nothing.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # A forked worker doesn't inherit its parent's thread
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+
+    def start(self):
+        with self._lock:
+            self._ensure_thread()
+            self._active[threading.get_ident()] = Counter()
+        self._wake.set()
+
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.clear()
+                if not self._active:
+                    self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+
+def _fold(frame):
+    """'outer (file:line);...;inner (file:line)' for one sampled stack"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Profiler:
+    def __init__(self, app):
+        self.directory = app.config['PROFILE_DIR']
+        self.max_files = app.config['PROFILE_MAX_FILES']
+        self.sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        self.slow_seconds = app.config['PROFILE_SLOW_MS'] / 1000
+        self.sampler = StackSampler(app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000) if self.slow_seconds else None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def before_request(self):
+        if request.endpoint in (None, 'static') or request.endpoint.startswith('profile_'):
+            return
+        g.profile_started = time.perf_counter()
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler already owns this interpreter
+                return
+            g.profile = profile
+        elif self.sampler is not None:
+            self.sampler.start()
+            g.profile_sampling = True
+
+    def teardown_request(self, exc):
+        started = g.pop('profile_started', None)
+        if started is None:
+            return
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+        stacks = self.sampler.stop() if g.pop('profile_sampling', False) else None
+        duration = time.perf_counter() - started
+
+        if profile is not None:
+            self._save('sampled', duration, exc, '.pstats', lambda path: profile.dump_stats(path))
+        elif stacks and duration >= self.slow_seconds:
+            folded = ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+            self._save('slow', duration, exc, '.folded', lambda path: _write_text(path, folded))
+
+    def _save(self, reason, duration, exc, extension, write):
+        name = f'{int(time.time() * 1000)}-{os.getpid()}-{threading.get_ident() % 100000}-{request.endpoint}'
+        try:
+            write(os.path.join(self.directory, name + extension))
+            _write_text(os.path.join(self.directory, name + '.json'), json.dumps({
+                'name': name,
+                'file': name + extension,
+                'reason': reason,
+                'endpoint': request.endpoint,
+                'method': request.method,
+                'path': request.path,
+                'view_args': request.view_args or {},
+                'args': request.args.to_dict(flat=False),
+                'duration_ms': round(duration * 1000, 1),
+                'error': repr(exc) if exc is not None else None,
+                'created_at': time.time(),
+            }))
+            self._prune()
+        except OSError:
+            # Profiling must never break the request it observed
+            pass
+
+    def _prune(self):
+        names = sorted(entry[:-5] for entry in os.listdir(self.directory) if entry.endswith('.json'))
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            for extension in ('.json',) + PROFILE_EXTENSIONS:
+                try:
+                    os.remove(os.path.join(self.directory, name + extension))
+                except FileNotFoundError:
+                    pass
+
+
+def _write_text(path, text):
+    # Write then rename, so a reader never sees half a file
+    partial = f'{path}.{os.getpid()}.tmp'
+    with open(partial, 'w') as f:
+        f.write(text)
+    os.replace(partial, path)
+
+
+def list_profiles(directory):
+    """Saved profile metadata, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in sorted(os.listdir(directory), reverse=True):
+        if entry.endswith('.json'):
+            try:
+                with open(os.path.join(directory, entry)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # pruned or still being written
+    return profiles
+
+
+def init_profiler(app):
+    """Install the request hooks, only when a profiling mode is switched on"""
+    if not app.config['PROFILE_SAMPLE_RATE'] and not app.config['PROFILE_SLOW_MS']:
+        return None
+    profiler = Profiler(app)
+    app.before_request(profiler.before_request)
+    app.teardown_request(profiler.teardown_request)
+    app.extensions['profiler'] = profiler
+    return profiler
+
+
+def register_profile_routes(app):
+    """Register admin-only routes for browsing saved profiles"""
+
+    @app.route('/admin/profiles')
+    @admin_required
+    def profile_list():
+        limit = max(1, min(request.args.get('limit', 100, type=int), app.config['PROFILE_MAX_FILES']))
+        return jsonify({'profiles': list_profiles(app.config['PROFILE_DIR'])[:limit]})
+
+    @app.route('/admin/profiles/<name>')
+    @admin_required
+    def profile_download(name):
+        """The raw profile, or ?format=text for the top functions of a .pstats file"""
+        if not name.endswith(PROFILE_EXTENSIONS):
+            abort(404)
+        directory = app.config['PROFILE_DIR']
+        if request.args.get('format') == 'text' and name.endswith('.pstats'):
+            path = os.path.join(directory, os.path.basename(name))
+            if not os.path.isfile(path):
+                abort(404)
+            output = io.StringIO()
+            pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(50)
+            return Response(output.getvalue(), mimetype='text/plain')
+        return send_from_directory(directory, name, as_attachment=True)
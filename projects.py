@@ -1,8 +1,24 @@
-from flask import render_template, request, redirect, url_for, flash
+from flask import render_template, request, redirect, url_for, flash, abort, current_app
 from flask_login import login_required, current_user
-from models import db, Project
+from sqlalchemy import or_
+from models import (db, AnalyticsDay, Project, ProjectArchive, ProjectStats, Subscription, Task, TaskClosure,
+                    task_dependencies)
+from stats import forget_project, get_project_stats
+from archive import forget_project_archive
+from jobs import job_handler, enqueue
+from concurrency import submitted_version, conflict_response
+from timing import timed
+from cache import cached, project_scope, invalidate_project
+import audit
 from datetime import datetime
 
+PROJECT_CONFLICT = 'This project was changed by someone else. Your changes were not saved; review it and try again.'
+
+def _editable(project):
+    """The user-editable fields of a project, as compared for the audit log"""
+    return {'name': project.name, 'description': project.description, 'deadline': project.deadline}
+
+
 def register_project_routes(app):
     """Register project CRUD routes with the Flask app"""
 
@@ -41,6 +57,8 @@ def register_project_routes(app):
                 user_id=current_user.id
             )
             db.session.add(project)
+            db.session.flush()
+            audit.record('create', project.id, details={'name': name, 'deadline': audit.jsonable(deadline)})
             db.session.commit()
 
             flash('Project created successfully!', 'success')
@@ -51,21 +69,31 @@ def register_project_routes(app):
     @app.route('/projects/<int:project_id>')
     @login_required
     def view_project(project_id):
-        project = Project.query.get_or_404(project_id)
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.is_deleting:
+            abort(404)
 
         # Check if user owns this project
         if project.user_id != current_user.id:
             flash('You do not have permission to view this project', 'error')
             return redirect(url_for('dashboard'))
 
-        # Get tasks sorted by creation date
-        tasks = project.tasks
-        return render_template('view_project.html', project=project, tasks=tasks)
+        page = cached(project_scope(project.id), 'page', lambda: _project_page(project))
+        # Destinations for the bulk "move to" action
+        other_projects = (db.session.query(Project.id, Project.name)
+                          .filter(Project.user_id == current_user.id, Project.id != project.id,
+                                  Project.is_deleting.is_(False))
+                          .order_by(Project.name).all())
+        return render_template('view_project.html', project=project, other_projects=other_projects, **page)
 
     @app.route('/projects/<int:project_id>/edit', methods=['GET', 'POST'])
     @login_required
     def edit_project(project_id):
-        project = Project.query.get_or_404(project_id)
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.is_deleting:
+            abort(404)
 
         # Check if user owns this project
         if project.user_id != current_user.id:
@@ -96,10 +124,19 @@ def register_project_routes(app):
                     flash(error, 'error')
                 return render_template('edit_project.html', project=project)
 
+            # Someone else saved this project since the form was loaded
+            if not project.claim_version(submitted_version()):
+                return conflict_response(project, PROJECT_CONFLICT, url_for('edit_project', project_id=project.id))
+
             # Update project
+            before = _editable(project)
             project.name = name
             project.description = description
             project.deadline = deadline
+            edited = audit.changes(before, _editable(project))
+            if edited:
+                audit.record('edit', project.id, details=edited)
+            invalidate_project(project.id, project.user_id)
             db.session.commit()
 
             flash('Project updated successfully!', 'success')
@@ -110,16 +147,90 @@ def register_project_routes(app):
     @app.route('/projects/<int:project_id>/delete', methods=['POST'])
     @login_required
     def delete_project(project_id):
-        project = Project.query.get_or_404(project_id)
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
 
         # Check if user owns this project
         if project.user_id != current_user.id:
             flash('You do not have permission to delete this project', 'error')
             return redirect(url_for('dashboard'))
 
+        # Hide the project straight away and let a background job remove the rows
         project_name = project.name
-        db.session.delete(project)
-        db.session.commit()
+        if not project.is_deleting:
+            project.is_deleting = True
+            forget_project(project.id, project.user_id)
+            invalidate_project(project.id, project.user_id)
+            # Nothing more is delivered for it; queued deliveries skip a missing subscription
+            Subscription.query.filter_by(project_id=project.id).delete(synchronize_session=False)
+            enqueue('project.delete', {'project_id': project.id}, user_id=current_user.id)
 
         flash(f'Project "{project_name}" deleted successfully', 'success')
         return redirect(url_for('dashboard'))
+
+
+def _project_page(project):
+    """Everything view_project shows below the header, as plain (cacheable) data
+
+    Dependency counts come from one correlated subquery instead of a COUNT
+    per task, and totals include archived tasks, so they are read from the
+    rollup rather than the task list.
+    """
+    dependency_count = (db.select(db.func.count())
+                        .where(task_dependencies.c.task_id == Task.id)
+                        .correlate(Task).scalar_subquery())
+    rows = (db.session.query(Task.id, Task.title, Task.description, Task.importance,
+                             Task.start_date, Task.expected_completion_date,
+                             Task.is_completed, Task.version,
+                             dependency_count.label('dependency_count'))
+            .filter(Task.project_id == project.id)
+            .order_by(Task.id))
+    counts = get_project_stats([project.id]).get(project.id) or project
+    archive = db.session.get(ProjectArchive, project.id)
+    return {
+        'tasks': [row._asdict() for row in rows],
+        'task_count': counts.get_task_count(),
+        'completion_percentage': counts.get_completion_percentage(),
+        'archived_count': archive.archived_tasks if archive else 0,
+    }
+
+
+@job_handler('project.delete', concurrency=2)
+def delete_project_job(project_id):
+    """Delete a project with chunked set-based DELETEs instead of the ORM cascade
+
+    Each chunk is its own short transaction, so locks are held briefly and
+    no task objects are loaded into memory. Safe to re-run after a failure.
+    """
+    chunk_size = current_app.config['PROJECT_DELETE_CHUNK_SIZE']
+    deleted = 0
+
+    while True:
+        task_ids = [row.id for row in db.session.query(Task.id)
+                    .filter(Task.project_id == project_id)
+                    .limit(chunk_size)]
+        if not task_ids:
+            break
+
+        # Closure rows and edges reference tasks, so they go first
+        TaskClosure.query.filter(or_(
+            TaskClosure.ancestor_id.in_(task_ids),
+            TaskClosure.descendant_id.in_(task_ids)
+        )).delete(synchronize_session=False)
+        db.session.execute(task_dependencies.delete().where(or_(
+            task_dependencies.c.task_id.in_(task_ids),
+            task_dependencies.c.depends_on_id.in_(task_ids)
+        )))
+        Task.query.filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(task_ids)
+
+    forget_project_archive(project_id, chunk_size)
+    ProjectStats.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+    AnalyticsDay.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+    Subscription.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+    # Copies outlive their source; they just lose the lineage
+    Project.query.filter_by(cloned_from_id=project_id).update({'cloned_from_id': None}, synchronize_session=False)
+    Project.query.filter_by(id=project_id).delete(synchronize_session=False)
+    db.session.commit()
+    return {'deleted_tasks': deleted}
@@ -0,0 +1,165 @@
+"""Due-soon reminders for open tasks and project deadlines
+
+A reminder goes out REMINDER_LEAD_HOURS before a due date. Each scan reads
+only the slice of time that has come within the lead since the previous
+scan, due dates in (last horizon, now + lead], from indexes that start with
+the due date (ix_task_due_open, ix_project_deadline). The horizon is kept in
+the 'reminders' watermark. A task given a due date inside a slice that was
+already scanned (say, a new task due tomorrow) is found through the audit
+log past the same watermark's last_id (settled events only, see
+audit.settled), so no scan walks the whole table. Project deadlines set or
+moved that way are found through the project create and edit events.
+Without the audit log (AUDIT_ENABLED=False, or events lost to
+AUDIT_OVERFLOW=drop) a task due date set inside a scanned slice gets no
+reminder; the slices themselves are still scanned.
+
+One scan runs at a time. The watermark row is taken with SELECT ... FOR
+UPDATE SKIP LOCKED, so a scan started on another worker or node while one is
+running returns straight away; SQLite has no row locks, so the horizon also
+moves with a compare-and-set. Sent reminders are recorded in the reminder
+table, unique per (kind, target, due date), so none fires twice; a moved due
+date earns a new one.
+
+Reminders are delivered as task.due_soon / project.due_soon notifications to
+the project's subscriptions (see notifications.py).
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import db, AuditEvent, Project, Reminder, Task, Watermark
+from jobs import job_handler, enqueue_many
+from notifications import delivery_payloads
+from audit import settled
+
+WATERMARK = 'reminders'
+READ_LIMIT = 5000
+
+TASK_ACTIONS = ('create', 'edit', 'reopen', 'move')  # may give a task a due date inside a scanned slice
+PROJECT_ACTIONS = ('create', 'edit')  # project events (no task_id) that may set its deadline
+
+
+def _claim_watermark(now):
+    """Lock the reminder watermark, creating it on first use; None while another scan holds it"""
+    if db.session.get(Watermark, WATERMARK) is None:
+        latest = db.session.query(db.func.max(AuditEvent.id)).scalar() or 0
+        db.session.add(Watermark(name=WATERMARK, last_id=latest, last_at=now))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # another scan created it first
+    return (Watermark.query.filter_by(name=WATERMARK)
+            .with_for_update(skip_locked=True).populate_existing().one_or_none())
+
+
+def _live(query):
+    return query.join(Project, Project.id == Task.project_id) \
+        .filter(Project.is_deleting.is_(False), Project.is_template.is_(False))
+
+
+def _due_tasks(condition, start, end):
+    """Open tasks in live projects matching condition and due in (start, end]"""
+    due = Task.expected_completion_date
+    query = _live(db.session.query(Task.id, Task.title, Task.project_id, due.label('due')))
+    # Written like the index predicate, so the partial index qualifies
+    return query.filter(condition, Task.is_completed == db.false(), due > start, due <= end).all()
+
+
+def _due_projects(condition, start, end):
+    return (db.session.query(Project.id, Project.name.label('title'), Project.id.label('project_id'),
+                             Project.deadline.label('due'))
+            .filter(condition, Project.is_deleting.is_(False), Project.is_template.is_(False),
+                    Project.deadline > start, Project.deadline <= end).all())
+
+
+def _changed_since(last_id, now):
+    """(task IDs, edited project IDs, cloned project IDs, new last_id) from settled audit events past last_id"""
+    query = db.session.query(AuditEvent.id, AuditEvent.action, AuditEvent.task_id, AuditEvent.project_id)
+    events = settled(query, last_id, now).order_by(AuditEvent.id).limit(READ_LIMIT).all()
+    task_ids = {row.task_id for row in events if row.action in TASK_ACTIONS and row.task_id}
+    project_ids = {row.project_id for row in events if row.action in PROJECT_ACTIONS and not row.task_id}
+    cloned_ids = {row.project_id for row in events if row.action == 'clone'}
+    return task_ids, project_ids, cloned_ids, events[-1].id if events else last_id
+
+
+def _unsent(kind, rows):
+    """Drop rows already reminded about for the same due date"""
+    if not rows:
+        return []
+    sent = {(row.target_id, row.due_at) for row in db.session.query(Reminder.target_id, Reminder.due_at)
+            .filter(Reminder.kind == kind, Reminder.target_id.in_({row.id for row in rows}))}
+    return [row for row in rows if (row.id, row.due) not in sent]
+
+
+def scan_due(now=None):
+    """Send reminders for what came due within the lead since the last scan
+
+    Returns the number of reminders sent, or None if another scan holds the
+    watermark (or won a race for the same reminders).
+    """
+    now = now or datetime.utcnow()
+    mark = _claim_watermark(now)
+    if mark is None:
+        db.session.rollback()
+        return None
+    start, last_id = mark.last_at, mark.last_id
+    horizon = max(start, now + timedelta(hours=current_app.config['REMINDER_LEAD_HOURS']))
+
+    # The new slice, plus anything that moved into an already scanned one
+    task_ids, project_ids, cloned_ids, next_id = _changed_since(last_id, now)
+    changed_tasks = []
+    if task_ids or cloned_ids:
+        changed_tasks = _due_tasks(or_(Task.id.in_(task_ids), Task.project_id.in_(cloned_ids)), now, horizon)
+    tasks = {row.id: row for row in _due_tasks(db.true(), start, horizon) + changed_tasks}
+    projects = {row.id: row for row in _due_projects(db.true(), start, horizon)}
+    if project_ids or cloned_ids:
+        projects.update((row.id, row) for row in _due_projects(Project.id.in_(project_ids | cloned_ids), now, horizon))
+
+    due_now = [('task', row) for row in _unsent('task', list(tasks.values()))] + \
+              [('project', row) for row in _unsent('project', list(projects.values()))]
+    by_project = {}
+    for kind, row in due_now:
+        db.session.add(Reminder(kind=kind, target_id=row.id, due_at=row.due, project_id=row.project_id, sent_at=now))
+        by_project.setdefault(row.project_id, []).append({
+            'type': f'{kind}.due_soon', 'task_id': row.id if kind == 'task' else None,
+            'project_id': row.project_id, 'title': row.title, 'due': row.due.isoformat(),
+            'occurred_at': now.isoformat()})
+
+    try:
+        moved = Watermark.query.filter_by(name=WATERMARK, last_id=last_id, last_at=start) \
+            .update({'last_id': next_id, 'last_at': horizon, 'updated_at': now}, synchronize_session=False)
+        if not moved:
+            db.session.rollback()
+            return None
+        payloads = delivery_payloads(by_project)
+        if payloads:
+            enqueue_many('notifications.deliver', payloads,
+                         max_attempts=current_app.config['NOTIFY_MAX_ATTEMPTS'])
+        else:
+            db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another scan recorded these reminders first
+        return None
+    return len(due_now)
+
+
+@job_handler('reminders.scan')
+def scan_job():
+    """Periodic: send due-soon reminders (one at a time across all workers)"""
+    return {'sent': scan_due()}
+
+
+def register_reminder_commands(app):
+    """Register `flask reminders ...` CLI commands with the Flask app"""
+    reminders_cli = AppGroup('reminders', help='Due date reminder commands')
+
+    @reminders_cli.command('scan')
+    def scan_command():
+        """Send reminders for tasks and projects coming due (e.g. every minute from cron)"""
+        sent = scan_due()
+        click.echo('another scan is running' if sent is None else f'{sent} reminder(s) sent')
+
+    app.cli.add_command(reminders_cli)
@@ -1,25 +1,49 @@
+import click
 from flask import Flask
 from flask_login import LoginManager
-from prometheus_flask_exporter import PrometheusMetrics
 from models import db, User
 from config import Config
-from auth import register_auth_routes
-from projects import register_project_routes
-from tasks import register_task_routes
 import os
 
-def create_app():
-    app = Flask(__name__)
-    app.config.from_object(Config)
 
-    # Initialize Prometheus metrics (skip in test mode to avoid duplicate registration)
-    if os.getenv('TESTING', 'False').lower() != 'true':
+def _init_metrics(app):
+    # Imported here so processes that never serve /metrics don't load prometheus_client
+    from prometheus_client import CollectorRegistry
+    from prometheus_flask_exporter import PrometheusMetrics
+    from cache import register_cache_metrics
+    from audit import register_audit_metrics
+    from leader import register_leader_metrics
+    from metrics import multiprocess_dir, init_multiprocess_metrics, register_business_metrics
+
+    if multiprocess_dir():
+        # gunicorn: /metrics merges every worker's samples (see metrics.py)
+        metrics = PrometheusMetrics(app, path=None, registry=CollectorRegistry())
+        served, per_worker = init_multiprocess_metrics(app)
+    else:
         metrics = PrometheusMetrics(app)
-        # Add default metrics: request count, duration, and info
-        metrics.info('app_info', 'Application info', version='1.0.0')
+        served = per_worker = metrics.registry
+    # Add default metrics: request count, duration, and info
+    metrics.info('app_info', 'Application info', version='1.0.0')
+    register_cache_metrics(app, per_worker)
+    register_audit_metrics(app, per_worker)
+    register_leader_metrics(app, per_worker)
+    register_business_metrics(app, served)
 
-    # Initialize database
-    db.init_app(app)
+
+def _register_web(app):
+    from auth import register_auth_routes
+    from projects import register_project_routes
+    from tasks import register_task_routes
+    from analytics import register_analytics_routes
+    from jobs import register_job_routes
+    from archive import register_archive_routes
+    from deadlines import register_deadline_routes
+    from cloning import register_clone_routes
+    from bulk import register_bulk_routes
+    from audit import init_audit, register_audit_routes
+    from notifications import register_notification_routes
+    from profiler import init_profiler, register_profile_routes
+    from timing import init_timing, timed
 
     # Initialize login manager
     login_manager = LoginManager()
@@ -28,20 +52,101 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        with timed('load_user'):
+            return User.query.get(int(user_id))
 
     # Register routes
     register_auth_routes(app)
     register_project_routes(app)
     register_task_routes(app)
+    register_job_routes(app)
+    register_analytics_routes(app)
+    register_archive_routes(app)
+    register_deadline_routes(app)
+    register_clone_routes(app)
+    register_bulk_routes(app)
+    register_audit_routes(app)
+    register_notification_routes(app)
+    register_profile_routes(app)
 
-    # Create tables if they don't exist already
-    with app.app_context():
-        db.create_all()
+    # Opt-in request profiling; installs no hooks unless PROFILE_SAMPLE_RATE or PROFILE_SLOW_MS is set
+    init_profiler(app)
+    # Server-Timing header and per-request timing log
+    init_timing(app)
+    # Queue for audit events; a background thread writes them in batches
+    init_audit(app)
+
+
+def _register_commands(app):
+    from tasks import register_task_commands
+    from jobs import register_job_commands
+    from closure import register_closure_commands
+    from stats import register_stats_commands
+    from schema import register_schema_commands
+    from archive import register_archive_commands
+    from cache import register_cache_commands
+    from audit import register_audit_commands
+    from notifications import register_notification_commands
+    from reminders import register_reminder_commands
+    from leader import register_leader_commands
+    from metrics import register_metrics_commands
+    from auth import register_auth_commands
+
+    register_job_commands(app)
+    register_closure_commands(app)
+    register_task_commands(app)
+    register_stats_commands(app)
+    register_schema_commands(app)
+    register_archive_commands(app)
+    register_cache_commands(app)
+    register_audit_commands(app)
+    register_notification_commands(app)
+    register_reminder_commands(app)
+    register_leader_commands(app)
+    register_metrics_commands(app)
+    register_auth_commands(app)
+
+
+def create_app(web=True):
+    """Build the app. web=False skips routes, login and metrics, for scripts that only touch the database"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    # CLI commands run inside a click context; they skip the startup schema
+    # check (so `flask db upgrade` can fix an outdated database) and metrics
+    in_cli = click.get_current_context(silent=True) is not None
+
+    # Initialize Prometheus metrics (skip in test mode to avoid duplicate registration)
+    if web and not in_cli and os.getenv('TESTING', 'False').lower() != 'true':
+        _init_metrics(app)
+
+    # Initialize database
+    db.init_app(app)
+
+    if web:
+        _register_web(app)
+    _register_commands(app)
+
+    # Fail fast if the database schema is behind the code
+    if app.config['SCHEMA_CHECK_ON_STARTUP'] and not in_cli:
+        from schema import check_schema
+
+        with app.app_context():
+            check_schema()
 
     return app
 
-app = create_app()
+
+def __getattr__(name):
+    # `run:app` is built on first access, so importing create_app (tests,
+    # scripts, benchmarks) doesn't also build and discard a full web app
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 if __name__ == '__main__':
+    app = create_app()
     app.run(host='0.0.0.0', debug=True)
@@ -0,0 +1,239 @@
+import secrets
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateColumn
+from cache import EPOCH_SCOPE
+from models import (db, User, Job, Project, Task, TaskClosure, UserStats, ProjectStats,
+                    AnalyticsDay, ArchivedTask, ProjectArchive, SchemaVersion, AuditEvent,
+                    Subscription, Watermark, Reminder, LeaderLease, MetricSnapshot, CacheGeneration,
+                    task_dependencies, archived_task_dependencies)
+
+
+class SchemaError(RuntimeError):
+    """The database schema does not match the version this code expects"""
+
+
+def _create_tables(*tables):
+    bind = db.session.connection()
+    for table in tables:
+        table.create(bind, checkfirst=True)
+
+
+def _add_column(table, column_name):
+    """ALTER TABLE ... ADD COLUMN using the model's definition (needs a server default if NOT NULL)"""
+    bind = db.session.connection()
+    existing = {column['name'] for column in inspect(bind).get_columns(table.name)}
+    if column_name in existing:
+        return
+    preparer = bind.dialect.identifier_preparer
+    column_ddl = CreateColumn(table.c[column_name]).compile(dialect=bind.dialect)
+    bind.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}'))
+
+
+def _create_indexes(table, *names):
+    bind = db.session.connection()
+    for index in table.indexes:
+        if index.name in names:
+            index.create(bind, checkfirst=True)
+
+
+def _v1_feature_tables():
+    _create_tables(Job.__table__, TaskClosure.__table__, UserStats.__table__,
+                   ProjectStats.__table__, AnalyticsDay.__table__)
+
+
+def _v2_deletion_flag_and_blocked_count():
+    from dependencies import repair_blocked_counts
+
+    _add_column(Project.__table__, 'is_deleting')
+    _add_column(Task.__table__, 'blocked_count')
+    repair_blocked_counts()
+
+
+def _v3_lookup_indexes():
+    _create_indexes(task_dependencies, 'ix_task_dependencies_depends_on_id')
+    _create_indexes(Project.__table__, 'ix_project_user_id')
+    _create_indexes(Task.__table__, 'ix_task_project_id', 'ix_task_project_ready',
+                    'ix_task_project_completed_at')
+
+
+def _v4_archive_tables():
+    _create_tables(ArchivedTask.__table__, archived_task_dependencies, ProjectArchive.__table__)
+
+
+def _v5_version_columns():
+    _add_column(Project.__table__, 'version')
+    _add_column(Task.__table__, 'version')
+
+
+def _v6_deadline_indexes():
+    _create_indexes(Task.__table__, 'ix_task_open_due')
+    _create_indexes(Project.__table__, 'ix_project_user_deadline')
+
+
+def _v7_task_title_index():
+    _create_indexes(Task.__table__, 'ix_task_project_title', 'ix_task_project_title_pattern')
+
+
+def _v8_project_cloning():
+    _add_column(Project.__table__, 'is_template')
+    _add_column(Project.__table__, 'cloned_from_id')
+    _add_column(Task.__table__, 'cloned_from_id')
+    _create_indexes(Task.__table__, 'ix_task_project_cloned_from')
+
+
+def _v9_audit_log():
+    _create_tables(AuditEvent.__table__)
+
+
+def _v10_notification_tables():
+    _create_tables(Subscription.__table__, Watermark.__table__)
+
+
+def _v11_deadline_reminders():
+    _add_column(Watermark.__table__, 'last_at')
+    _create_tables(Reminder.__table__)
+    _create_indexes(Task.__table__, 'ix_task_due_open')
+    _create_indexes(Project.__table__, 'ix_project_deadline')
+
+
+def _v12_leader_leases():
+    _create_tables(LeaderLease.__table__)
+
+
+def _v13_business_metrics():
+    _add_column(User.__table__, 'last_active_at')
+    _create_indexes(User.__table__, 'ix_user_last_active_at')
+    _create_tables(MetricSnapshot.__table__)
+
+
+def _seed_cache_epoch():
+    if db.session.get(CacheGeneration, EPOCH_SCOPE) is None:
+        db.session.add(CacheGeneration(scope=EPOCH_SCOPE, value=secrets.randbits(31)))
+
+
+def _v14_cache_generations():
+    _create_tables(CacheGeneration.__table__)
+    _seed_cache_epoch()
+
+
+def _v15_admin_flag():
+    _add_column(User.__table__, 'is_admin')
+
+
+def _v16_audit_written_at():
+    _add_column(AuditEvent.__table__, 'written_at')
+
+
+# Ordered upgrade steps. Append new steps; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, 'Job queue, dependency closure, statistics and analytics tables', _v1_feature_tables),
+    (2, 'Project deletion flag and task blocked_count', _v2_deletion_flag_and_blocked_count),
+    (3, 'Indexes for dependency, ready-task and analytics lookups', _v3_lookup_indexes),
+    (4, 'Completed task archive tables', _v4_archive_tables),
+    (5, 'Optimistic concurrency version columns', _v5_version_columns),
+    (6, 'Indexes for the upcoming-deadlines view', _v6_deadline_indexes),
+    (7, 'Task title index for the dependency picker', _v7_task_title_index),
+    (8, 'Project templates and clone lineage', _v8_project_cloning),
+    (9, 'Audit event log', _v9_audit_log),
+    (10, 'Change notification subscriptions and watermarks', _v10_notification_tables),
+    (11, 'Deadline reminders and due date scan indexes', _v11_deadline_reminders),
+    (12, 'Leader leases for singleton background work', _v12_leader_leases),
+    (13, 'Business metric snapshots and user activity', _v13_business_metrics),
+    (14, 'Cache generations shared by every node', _v14_cache_generations),
+    (15, 'Explicit admin flag on users', _v15_admin_flag),
+    (16, 'Audit event insert time for watermark readers', _v16_audit_written_at),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version():
+    """Applied schema version, or None when the database has never been versioned"""
+    try:
+        return db.session.query(SchemaVersion.version).scalar()
+    except (OperationalError, ProgrammingError):
+        db.session.rollback()
+        return None
+
+
+def check_schema():
+    """Fast startup check: one query, then proceed or raise SchemaError"""
+    # Plain Core query on a short-lived connection: no mapper configuration,
+    # and no connection left open in a process that may fork
+    try:
+        with db.engine.connect() as connection:
+            version = connection.execute(text('SELECT version FROM schema_version')).scalar()
+    except (OperationalError, ProgrammingError):
+        version = None
+
+    if version is None:
+        raise SchemaError('Database schema is not initialised. Run `flask --app run db upgrade` first.')
+    if version < HEAD:
+        raise SchemaError(f'Database schema is at version {version} but the code needs {HEAD}. '
+                          'Run `flask --app run db upgrade`.')
+    if version > HEAD:
+        raise SchemaError(f'Database schema is at version {version}, newer than this code ({HEAD}). '
+                          'Deploy a newer release.')
+
+
+def _set_version(version):
+    row = db.session.get(SchemaVersion, 1)
+    if row is None:
+        db.session.add(SchemaVersion(id=1, version=version))
+    else:
+        row.version = version
+        row.applied_at = datetime.utcnow()
+
+
+def upgrade(echo=lambda message: None):
+    """Bring the database up to HEAD; returns the list of versions applied"""
+    version = current_version()
+
+    if version is None:
+        if not inspect(db.engine).has_table(Task.__tablename__):
+            # Empty database: create everything at once and stamp it
+            db.create_all()
+            _seed_cache_epoch()
+            _set_version(HEAD)
+            db.session.commit()
+            echo(f'created schema at version {HEAD}')
+            return [HEAD]
+
+        # Tables from before schema versioning existed
+        _create_tables(SchemaVersion.__table__)
+        version = 0
+
+    applied = []
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        step()
+        _set_version(step_version)
+        db.session.commit()
+        applied.append(step_version)
+        echo(f'applied {step_version}: {description}')
+    return applied
+
+
+def register_schema_commands(app):
+    """Register `flask db ...` CLI commands with the Flask app"""
+    db_cli = AppGroup('db', help='Database schema commands')
+
+    @db_cli.command('upgrade')
+    def upgrade_command():
+        """Apply pending schema upgrade steps"""
+        applied = upgrade(echo=click.echo)
+        if not applied:
+            click.echo(f'schema already at version {HEAD}')
+
+    @db_cli.command('current')
+    def current_command():
+        """Show the applied and expected schema versions"""
+        click.echo(f'database: {current_version()}  code: {HEAD}')
+
+    app.cli.add_command(db_cli)
@@ -0,0 +1,102 @@
+// Typeahead for the task dependency picker (templates/_dependency_picker.html).
+// Candidates are fetched a page at a time as the user types instead of
+// rendering every task in the project into the form.
+(function () {
+    'use strict';
+
+    var DEBOUNCE_MS = 150;
+
+    function init(picker) {
+        var url = picker.dataset.candidatesUrl;
+        var taskId = picker.dataset.taskId;
+        var search = picker.querySelector('.dependency-search');
+        var results = picker.querySelector('.dependency-results');
+        var selected = picker.querySelector('.dependency-selected');
+        var timer = null;
+        var inflight = null;
+
+        function isSelected(id) {
+            return selected.querySelector('input[value="' + id + '"]') !== null;
+        }
+
+        function add(candidate) {
+            if (isSelected(candidate.id)) {
+                return;
+            }
+            var item = document.createElement('div');
+            item.className = 'checkbox-item';
+            var box = document.createElement('input');
+            box.type = 'checkbox';
+            box.id = 'dep_' + candidate.id;
+            box.name = 'dependencies';
+            box.value = candidate.id;
+            box.checked = true;
+            var label = document.createElement('label');
+            label.htmlFor = box.id;
+            label.textContent = candidate.title;
+            item.appendChild(box);
+            item.appendChild(label);
+            selected.appendChild(item);
+        }
+
+        function show(candidates) {
+            results.textContent = '';
+            candidates.forEach(function (candidate) {
+                if (isSelected(candidate.id)) {
+                    return;
+                }
+                var option = document.createElement('li');
+                option.setAttribute('role', 'option');
+                option.textContent = candidate.title + (candidate.is_completed ? ' (done)' : '');
+                option.addEventListener('mousedown', function (event) {
+                    event.preventDefault();
+                    add(candidate);
+                    option.remove();
+                });
+                results.appendChild(option);
+            });
+        }
+
+        function fetchCandidates() {
+            if (inflight) {
+                inflight.abort();
+            }
+            inflight = new AbortController();
+            var params = new URLSearchParams({q: search.value.trim()});
+            if (taskId) {
+                params.set('task_id', taskId);
+            }
+            fetch(url + '?' + params, {
+                headers: {'Accept': 'application/json'},
+                credentials: 'same-origin',
+                signal: inflight.signal
+            })
+                .then(function (response) { return response.ok ? response.json() : {candidates: []}; })
+                .then(function (data) { show(data.candidates); })
+                .catch(function (error) {
+                    if (error.name !== 'AbortError') {
+                        results.textContent = '';
+                    }
+                });
+        }
+
+        search.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(fetchCandidates, DEBOUNCE_MS);
+        });
+        search.addEventListener('focus', fetchCandidates);
+        search.addEventListener('blur', function () { results.textContent = ''; });
+        // Enter in the search box should not submit the task form
+        search.addEventListener('keydown', function (event) {
+            if (event.key === 'Enter') {
+                event.preventDefault();
+                var first = results.querySelector('li');
+                if (first) {
+                    first.dispatchEvent(new MouseEvent('mousedown'));
+                }
+            }
+        });
+    }
+
+    document.querySelectorAll('.dependency-picker').forEach(init);
+})();
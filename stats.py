@@ -0,0 +1,332 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, func
+from models import db, User, Project, Task, UserStats, ProjectStats, ProjectArchive
+from jobs import job_handler
+
+IMPORTANCE_LEVELS = ('low', 'medium', 'high')
+
+COUNTERS = ['total_tasks', 'completed_tasks', 'overdue_tasks', 'due_this_week'] + [
+    f'{level}_{kind}' for level in IMPORTANCE_LEVELS for kind in ('total', 'completed')
+]
+
+TIMED_COUNTERS = ('overdue_tasks', 'due_this_week')
+
+DUE_SOON_WINDOW = timedelta(days=7)
+
+
+def snapshot(task):
+    """The parts of a task the statistics depend on, taken before or after a write"""
+    return (bool(task.is_completed), task.importance, task.expected_completion_date)
+
+
+def contribution(state):
+    """Counter values a single task in `state` adds to its project's totals, bar the time-dependent ones"""
+    counts = dict.fromkeys(COUNTERS, 0)
+    if state is None:
+        return counts
+
+    completed, importance, _ = state
+    counts['total_tasks'] = 1
+    counts['completed_tasks'] = int(completed)
+    if importance in IMPORTANCE_LEVELS:
+        counts[f'{importance}_total'] = 1
+        counts[f'{importance}_completed'] = int(completed)
+    return counts
+
+
+def _open_due(state):
+    """The due date that makes a task count as overdue or due soon, if it has one and is open"""
+    if state is None or state[0]:
+        return None
+    return state[2]
+
+
+def timed_contribution(state, as_of):
+    """SQL for what a task in `state` adds to overdue_tasks and due_this_week as of `as_of`"""
+    due = _open_due(state)
+    if due is None:
+        return dict.fromkeys(TIMED_COUNTERS, 0)
+    return {
+        'overdue_tasks': case((as_of > due, 1), else_=0),
+        'due_this_week': case((and_(as_of <= due, as_of > due - DUE_SOON_WINDOW), 1), else_=0),
+    }
+
+
+def _is_template(project_id):
+    """Templates keep their own rollup row but stay out of their owner's totals"""
+    project = db.session.get(Project, project_id)  # already loaded by the write paths
+    return project is not None and project.is_template
+
+
+def _changed_values(model, delta, before, after):
+    values = {name: getattr(model, name) + amount for name, amount in delta.items()}
+    if _open_due(before) != _open_due(after):
+        old, new = timed_contribution(before, model.refreshed_at), timed_contribution(after, model.refreshed_at)
+        values.update({name: getattr(model, name) + new[name] - old[name] for name in TIMED_COUNTERS})
+    return values
+
+
+def record_change(project_id, user_id, before, after):
+    """Apply the counter delta between two task snapshots (None = task absent)
+
+    Called from the task write paths so the rollup stays current without
+    rescanning tasks. A missing rollup row is built from scratch instead.
+
+    overdue_tasks and due_this_week count tasks as of the row's refreshed_at,
+    not as of now: both snapshots are judged against that same instant, so
+    the stored counts never drift between refreshes. The periodic refresh
+    moves them forward in time.
+    """
+    old, new = contribution(before), contribution(after)
+    delta = {name: new[name] - old[name] for name in COUNTERS if new[name] != old[name]}
+    if not delta and _open_due(before) == _open_due(after):
+        return
+
+    project_values = _changed_values(ProjectStats, delta, before, after)
+    if not ProjectStats.query.filter_by(project_id=project_id).update(project_values, synchronize_session=False):
+        rebuild_project(project_id, user_id)
+    if _is_template(project_id):
+        return
+
+    user_values = _changed_values(UserStats, delta, before, after)
+    if not UserStats.query.filter_by(user_id=user_id).update(user_values, synchronize_session=False):
+        rebuild(user_id)
+
+
+def forget_project(project_id, user_id):
+    """Take a project out of its owner's totals (used when the project is deleted)"""
+    project_stats = db.session.get(ProjectStats, project_id)
+    if project_stats is None:
+        return
+    if not _is_template(project_id):
+        values = {name: getattr(UserStats, name) - getattr(project_stats, name) for name in COUNTERS}
+        UserStats.query.filter_by(user_id=user_id).update(values, synchronize_session=False)
+    db.session.delete(project_stats)
+
+
+def refresh_project(project_id, user_id):
+    """Recount one project after a set-based write and move its owner's totals by the difference
+
+    Used where many tasks change in one statement (copies, bulk edits), so
+    there are no per-task snapshots to feed record_change.
+    """
+    old = db.session.get(ProjectStats, project_id)
+    before = {name: getattr(old, name) for name in COUNTERS} if old else dict.fromkeys(COUNTERS, 0)
+    if old is not None:
+        db.session.expunge(old)
+    rebuild_project(project_id, user_id)
+    if _is_template(project_id):
+        return
+    new = db.session.get(ProjectStats, project_id)
+    after = {name: getattr(new, name) for name in COUNTERS} if new else dict.fromkeys(COUNTERS, 0)
+
+    values = {name: getattr(UserStats, name) + after[name] - before[name]
+              for name in COUNTERS if after[name] != before[name]}
+    if values and not UserStats.query.filter_by(user_id=user_id).update(values, synchronize_session=False):
+        rebuild(user_id)
+
+
+def _aggregate_columns(now):
+    completed = Task.is_completed.is_(True)
+    open_ = Task.is_completed.is_(False)
+    due = Task.expected_completion_date
+
+    def count_where(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    columns = [
+        func.count(Task.id).label('total_tasks'),
+        count_where(completed).label('completed_tasks'),
+        count_where(and_(open_, due < now)).label('overdue_tasks'),
+        count_where(and_(open_, due >= now, due < now + DUE_SOON_WINDOW)).label('due_this_week'),
+    ]
+    for level in IMPORTANCE_LEVELS:
+        columns.append(count_where(Task.importance == level).label(f'{level}_total'))
+        columns.append(count_where(and_(Task.importance == level, completed)).label(f'{level}_completed'))
+    return columns
+
+
+def _archived_columns():
+    """Archived tasks are all complete, so each adds to a total and its completed count"""
+    return [func.coalesce(func.max(getattr(ProjectArchive, name)), 0).label(name)
+            for name in ['archived_tasks'] + [f'{level}_archived' for level in IMPORTANCE_LEVELS]]
+
+
+def _add_archived(row):
+    counts = {name: int(getattr(row, name)) for name in COUNTERS}
+    counts['total_tasks'] += row.archived_tasks
+    counts['completed_tasks'] += row.archived_tasks
+    for level in IMPORTANCE_LEVELS:
+        counts[f'{level}_total'] += getattr(row, f'{level}_archived')
+        counts[f'{level}_completed'] += getattr(row, f'{level}_archived')
+    return counts
+
+
+def compute_project_stats(user_id=None, project_id=None, project_ids=None, as_of=None):
+    """{project_id: (user_id, counters)} from one GROUP BY over the task table
+
+    Archived tasks come from the precomputed project_archive row, not a scan.
+    Time-dependent counters are taken as of `as_of` (default now).
+    """
+    now = as_of or datetime.utcnow()
+    query = (
+        db.session.query(Project.id, Project.user_id, *_aggregate_columns(now), *_archived_columns())
+        .outerjoin(Task, Task.project_id == Project.id)
+        .outerjoin(ProjectArchive, ProjectArchive.project_id == Project.id)
+        .filter(Project.is_deleting.is_(False))
+        .group_by(Project.id, Project.user_id)
+    )
+    if user_id is not None:
+        query = query.filter(Project.user_id == user_id)
+    if project_id is not None:
+        query = query.filter(Project.id == project_id)
+    if project_ids is not None:
+        query = query.filter(Project.id.in_(project_ids))
+
+    return {row.id: (row.user_id, _add_archived(row)) for row in query}
+
+
+def _template_ids(user_id=None):
+    query = db.session.query(Project.id).filter(Project.is_template.is_(True))
+    if user_id is not None:
+        query = query.filter(Project.user_id == user_id)
+    return {row.id for row in query}
+
+
+def _sum_by_user(project_stats, user_ids, template_ids):
+    """Per-user totals of the project rows; templates are not live work, so they are left out"""
+    totals = {user_id: dict.fromkeys(COUNTERS, 0) for user_id in user_ids}
+    for project_id, (owner_id, counts) in project_stats.items():
+        if project_id in template_ids:
+            continue
+        user_totals = totals.setdefault(owner_id, dict.fromkeys(COUNTERS, 0))
+        for name in COUNTERS:
+            user_totals[name] += counts[name]
+    return totals
+
+
+def rebuild_project(project_id, user_id):
+    """Recompute one project's rollup row, as of the same instant as its owner's row"""
+    as_of = db.session.query(UserStats.refreshed_at).filter_by(user_id=user_id).scalar() or datetime.utcnow()
+    computed = compute_project_stats(project_id=project_id, as_of=as_of)
+    ProjectStats.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+    for pid, (owner_id, counts) in computed.items():
+        db.session.add(ProjectStats(project_id=pid, user_id=owner_id, refreshed_at=as_of, **counts))
+    db.session.flush()
+
+
+def rebuild(user_id=None):
+    """Recompute rollup rows in bulk for one user or everyone; returns rows written"""
+    computed = compute_project_stats(user_id=user_id)
+    if user_id is None:
+        user_ids = [row.id for row in db.session.query(User.id)]
+    else:
+        user_ids = [user_id]
+    user_totals = _sum_by_user(computed, user_ids, _template_ids(user_id))
+
+    project_delete = ProjectStats.query
+    user_delete = UserStats.query
+    if user_id is not None:
+        project_delete = project_delete.filter_by(user_id=user_id)
+        user_delete = user_delete.filter_by(user_id=user_id)
+    project_delete.delete(synchronize_session=False)
+    user_delete.delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    project_rows = [dict(project_id=pid, user_id=owner_id, refreshed_at=now, **counts)
+                    for pid, (owner_id, counts) in computed.items()]
+    user_rows = [dict(user_id=uid, refreshed_at=now, **counts) for uid, counts in user_totals.items()]
+    if project_rows:
+        db.session.execute(db.insert(ProjectStats), project_rows)
+    if user_rows:
+        db.session.execute(db.insert(UserStats), user_rows)
+    return len(computed) + len(user_totals)
+
+
+def check():
+    """Rollup rows that disagree with a fresh computation, as (kind, id) pairs
+
+    Time-dependent counters are compared as of each row's refreshed_at, so
+    time passing since the last refresh is not reported as drift.
+    """
+    stored_projects = {row.project_id: row for row in ProjectStats.query}
+    stored_users = {row.user_id: row for row in UserStats.query}
+
+    def differs(row, counts):
+        return row is None or any(getattr(row, name) != counts[name] for name in COUNTERS)
+
+    computed = compute_project_stats()
+    # Recount what looks off as of the instant it was counted at
+    recount = defaultdict(list)
+    for pid, (_, counts) in computed.items():
+        row = stored_projects.get(pid)
+        if row is not None and differs(row, counts):
+            recount[row.refreshed_at].append(pid)
+    for as_of, project_ids in recount.items():
+        computed.update(compute_project_stats(project_ids=project_ids, as_of=as_of))
+    user_totals = _sum_by_user(computed, [row.id for row in db.session.query(User.id)], _template_ids())
+
+    mismatches = [('project', pid) for pid, (_, counts) in computed.items()
+                  if differs(stored_projects.get(pid), counts)]
+    mismatches += [('project', pid) for pid in stored_projects.keys() - computed.keys()]
+    mismatches += [('user', uid) for uid, counts in user_totals.items()
+                   if differs(stored_users.get(uid), counts)]
+    return mismatches
+
+
+def get_user_stats(user_id):
+    """The user's rollup row by primary key, built on first use"""
+    user_stats = db.session.get(UserStats, user_id)
+    if user_stats is None:
+        rebuild(user_id)
+        db.session.commit()
+        user_stats = db.session.get(UserStats, user_id)
+    return user_stats
+
+
+def get_project_stats(project_ids):
+    """{project_id: ProjectStats} for the given projects (one primary-key IN query)"""
+    if not project_ids:
+        return {}
+    return {row.project_id: row for row in ProjectStats.query.filter(ProjectStats.project_id.in_(project_ids))}
+
+
+@job_handler('stats.refresh')
+def refresh_stats_job(user_id=None):
+    """Periodic recompute so overdue / due-this-week counts roll over with time"""
+    rows = rebuild(user_id)
+    db.session.commit()
+    return {'rows': rows}
+
+
+def register_stats_commands(app):
+    """Register `flask stats ...` CLI commands with the Flask app"""
+    stats_cli = AppGroup('stats', help='Statistics rollup commands')
+
+    @stats_cli.command('refresh')
+    @click.option('--user-id', type=int, default=None, help='Only refresh this user')
+    def refresh_command(user_id):
+        """Recompute rollup rows in bulk (run periodically, e.g. hourly from cron)"""
+        rows = rebuild(user_id)
+        db.session.commit()
+        click.echo(f'{rows} statistics row(s) rebuilt')
+
+    @stats_cli.command('check')
+    @click.option('--fix', is_flag=True, help='Rebuild everything if any row is off')
+    def check_command(fix):
+        """Compare rollup rows with the task table"""
+        mismatches = check()
+        for kind, key in mismatches:
+            click.echo(f'{kind} {key} out of date')
+        if mismatches and fix:
+            rebuild()
+            db.session.commit()
+            click.echo('statistics rebuilt')
+        elif not mismatches:
+            click.echo('statistics OK')
+
+    app.cli.add_command(stats_cli)
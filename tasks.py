@@ -1,15 +1,34 @@
-from flask import render_template, request, redirect, url_for, flash
+import click
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort
+from flask.cli import AppGroup
 from flask_login import login_required, current_user
 from models import db, Project, Task
+from stats import record_change, snapshot
+from analytics import invalidate_day
+from archive import archived_dependent_ids, forget_task_edges
+from concurrency import submitted_version, conflict_response
+from timing import timed
+from cache import cached, project_scope, user_scope, invalidate_project
+import audit
+from dependencies import (validate_dependency_ids, add_dependencies, remove_dependencies,
+                          sync_dependencies, current_dependency_ids,
+                          dependency_candidates, CANDIDATE_LIMIT, MAX_CANDIDATE_LIMIT,
+                          find_dependents, find_prerequisites,
+                          set_completion, repair_blocked_counts)
 from datetime import datetime
 
+TASK_CONFLICT = 'This task was changed by someone else. Your changes were not saved; review it and try again.'
+
 def register_task_routes(app):
     """Register task CRUD routes with the Flask app"""
 
     @app.route('/projects/<int:project_id>/tasks/create', methods=['GET', 'POST'])
     @login_required
     def create_task(project_id):
-        project = Project.query.get_or_404(project_id)
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.is_deleting:
+            abort(404)
 
         # Check if user owns this project
         if project.user_id != current_user.id:
@@ -48,23 +67,16 @@ def register_task_routes(app):
                 except ValueError:
                     errors.append('Invalid expected completion date format')
 
-            # Validate dependencies exist and belong to same project
-            dependencies = []
-            if dependency_ids:
-                for dep_id in dependency_ids:
-                    dep_task = Task.query.get(int(dep_id))
-                    if not dep_task or dep_task.project_id != project_id:
-                        errors.append(f'Invalid dependency task ID: {dep_id}')
-                    else:
-                        dependencies.append(dep_task)
+            # Validate dependencies exist and belong to same project (one IN query)
+            dependencies, dependency_errors = validate_dependency_ids(project_id, dependency_ids)
+            errors.extend(dependency_errors)
 
             if errors:
                 for error in errors:
                     flash(error, 'error')
-                # Get available tasks for dependencies
-                available_tasks = Task.query.filter_by(project_id=project_id).all()
+                # Keep the valid picks; other candidates are searched on demand
                 return render_template('create_task.html', project=project,
-                                     available_tasks=available_tasks)
+                                     selected_tasks=list(dependencies.values()))
 
             # Create new task
             task = Task(
@@ -79,24 +91,26 @@ def register_task_routes(app):
             db.session.flush()  # Get task ID before adding dependencies
 
             # Add dependencies
-            for dep_task in dependencies:
-                task.dependencies.append(dep_task)
+            add_dependencies(project_id, task.id, dependencies.keys())
+            record_change(project_id, project.user_id, None, snapshot(task))
+            audit.record('create', project_id, task.id, {'title': task.title})
+            invalidate_project(project_id, project.user_id)
 
             db.session.commit()
 
             flash('Task created successfully!', 'success')
             return redirect(url_for('view_project', project_id=project_id))
 
-        # Get available tasks for dependencies
-        available_tasks = Task.query.filter_by(project_id=project_id).all()
-        return render_template('create_task.html', project=project,
-                             available_tasks=available_tasks)
+        return render_template('create_task.html', project=project, selected_tasks=[])
 
     @app.route('/tasks/<int:task_id>/edit', methods=['GET', 'POST'])
     @login_required
     def edit_task(task_id):
-        task = Task.query.get_or_404(task_id)
-        project = task.project
+        with timed('ownership'):
+            task = Task.query.get_or_404(task_id)
+            project = task.project
+        if project.is_deleting:
+            abort(404)
 
         # Check if user owns this project
         if project.user_id != current_user.id:
@@ -135,65 +149,55 @@ def register_task_routes(app):
                 except ValueError:
                     errors.append('Invalid expected completion date format')
 
-            # Validate dependencies - cannot depend on itself
-            dependencies = []
-            if dependency_ids:
-                for dep_id in dependency_ids:
-                    dep_id_int = int(dep_id)
-                    if dep_id_int == task_id:
-                        errors.append('Task cannot depend on itself')
-                        continue
-                    dep_task = Task.query.get(dep_id_int)
-                    if not dep_task or dep_task.project_id != project.id:
-                        errors.append(f'Invalid dependency task ID: {dep_id}')
-                    else:
-                        # Check for circular dependencies
-                        if would_create_circular_dependency(task, dep_task):
-                            errors.append(f'Cannot add dependency on "{dep_task.title}" - would create circular dependency')
-                        else:
-                            dependencies.append(dep_task)
+            # Validate dependencies in one batch - no self, foreign or circular dependencies
+            dependencies, dependency_errors = validate_dependency_ids(project.id, dependency_ids, task_id=task_id)
+            errors.extend(dependency_errors)
 
             if errors:
                 for error in errors:
                     flash(error, 'error')
-                # Get available tasks for dependencies (exclude self)
-                available_tasks = Task.query.filter(
-                    Task.project_id == project.id,
-                    Task.id != task_id
-                ).all()
+                # Keep the valid picks; other candidates are searched on demand
                 return render_template('edit_task.html', task=task, project=project,
-                                     available_tasks=available_tasks)
+                                     selected_tasks=list(dependencies.values()))
+
+            # Someone else saved this task since the form was loaded
+            if not task.claim_version(submitted_version()):
+                return conflict_response(task, TASK_CONFLICT, url_for('edit_task', task_id=task.id))
 
             # Update task
+            before = snapshot(task)
+            before_edit = _editable(task, current_dependency_ids(task.id))
             task.title = title
             task.description = description
             task.start_date = start_date or task.start_date
             task.expected_completion_date = expected_completion
             task.importance = importance
 
-            # Update dependencies - clear and re-add
-            task.dependencies = []
-            for dep_task in dependencies:
-                task.dependencies.append(dep_task)
+            # Update dependencies - only write the edges that changed
+            sync_dependencies(project.id, task.id, dependencies.keys())
+            record_change(project.id, project.user_id, before, snapshot(task))
+            edited = audit.changes(before_edit, _editable(task, dependencies.keys()))
+            if edited:
+                audit.record('edit', project.id, task.id, edited)
+            invalidate_project(project.id, project.user_id)
 
             db.session.commit()
 
             flash('Task updated successfully!', 'success')
             return redirect(url_for('view_project', project_id=project.id))
 
-        # Get available tasks for dependencies (exclude self)
-        available_tasks = Task.query.filter(
-            Task.project_id == project.id,
-            Task.id != task_id
-        ).all()
+        # Only the current dependencies; other candidates are searched on demand
         return render_template('edit_task.html', task=task, project=project,
-                             available_tasks=available_tasks)
+                             selected_tasks=task.dependencies.all())
 
     @app.route('/tasks/<int:task_id>/delete', methods=['POST'])
     @login_required
     def delete_task(task_id):
-        task = Task.query.get_or_404(task_id)
-        project = task.project
+        with timed('ownership'):
+            task = Task.query.get_or_404(task_id)
+            project = task.project
+        if project.is_deleting:
+            abort(404)
 
         # Check if user owns this project
         if project.user_id != current_user.id:
@@ -206,9 +210,18 @@ def register_task_routes(app):
             dependent_titles = [t.title for t in dependent_tasks]
             flash(f'Cannot delete task. The following tasks depend on it: {", ".join(dependent_titles)}', 'error')
             return redirect(url_for('view_project', project_id=project.id))
+        if archived_dependent_ids([task.id]):
+            flash('Cannot delete task. Archived tasks depend on it', 'error')
+            return redirect(url_for('view_project', project_id=project.id))
 
         task_title = task.title
-        db.session.delete(task)
+        record_change(project.id, project.user_id, snapshot(task), None)
+        audit.record('delete', project.id, task.id, {'title': task_title})
+        invalidate_day(project.id, task.completed_at)
+        remove_dependencies(project.id, task.id, current_dependency_ids(task.id))
+        forget_task_edges(task.id)
+        Task.query.filter_by(id=task.id).delete(synchronize_session=False)
+        invalidate_project(project.id, project.user_id)
         db.session.commit()
 
         flash(f'Task "{task_title}" deleted successfully', 'success')
@@ -217,8 +230,11 @@ def register_task_routes(app):
     @app.route('/tasks/<int:task_id>/complete', methods=['POST'])
     @login_required
     def complete_task(task_id):
-        task = Task.query.get_or_404(task_id)
-        project = task.project
+        with timed('ownership'):
+            task = Task.query.get_or_404(task_id)
+            project = task.project
+        if project.is_deleting:
+            abort(404)
 
         # Check if user owns this project
         if project.user_id != current_user.id:
@@ -227,6 +243,11 @@ def register_task_routes(app):
 
         # Get the completion status from form
         is_completed = request.form.get('is_completed') == 'true'
+        before = snapshot(task)
+
+        # Two concurrent toggles would both adjust the dependents' blocked_count
+        if not task.claim_version(submitted_version()):
+            return conflict_response(task, TASK_CONFLICT, url_for('view_project', project_id=project.id))
 
         if is_completed:
             # Check if dependencies are met
@@ -234,8 +255,7 @@ def register_task_routes(app):
                 flash('Cannot complete task. All dependency tasks must be completed first.', 'error')
                 return redirect(url_for('view_project', project_id=project.id))
 
-            task.is_completed = True
-            task.completed_at = datetime.utcnow()
+            set_completion(task, True)
             flash(f'Task "{task.title}" marked as completed!', 'success')
         else:
             # Uncompleting - check if other tasks depend on this and are completed
@@ -245,29 +265,173 @@ def register_task_routes(app):
                 flash(f'Cannot mark as incomplete. The following completed tasks depend on it: {", ".join(dependent_titles)}', 'error')
                 return redirect(url_for('view_project', project_id=project.id))
 
-            task.is_completed = False
-            task.completed_at = None
+            invalidate_day(project.id, task.completed_at)
+            set_completion(task, False)
             flash(f'Task "{task.title}" marked as incomplete', 'success')
 
+        record_change(project.id, project.user_id, before, snapshot(task))
+        audit.record('complete' if is_completed else 'reopen', project.id, task.id)
+        invalidate_project(project.id, project.user_id)
         db.session.commit()
         return redirect(url_for('view_project', project_id=project.id))
 
+    @app.route('/tasks/<int:task_id>/blockers')
+    @login_required
+    def task_blockers(task_id):
+        """Every task upstream of this one, directly or indirectly"""
+        with timed('ownership'):
+            task = Task.query.get_or_404(task_id)
+            owner_id = task.project.user_id
+        if owner_id != current_user.id:
+            return jsonify({'error': 'Task not found'}), 404
+
+        blockers = cached(project_scope(task.project_id), f'blockers:{task.id}',
+                          lambda: _task_summaries(find_prerequisites(task.project_id, task.id)))
+        return jsonify({'task_id': task.id, 'blockers': blockers})
+
+    @app.route('/tasks/<int:task_id>/impacted')
+    @login_required
+    def task_impacted(task_id):
+        """Every task downstream of this one, directly or indirectly"""
+        with timed('ownership'):
+            task = Task.query.get_or_404(task_id)
+            owner_id = task.project.user_id
+        if owner_id != current_user.id:
+            return jsonify({'error': 'Task not found'}), 404
+
+        impacted = cached(project_scope(task.project_id), f'impacted:{task.id}',
+                          lambda: _task_summaries(find_dependents(task.project_id, task.id)))
+        return jsonify({'task_id': task.id, 'impacted': impacted})
+
+    @app.route('/projects/<int:project_id>/tasks/dependency-candidates')
+    @login_required
+    def dependency_candidates_search(project_id):
+        """Typeahead for the dependency picker: tasks whose title starts with ?q=
+
+        With ?task_id= (editing), tasks that would create a cycle are left out.
+        """
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.user_id != current_user.id or project.is_deleting:
+            return jsonify({'error': 'Project not found'}), 404
+
+        prefix = request.args.get('q', '').strip()
+        task_id = request.args.get('task_id', type=int)
+        limit = max(1, min(request.args.get('limit', CANDIDATE_LIMIT, type=int), MAX_CANDIDATE_LIMIT))
+        candidates = dependency_candidates(project.id, prefix, task_id=task_id, limit=limit)
+        return jsonify({'project_id': project.id, 'candidates': candidates})
+
+    @app.route('/projects/<int:project_id>/tasks/ready')
+    @login_required
+    def project_ready_tasks(project_id):
+        """Open tasks in a project whose prerequisites are all done"""
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.user_id != current_user.id or project.is_deleting:
+            return jsonify({'error': 'Project not found'}), 404
+
+        limit = _listing_limit()
+        tasks = cached(project_scope(project.id), f'ready:{limit}', lambda: _listing(
+            _actionable_query(ready=True).filter(Task.project_id == project.id), limit))
+        return jsonify({'project_id': project.id, 'tasks': tasks})
+
+    @app.route('/projects/<int:project_id>/tasks/blocked')
+    @login_required
+    def project_blocked_tasks(project_id):
+        """Open tasks in a project still waiting on prerequisites"""
+        with timed('ownership'):
+            project = Project.query.get_or_404(project_id)
+        if project.user_id != current_user.id or project.is_deleting:
+            return jsonify({'error': 'Project not found'}), 404
+
+        limit = _listing_limit()
+        tasks = cached(project_scope(project.id), f'blocked:{limit}', lambda: _listing(
+            _actionable_query(ready=False).filter(Task.project_id == project.id), limit))
+        return jsonify({'project_id': project.id, 'tasks': tasks})
+
+    @app.route('/tasks/ready')
+    @login_required
+    def ready_tasks():
+        """Ready and blocked tasks across all of the user's projects"""
+        limit = _listing_limit()
+        ready, blocked = cached(user_scope(current_user.id), f'ready:{limit}', lambda: (
+            _listing(_owned(_actionable_query(ready=True)), limit),
+            _listing(_owned(_actionable_query(ready=False)), limit)))
+
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'ready': ready, 'blocked': blocked})
+        return render_template('ready_tasks.html', ready=ready, blocked=blocked)
+
+
+def register_task_commands(app):
+    """Register `flask tasks ...` CLI commands with the Flask app"""
+    tasks_cli = AppGroup('tasks', help='Task maintenance commands')
+
+    @tasks_cli.command('repair-blocked-counts')
+    @click.option('--project-id', type=int, default=None, help='Only repair this project')
+    def repair_blocked_counts_command(project_id):
+        """Recompute each task's count of incomplete prerequisites"""
+        fixed = repair_blocked_counts(project_id)
+        db.session.commit()
+        click.echo(f'{fixed} task(s) repaired')
+
+    app.cli.add_command(tasks_cli)
+
+
+TASK_LISTING_LIMIT = 200
+
+
+def _actionable_query(ready):
+    """Open tasks that are (ready=True) or are not (ready=False) free of incomplete prerequisites"""
+    query = Task.query.filter(Task.is_completed.is_(False))
+    if ready:
+        return query.filter(Task.blocked_count == 0)
+    return query.filter(Task.blocked_count > 0)
+
+
+def _owned(query):
+    """Restrict a task query to the current user's live projects"""
+    return query.join(Project, Project.id == Task.project_id).filter(
+        Project.user_id == current_user.id, Project.is_deleting.is_(False))
+
+
+def _listing_limit():
+    return max(1, min(request.args.get('limit', TASK_LISTING_LIMIT, type=int), TASK_LISTING_LIMIT))
+
+
+def _listing(query, limit):
+    """JSON-ready rows for a ready/blocked task listing"""
+    rows = query.with_entities(
+        Task.id, Task.title, Task.project_id, Task.importance,
+        Task.expected_completion_date, Task.blocked_count
+    ).order_by(Task.id).limit(limit)
+    return [{
+        'id': row.id,
+        'title': row.title,
+        'project_id': row.project_id,
+        'importance': row.importance,
+        'expected_completion_date': row.expected_completion_date.isoformat() if row.expected_completion_date else None,
+        'blocked_count': row.blocked_count,
+    } for row in rows]
 
-def would_create_circular_dependency(task, new_dependency):
-    """Check if adding new_dependency to task would create a circular dependency"""
-    # If new_dependency already depends on task (directly or indirectly), it's circular
-    visited = set()
 
-    def has_path_to_task(current_task):
-        if current_task.id == task.id:
-            return True
-        if current_task.id in visited:
-            return False
-        visited.add(current_task.id)
+def _editable(task, dependency_ids):
+    """The fields the edit form changes, for the audit log"""
+    return {
+        'title': task.title,
+        'description': task.description,
+        'start_date': task.start_date,
+        'expected_completion_date': task.expected_completion_date,
+        'importance': task.importance,
+        'dependencies': sorted(dependency_ids),
+    }
 
-        for dep in current_task.dependencies:
-            if has_path_to_task(dep):
-                return True
-        return False
 
-    return has_path_to_task(new_dependency)
+def _task_summaries(task_ids):
+    """Short JSON-ready descriptions of tasks, fetched with one IN query"""
+    if not task_ids:
+        return []
+    rows = (db.session.query(Task.id, Task.title, Task.is_completed)
+            .filter(Task.id.in_(task_ids))
+            .order_by(Task.id))
+    return [{'id': row.id, 'title': row.title, 'is_completed': row.is_completed} for row in rows]
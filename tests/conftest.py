@@ -8,6 +8,10 @@ sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 os.environ["DATABASE_URL"] = "sqlite:///:memory:"
 os.environ["SECRET_KEY"] = "test-secret-key"
 os.environ["FLASK_ENV"] = "testing"
+# Tests build their tables with create_all, so skip the schema version check
+os.environ["SCHEMA_CHECK_ON_STARTUP"] = "False"
+# Keep per-request timing lines out of the test output
+os.environ["TIMING_LOG_ENABLED"] = "False"
 
 from run import create_app
 from models import db, User, Project, Task
@@ -22,7 +26,12 @@ def app():
     app.config.update({
         "TESTING": True,
         "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
-        "WTF_CSRF_ENABLED": False
+        "WTF_CSRF_ENABLED": False,
+        "JOBS_RUN_INLINE": True,
+        "AUDIT_WRITE_INLINE": True,
+        # Tables come from create_all, which doesn't seed a fresh cache epoch, so
+        # keep entries in the per-app LRU rather than a file that outlives them
+        "CACHE_BACKEND": "local"
     })
 
     with app.app_context():
@@ -100,3 +109,20 @@ def sample_task(app, sample_project):
         task_id = task.id
 
     return task_id
+
+
+@pytest.fixture
+def foreign_keys(app):
+    """Enforce foreign keys on the test database, as PostgreSQL always does"""
+    db.session.commit()
+    db.session.connection().exec_driver_sql('PRAGMA foreign_keys=ON')
+    yield
+    db.session.rollback()
+    db.session.connection().exec_driver_sql('PRAGMA foreign_keys=OFF')
+
+
+@pytest.fixture(params=[False, True], ids=['walk', 'closure'])
+def closure_mode(request, app):
+    """Run a test with dependency lookups walking the edges (the default) and from the closure table"""
+    app.config['TASK_CLOSURE_ENABLED'] = request.param
+    return request.param
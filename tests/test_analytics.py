@@ -0,0 +1,86 @@
+import pytest
+from datetime import datetime, timedelta
+from models import db, Project, Task, AnalyticsDay
+import analytics
+
+
+def completed_task(project_id, days_ago, cycle_days):
+    completed_at = datetime.utcnow() - timedelta(days=days_ago)
+    return Task(title=f'Done {days_ago}/{cycle_days}', project_id=project_id, is_completed=True,
+                completed_at=completed_at, start_date=completed_at - timedelta(days=cycle_days))
+
+
+@pytest.mark.unit
+class TestThroughput:
+    def test_daily_buckets_and_cache(self, app, sample_project):
+        """Test closed days are counted once and cached, today stays live"""
+        db.session.add_all([
+            completed_task(sample_project, 2, 1),
+            completed_task(sample_project, 2, 3),
+            completed_task(sample_project, 0, 1),
+        ])
+        db.session.commit()
+
+        today = datetime.utcnow().date()
+        start = today - timedelta(days=3)
+        throughput = dict(analytics.daily_completions([sample_project], start, today))
+
+        assert throughput[today - timedelta(days=2)] == 2
+        assert throughput[today] == 1
+        assert AnalyticsDay.query.count() == 3  # closed days only, zeros included
+
+        # A cached day is not recomputed even if the task table changes behind its back
+        db.session.add(completed_task(sample_project, 2, 1))
+        db.session.commit()
+        throughput = dict(analytics.daily_completions([sample_project], start, today))
+        assert throughput[today - timedelta(days=2)] == 2
+
+        analytics.invalidate_day(sample_project, datetime.utcnow() - timedelta(days=2))
+        throughput = dict(analytics.daily_completions([sample_project], start, today))
+        assert throughput[today - timedelta(days=2)] == 3
+
+    def test_cycle_time_distribution(self, app, sample_project):
+        """Test cycle time percentiles and histogram"""
+        db.session.add_all([completed_task(sample_project, 1, days) for days in (1, 2, 3, 4, 10)])
+        db.session.commit()
+
+        result = analytics.cycle_times([sample_project])
+        assert result['count'] == 5
+        assert result['p50'] == pytest.approx(3, abs=0.01)
+        assert result['mean'] == pytest.approx(4, abs=0.01)
+        assert {bucket['days'] for bucket in result['histogram']} == {1, 2, 3, 4, 10}
+
+    def test_forecast(self, app):
+        """Test the forecast divides open work by recent throughput"""
+        today = datetime(2026, 1, 1).date()
+        throughput = [(today - timedelta(days=offset), 2) for offset in range(14)]
+
+        assert analytics.forecast(10, throughput, today)['completion_date'] == '2026-01-06'
+        assert analytics.forecast(10, [(today, 0)], today)['completion_date'] is None
+
+
+@pytest.mark.integration
+class TestAnalyticsRoutes:
+    def test_project_analytics(self, authenticated_client, sample_project, app):
+        """Test the project endpoint returns throughput, burndown and forecast"""
+        project = db.session.get(Project, sample_project)
+        project.created_at = datetime.utcnow() - timedelta(days=10)
+        project.deadline = datetime.utcnow() + timedelta(days=10)
+        db.session.add_all([completed_task(sample_project, 1, 2), Task(title='Open', project_id=sample_project)])
+        db.session.commit()
+
+        data = authenticated_client.get(f'/projects/{sample_project}/analytics?days=5').get_json()
+
+        assert len(data['throughput']) == 5
+        assert data['burndown'][-1]['remaining'] == 1
+        assert 'ideal' in data['burndown'][0]
+        assert data['forecast']['open_tasks'] == 1
+        assert data['cycle_time']['count'] == 1
+
+    def test_user_analytics(self, authenticated_client, sample_project, app):
+        """Test the account-wide endpoint"""
+        db.session.add(completed_task(sample_project, 0, 1))
+        db.session.commit()
+
+        data = authenticated_client.get('/analytics').get_json()
+        assert data['throughput'][-1]['completed'] == 1
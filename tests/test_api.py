@@ -60,6 +60,49 @@ class TestProjectRoutes:
             project = Project.query.get(sample_project)
             assert project is None
 
+    def test_delete_project_in_background(self, authenticated_client, sample_project, app):
+        """Test project is hidden at once and removed in chunks by the job worker"""
+        import jobs
+        from models import task_dependencies
+
+        app.config['JOBS_RUN_INLINE'] = False
+        app.config['PROJECT_DELETE_CHUNK_SIZE'] = 2
+        with app.app_context():
+            tasks = [Task(title=f'Task {i}', project_id=sample_project) for i in range(5)]
+            db.session.add_all(tasks)
+            db.session.commit()
+            tasks[1].dependencies.append(tasks[0])
+            tasks[4].dependencies.append(tasks[3])
+            db.session.commit()
+
+        authenticated_client.post(f'/projects/{sample_project}/delete')
+
+        response = authenticated_client.get(f'/projects/{sample_project}')
+        assert response.status_code == 404
+        response = authenticated_client.get('/dashboard')
+        assert f'/projects/{sample_project}"'.encode() not in response.data
+
+        with app.app_context():
+            assert jobs.run_pending() == 1
+            assert Project.query.get(sample_project) is None
+            assert Task.query.count() == 0
+            assert db.session.query(task_dependencies).count() == 0
+
+    def test_no_task_writes_while_project_is_deleting(self, authenticated_client, sample_task, app):
+        """Test task routes refuse writes once the project is queued for deletion"""
+        app.config['JOBS_RUN_INLINE'] = False
+        project_id = Task.query.get(sample_task).project_id
+        authenticated_client.post(f'/projects/{project_id}/delete')
+
+        assert authenticated_client.post(f'/projects/{project_id}/tasks/create', data={
+            'title': 'Late Task', 'importance': 'low'}).status_code == 404
+        assert authenticated_client.post(f'/tasks/{sample_task}/edit', data={
+            'title': 'Renamed', 'importance': 'low'}).status_code == 404
+        assert authenticated_client.post(f'/tasks/{sample_task}/complete',
+                                         data={'is_completed': 'true'}).status_code == 404
+        assert authenticated_client.post(f'/tasks/{sample_task}/delete').status_code == 404
+        assert [task.title for task in Task.query.all()] == ['Test Task']
+
 
 @pytest.mark.integration
 class TestTaskRoutes:
@@ -112,6 +155,32 @@ class TestTaskRoutes:
             assert task.title == 'Updated Task Title'
             assert task.importance == 'low'
 
+    @pytest.mark.usefixtures('closure_mode')
+    def test_edit_task_dependencies(self, authenticated_client, sample_task, app):
+        """Test editing dependencies and rejecting a circular one"""
+        with app.app_context():
+            other = Task(title='Other Task', project_id=Task.query.get(sample_task).project_id)
+            db.session.add(other)
+            db.session.commit()
+            other_id = other.id
+
+        authenticated_client.post(f'/tasks/{sample_task}/edit', data={
+            'title': 'Test Task',
+            'importance': 'high',
+            'dependencies': [str(other_id)]
+        }, follow_redirects=True)
+
+        response = authenticated_client.post(f'/tasks/{other_id}/edit', data={
+            'title': 'Other Task',
+            'importance': 'medium',
+            'dependencies': [str(sample_task)]
+        }, follow_redirects=True)
+        assert b'would create circular dependency' in response.data
+
+        with app.app_context():
+            assert [t.id for t in Task.query.get(sample_task).dependencies] == [other_id]
+            assert Task.query.get(other_id).dependencies.count() == 0
+
     def test_delete_task(self, authenticated_client, sample_task, app):
         """Test deleting a task"""
         response = authenticated_client.post(f'/tasks/{sample_task}/delete', follow_redirects=True)
@@ -170,3 +239,39 @@ class TestSmokeTests:
         """Test basic app health"""
         assert app is not None
         assert app.config['TESTING'] is True
+
+
+@pytest.mark.integration
+class TestReadyTasks:
+    def test_ready_and_blocked(self, authenticated_client, sample_project, app):
+        """Test ready/blocked listings follow completion of prerequisites"""
+        from dependencies import add_dependencies
+
+        with app.app_context():
+            first = Task(title='First', project_id=sample_project)
+            second = Task(title='Second', project_id=sample_project)
+            db.session.add_all([first, second])
+            db.session.commit()
+            add_dependencies(sample_project, second.id, [first.id])
+            db.session.commit()
+            first_id, second_id = first.id, second.id
+
+        ready = authenticated_client.get(f'/projects/{sample_project}/tasks/ready').get_json()
+        blocked = authenticated_client.get(f'/projects/{sample_project}/tasks/blocked').get_json()
+        assert [t['id'] for t in ready['tasks']] == [first_id]
+        assert [t['id'] for t in blocked['tasks']] == [second_id]
+        clamped = authenticated_client.get(f'/projects/{sample_project}/tasks/ready?limit=-1').get_json()
+        assert [t['id'] for t in clamped['tasks']] == [first_id]
+
+        authenticated_client.post(f'/tasks/{first_id}/complete', data={'is_completed': 'true'})
+
+        response = authenticated_client.get('/tasks/ready', headers={'Accept': 'application/json'})
+        data = response.get_json()
+        assert [t['id'] for t in data['ready']] == [second_id]
+        assert data['blocked'] == []
+
+    def test_ready_page(self, authenticated_client, sample_task):
+        """Test the cross-project ready page renders"""
+        response = authenticated_client.get('/tasks/ready')
+        assert response.status_code == 200
+        assert b'Test Task' in response.data
@@ -0,0 +1,112 @@
+import pytest
+from datetime import datetime, timedelta
+from models import db, Project, Task, TaskClosure, ArchivedTask, ProjectArchive, task_dependencies, archived_task_dependencies
+from dependencies import add_dependencies
+import analytics
+import archive
+import stats
+
+
+def old_completed(project_id, title, importance='medium', days_ago=200):
+    completed_at = datetime.utcnow() - timedelta(days=days_ago)
+    return Task(title=title, project_id=project_id, importance=importance, is_completed=True,
+                completed_at=completed_at, start_date=completed_at - timedelta(days=2))
+
+
+@pytest.mark.unit
+class TestArchive:
+    def test_moves_old_completed_tasks_and_edges(self, app, sample_project):
+        """Test old completed tasks and their edges move in batches, open work stays"""
+        first = old_completed(sample_project, 'First', 'high')
+        second = old_completed(sample_project, 'Second')
+        recent = old_completed(sample_project, 'Recent', days_ago=1)
+        open_task = Task(title='Open', project_id=sample_project)
+        db.session.add_all([first, second, recent, open_task])
+        db.session.commit()
+        add_dependencies(sample_project, second.id, [first.id])
+        add_dependencies(sample_project, open_task.id, [second.id])
+        db.session.commit()
+        first_id, second_id, open_id = first.id, second.id, open_task.id
+
+        assert archive.archive_completed(older_than_days=90, batch_size=1) == 2
+
+        assert {task.title for task in Task.query} == {'Recent', 'Open'}
+        assert {task.title for task in ArchivedTask.query} == {'First', 'Second'}
+        assert db.session.query(task_dependencies).count() == 0
+        assert set(db.session.query(archived_task_dependencies)) == {
+            (second_id, first_id), (open_id, second_id)}
+        assert TaskClosure.query.count() == 0
+        assert db.session.get(Task, open_id).blocked_count == 0
+
+        counts = db.session.get(ProjectArchive, sample_project)
+        assert (counts.archived_tasks, counts.high_archived, counts.medium_archived) == (2, 1, 1)
+
+    def test_skips_tasks_with_open_prerequisites(self, app, sample_project):
+        """Test a task is not archived while one of its prerequisites is open"""
+        prerequisite = Task(title='Reopened', project_id=sample_project)
+        done = old_completed(sample_project, 'Done')
+        db.session.add_all([prerequisite, done])
+        db.session.commit()
+        add_dependencies(sample_project, done.id, [prerequisite.id])
+        db.session.commit()
+
+        assert archive.archive_completed(older_than_days=90) == 0
+
+    def test_waits_for_prerequisites_to_be_archived(self, app, sample_project):
+        """Test an old task stays live while its prerequisite is too recent to archive"""
+        prerequisite = old_completed(sample_project, 'Recent', days_ago=1)
+        done = old_completed(sample_project, 'Done')
+        db.session.add_all([prerequisite, done])
+        db.session.commit()
+        add_dependencies(sample_project, done.id, [prerequisite.id])
+        db.session.commit()
+        pair = (done.id, prerequisite.id)
+
+        assert archive.archive_completed(older_than_days=90) == 0
+        assert archive.archive_completed(older_than_days=0, batch_size=5) == 2
+        assert set(db.session.query(archived_task_dependencies)) == {pair}
+
+    def test_stats_and_analytics_include_archive(self, app, sample_project):
+        """Test totals are unchanged by archiving"""
+        db.session.add_all([old_completed(sample_project, 'Old', 'low'), Task(title='Open', project_id=sample_project)])
+        db.session.commit()
+        stats.rebuild()
+        db.session.commit()
+        before = stats.compute_project_stats()
+        cycle_before = analytics.cycle_times([sample_project])
+
+        archive.archive_completed(older_than_days=90)
+
+        assert stats.compute_project_stats() == before
+        assert stats.check() == []
+        assert analytics.task_totals([sample_project]) == (2, 1)
+        assert analytics.cycle_times([sample_project]) == cycle_before
+        assert db.session.get(Project, sample_project).get_completion_percentage() == 50
+
+
+@pytest.mark.integration
+class TestArchiveRoutes:
+    def test_browse_archive(self, authenticated_client, sample_project, app):
+        """Test the project page links to a paginated archive"""
+        db.session.add_all([old_completed(sample_project, f'Old {i}') for i in range(archive.ARCHIVE_PAGE_SIZE + 1)])
+        db.session.commit()
+        archive.archive_completed(older_than_days=90)
+
+        response = authenticated_client.get(f'/projects/{sample_project}')
+        assert f'{archive.ARCHIVE_PAGE_SIZE + 1} completed task(s)'.encode() in response.data
+
+        response = authenticated_client.get(f'/projects/{sample_project}/archive?page=2')
+        assert response.status_code == 200
+        assert b'Page 2 of 2' in response.data
+        assert response.data.count(b'<h3>Old ') == 1
+
+    def test_cli_and_project_delete(self, authenticated_client, runner, sample_project, app):
+        """Test the archive command and that deleting a project removes its archive"""
+        db.session.add(old_completed(sample_project, 'Old'))
+        db.session.commit()
+
+        assert '1 task(s) archived' in runner.invoke(args=['archive', 'run']).output
+
+        authenticated_client.post(f'/projects/{sample_project}/delete')
+        assert ArchivedTask.query.count() == 0
+        assert ProjectArchive.query.count() == 0
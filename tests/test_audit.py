@@ -0,0 +1,90 @@
+import pytest
+from datetime import datetime, timedelta
+from models import db, AuditEvent, Task
+from audit import AuditLog, replay_spill, settled
+
+JSON = {'Accept': 'application/json'}
+
+
+def event(number):
+    return {'occurred_at': datetime(2026, 1, 1), 'user_id': 1, 'project_id': 1, 'task_id': number,
+            'action': 'edit', 'details': {'n': number}}
+
+
+def edit_form(task, **overrides):
+    data = {'title': task.title, 'description': task.description or '', 'importance': task.importance,
+            'version': task.version}
+    data.update(overrides)
+    return data
+
+
+@pytest.mark.integration
+class TestTaskHistory:
+    def test_routes_record_history(self, authenticated_client, app, sample_project):
+        """Test create, edit, complete and delete each leave one event, readable after deletion"""
+        authenticated_client.post(f'/projects/{sample_project}/tasks/create', data={'title': 'Write docs'})
+        task = Task.query.filter_by(title='Write docs').one()
+        task_id = task.id
+        authenticated_client.post(f'/tasks/{task_id}/edit', data=edit_form(task, importance='high'))
+        authenticated_client.post(f'/tasks/{task_id}/complete', data={'is_completed': 'true'})
+        authenticated_client.post(f'/tasks/{task_id}/delete')
+
+        history = authenticated_client.get(f'/tasks/{task_id}/history?limit=3').get_json()
+        assert [entry['action'] for entry in history['events']] == ['delete', 'complete', 'edit']
+        assert history['events'][2]['details'] == {'importance': ['medium', 'high']}
+        rest = authenticated_client.get(f'/tasks/{task_id}/history?before={history["next"]}').get_json()
+        assert [entry['action'] for entry in rest['events']] == ['create'] and rest['next'] is None
+
+        project = authenticated_client.get(f'/projects/{sample_project}/history').get_json()
+        assert len(project['events']) == 4
+        assert authenticated_client.get('/tasks/99999/history').status_code == 404
+
+    def test_rolled_back_change_is_not_logged(self, authenticated_client, app, sample_task):
+        """Test an edit rejected as a conflict records nothing"""
+        task = db.session.get(Task, sample_task)
+        authenticated_client.post(f'/tasks/{sample_task}/edit', data=edit_form(task, title='Stale', version=99))
+        assert AuditEvent.query.count() == 0
+
+
+@pytest.mark.unit
+class TestAuditWriter:
+    def test_batches_and_drains_on_stop(self, app):
+        """Test the writer thread inserts in batches and stop() leaves nothing queued"""
+        app.config['AUDIT_WRITE_INLINE'] = False
+        app.config['AUDIT_BATCH_SIZE'] = 100
+        audit_log = AuditLog(app)
+        audit_log.enqueue([event(number) for number in range(250)])
+        audit_log.stop()
+
+        assert audit_log.written == 250 and audit_log.queue.empty()
+        assert AuditEvent.query.count() == 250
+
+    @pytest.mark.parametrize('policy', ['spill', 'drop'])
+    def test_full_queue_overflow(self, app, tmp_path, policy):
+        """Test events that don't fit are spilled to a file for replay, or dropped and counted"""
+        app.config.update(AUDIT_QUEUE_SIZE=2, AUDIT_OVERFLOW=policy,
+                          AUDIT_SPILL_PATH=str(tmp_path / 'spill.jsonl'))
+        audit_log = AuditLog(app)
+        audit_log.enqueue([event(number) for number in range(5)])
+
+        assert audit_log.queue.qsize() == 2
+        assert (audit_log.spilled, audit_log.dropped) == ((3, 0) if policy == 'spill' else (0, 3))
+        assert replay_spill(audit_log) == (3 if policy == 'spill' else 0)
+        assert audit_log.flush() == 2
+        assert AuditEvent.query.count() == (5 if policy == 'spill' else 2)
+
+    def test_readers_stop_short_of_recent_inserts(self, app):
+        """Test settled() stops at the first row inserted within AUDIT_SETTLE_SECONDS"""
+        now = datetime.utcnow()
+        old = now - timedelta(minutes=5)
+        # id 2 stands for a batch whose lower neighbours may still be committing
+        db.session.add_all([AuditEvent(id=number, occurred_at=old, action='create', written_at=written)
+                            for number, written in ((1, old), (2, now), (3, old))])
+        db.session.commit()
+
+        def ids(after_id, at):
+            return [row.id for row in settled(AuditEvent.query, after_id, at).order_by(AuditEvent.id)]
+
+        assert ids(0, now) == [1]
+        assert ids(1, now) == []
+        assert ids(0, now + timedelta(minutes=1)) == [1, 2, 3]
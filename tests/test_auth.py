@@ -147,6 +147,24 @@ class TestLogout:
         assert response.status_code == 200
 
 
+@pytest.mark.auth
+class TestAdminFlag:
+    def test_registration_never_grants_admin(self, client):
+        """Test a new account is not an admin, whatever its name"""
+        client.post('/register', data={'username': 'admin', 'email': 'admin@example.com',
+                                       'password': 'password123', 'confirm_password': 'password123'})
+        assert User.query.filter_by(username='admin').one().is_admin is False
+
+    def test_cli_grants_and_revokes(self, runner, sample_user):
+        """Test admin rights are set on an existing user from the CLI"""
+        assert 'now an admin' in runner.invoke(args=['users', 'admin', 'testuser']).output
+        assert db.session.get(User, sample_user).is_admin is True
+        runner.invoke(args=['users', 'admin', 'testuser', '--revoke'])
+        db.session.expire_all()
+        assert db.session.get(User, sample_user).is_admin is False
+        assert runner.invoke(args=['users', 'admin', 'nobody']).exit_code != 0
+
+
 @pytest.mark.auth
 class TestIndexAndDashboard:
     def test_index_redirects_to_login(self, client):
@@ -0,0 +1,145 @@
+import pytest
+from datetime import datetime
+from models import (db, Project, Task, TaskClosure, ProjectStats, UserStats, task_dependencies,
+                    archived_task_dependencies)
+from dependencies import add_dependencies, set_completion
+import closure
+import stats
+
+JSON = {'Accept': 'application/json'}
+
+
+def make_tasks(project_id, count):
+    tasks = [Task(title=f'Task {i}', project_id=project_id) for i in range(count)]
+    db.session.add_all(tasks)
+    db.session.commit()
+    return [task.id for task in tasks]
+
+
+def post(client, project_id, **body):
+    return client.post(f'/projects/{project_id}/tasks/bulk', json=body, headers=JSON)
+
+
+@pytest.fixture
+def other_project(app, sample_user):
+    project = Project(name='Other Project', user_id=sample_user)
+    db.session.add(project)
+    db.session.commit()
+    return project.id
+
+
+@pytest.mark.integration
+class TestBulkTasks:
+    def test_update(self, authenticated_client, app, sample_user, sample_project):
+        """Test one request changes every selected task and the rollup follows"""
+        ids = make_tasks(sample_project, 5)
+        stats.rebuild(sample_user)
+        db.session.commit()
+
+        response = post(authenticated_client, sample_project, action='update', task_ids=ids[:3],
+                        importance='high', expected_completion_date='2030-01-31')
+        assert response.get_json() == {'action': 'update', 'changed': 3}
+
+        rows = Task.query.filter(Task.id.in_(ids)).order_by(Task.id).all()
+        assert [task.importance for task in rows] == ['high'] * 3 + ['medium'] * 2
+        assert rows[0].expected_completion_date == datetime(2030, 1, 31) and rows[0].version == 2
+        assert db.session.get(ProjectStats, sample_project).high_total == 3
+        assert db.session.get(UserStats, sample_user).high_total == 3
+
+    @pytest.mark.parametrize('enabled', [True, False])
+    def test_delete(self, authenticated_client, app, sample_project, enabled):
+        """Test a selection is refused while outside tasks depend on it, then deleted with its edges"""
+        app.config['TASK_CLOSURE_ENABLED'] = enabled
+        a, b, c, d = make_tasks(sample_project, 4)
+        add_dependencies(sample_project, b, [a])
+        add_dependencies(sample_project, c, [b])
+        add_dependencies(sample_project, d, [c])
+        db.session.commit()
+
+        response = post(authenticated_client, sample_project, action='delete', task_ids=[b, c])
+        assert response.status_code == 400 and 'Task 3' in response.get_json()['error']
+        assert Task.query.filter_by(project_id=sample_project).count() == 4
+
+        response = post(authenticated_client, sample_project, action='delete', task_ids=[b, c, d])
+        assert response.get_json()['changed'] == 3
+        assert [task.id for task in Task.query.filter_by(project_id=sample_project)] == [a]
+        assert db.session.query(task_dependencies).count() == 0
+        assert TaskClosure.query.count() == 0
+
+    @pytest.mark.parametrize('enabled', [True, False])
+    def test_move(self, authenticated_client, app, sample_project, other_project, enabled):
+        """Test a subtree moves with its internal edges; edges to tasks left behind block the move"""
+        app.config['TASK_CLOSURE_ENABLED'] = enabled
+        a, b, c, d = make_tasks(sample_project, 4)
+        add_dependencies(sample_project, c, [b])
+        add_dependencies(sample_project, d, [c])
+        add_dependencies(sample_project, b, [a])
+        set_completion(db.session.get(Task, a), True)
+        db.session.commit()
+
+        response = post(authenticated_client, sample_project, action='move', task_ids=[c, d],
+                        target_project_id=other_project)
+        assert response.status_code == 400 and 'Task 2' in response.get_json()['error']
+
+        response = post(authenticated_client, sample_project, action='move', task_ids=[a, b, c, d],
+                        target_project_id=other_project)
+        assert response.get_json()['changed'] == 4
+        assert Task.query.filter_by(project_id=other_project).count() == 4
+        assert db.session.query(task_dependencies).count() == 3
+        assert db.session.get(Task, d).blocked_count == 1
+        if enabled:
+            assert TaskClosure.query.filter_by(project_id=sample_project).count() == 0
+            assert closure.check(other_project) == 0
+        assert db.session.get(ProjectStats, other_project).completed_tasks == 1
+
+    def test_edges_to_archived_tasks_block_move_and_delete(self, authenticated_client, app, sample_project,
+                                                           other_project):
+        """Test a live task stays put while archived history is linked to it"""
+        a, b = make_tasks(sample_project, 2)
+        db.session.execute(archived_task_dependencies.insert(), [{'task_id': b, 'depends_on_id': 99},
+                                                                 {'task_id': 98, 'depends_on_id': a}])
+        db.session.commit()
+
+        response = post(authenticated_client, sample_project, action='move', task_ids=[b],
+                        target_project_id=other_project)
+        assert response.status_code == 400 and 'Task 1' in response.get_json()['error']
+        response = post(authenticated_client, sample_project, action='delete', task_ids=[a])
+        assert response.status_code == 400 and 'Archived tasks depend on: Task 0' in response.get_json()['error']
+        assert post(authenticated_client, sample_project, action='delete', task_ids=[b]).status_code == 200
+        assert set(db.session.query(archived_task_dependencies)) == {(98, a)}
+
+    def test_rejects_foreign_and_bad_input(self, authenticated_client, app, sample_project, other_project):
+        """Test tasks from another project, unknown actions and unowned targets change nothing"""
+        [mine] = make_tasks(sample_project, 1)
+        [theirs] = make_tasks(other_project, 1)
+
+        response = post(authenticated_client, sample_project, action='update', task_ids=[mine, theirs],
+                        importance='low')
+        assert response.status_code == 400 and response.get_json()['error'] == f'Invalid task ID: {theirs}'
+        assert post(authenticated_client, sample_project, action='explode', task_ids=[mine]).status_code == 400
+        assert post(authenticated_client, sample_project, action='move', task_ids=[mine],
+                    target_project_id=99999).status_code == 400
+        assert post(authenticated_client, 99999, action='delete', task_ids=[mine]).status_code == 404
+        assert db.session.get(Task, mine).importance == 'medium'
+
+    def test_rejects_task_ids_that_are_not_a_list(self, authenticated_client, app, sample_project):
+        """Test a string or number for task_ids is a 400, not a character-by-character selection"""
+        make_tasks(sample_project, 2)
+        for task_ids in ('12', 12, {'1': 1}):
+            response = post(authenticated_client, sample_project, action='delete', task_ids=task_ids)
+            assert response.status_code == 400
+            assert response.get_json()['error'] == 'task_ids must be a list'
+        response = authenticated_client.post(f'/projects/{sample_project}/tasks/bulk', json=[1, 2], headers=JSON)
+        assert response.status_code == 400
+        assert Task.query.count() == 2
+
+    def test_form_post_from_project_page(self, authenticated_client, app, sample_project):
+        """Test the project page's multi-select form redirects back with a message"""
+        ids = make_tasks(sample_project, 2)
+        page = authenticated_client.get(f'/projects/{sample_project}').data
+        assert page.count(b'name="task_ids"') == 2
+
+        response = authenticated_client.post(f'/projects/{sample_project}/tasks/bulk',
+                                             data={'action': 'update', 'importance': 'low', 'task_ids': ids},
+                                             follow_redirects=True)
+        assert b'2 task(s) updated' in response.data
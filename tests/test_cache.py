@@ -0,0 +1,110 @@
+import os
+import stat
+
+import pytest
+from prometheus_client import CollectorRegistry
+from models import db, Task
+from cache import (Cache, LRUTier, SQLiteTier, get_cache, invalidate, project_scope,
+                   register_cache_metrics, shared_path)
+
+
+@pytest.mark.unit
+class TestCacheTiers:
+    def test_lru_evicts_least_recently_used(self):
+        """Test the local tier keeps its entry budget and counts evictions"""
+        tier = LRUTier(max_entries=2)
+        tier.set('a', 1, ttl=60)
+        tier.set('b', 2, ttl=60)
+        tier.get('a')
+        tier.set('c', 3, ttl=60)
+
+        assert (tier.get('a'), tier.get('b'), tier.get('c')) == (1, None, 3)
+        assert (tier.size(), tier.evictions) == (2, 1)
+
+    def test_workers_share_entries_and_invalidations(self, app, tmp_path):
+        """Test a bump committed by one worker hides entries cached in another worker's LRU"""
+        path = str(tmp_path / 'cache.sqlite3')
+        first = Cache(LRUTier(10), SQLiteTier(path, 100, 'secret'))
+        second = Cache(LRUTier(10), SQLiteTier(path, 100, 'secret'))
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            return value
+
+        assert first.get_or_set('project:1', 'page', lambda: compute('v1')) == 'v1'
+        assert second.get_or_set('project:1', 'page', lambda: compute('unused')) == 'v1'
+        assert calls == ['v1']
+
+        invalidate('project:1')
+        db.session.commit()
+        assert second.get_or_set('project:1', 'page', lambda: compute('v2')) == 'v2'
+
+        second.clear()
+        assert first.get_or_set('project:1', 'page', lambda: compute('v3')) == 'v3'
+
+    def test_unsigned_entries_are_misses(self, tmp_path):
+        """Test an entry written without the secret is never unpickled"""
+        path = str(tmp_path / 'cache.sqlite3')
+        SQLiteTier(path, 100, 'other secret').set('key', {'page': 1}, ttl=60)
+        tier = SQLiteTier(path, 100, 'secret')
+        assert tier.get('key') is None and tier.misses == 1
+
+    def test_shared_file_is_private_and_per_database(self, tmp_path):
+        """Test the file lives in an owner-only directory and is named after the database"""
+        config = {'CACHE_SHARED_DIR': str(tmp_path / 'cache'), 'SQLALCHEMY_DATABASE_URI': 'sqlite:///prod.db'}
+        path = shared_path(config)
+        assert path != shared_path({**config, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///staging.db'})
+        SQLiteTier(path, 100, 'secret').set('key', 1, ttl=60)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        assert stat.S_IMODE(os.stat(tmp_path / 'cache').st_mode) == 0o700
+
+        os.chmod(tmp_path / 'cache', 0o777)
+        with pytest.raises(PermissionError):
+            shared_path(config)
+
+    def test_unusable_shared_tier_falls_back_to_computing(self, app, tmp_path):
+        """Test the cache never fails a request when its file can't be opened"""
+        cache = Cache(LRUTier(10), SQLiteTier(str(tmp_path / 'missing' / 'cache.sqlite3'), 100, 'secret'))
+        assert cache.get_or_set('project:1', 'page', lambda: 'fresh') == 'fresh'
+
+
+@pytest.mark.integration
+class TestCacheInvalidation:
+    def test_invalidation_waits_for_commit(self, app):
+        """Test scopes are bumped in the committing transaction and forgotten on rollback"""
+        cache = get_cache()
+        invalidate(project_scope(1))
+        db.session.rollback()
+        assert cache.generation(project_scope(1)) == '0.0'
+
+        invalidate(project_scope(1))
+        db.session.commit()
+        assert cache.generation(project_scope(1)) == '0.1'
+
+    def test_task_write_refreshes_project_page(self, authenticated_client, sample_task, app):
+        """Test edits show up on the cached project page and listings straight away"""
+        task = db.session.get(Task, sample_task)
+        project_id = task.project_id
+        authenticated_client.get(f'/projects/{project_id}')
+        assert authenticated_client.get(f'/projects/{project_id}/tasks/ready').get_json()['tasks'][0]['id'] == sample_task
+
+        authenticated_client.post(f'/tasks/{sample_task}/edit', data={
+            'title': 'Renamed Task', 'description': '', 'importance': 'high', 'version': task.version})
+        assert b'Renamed Task' in authenticated_client.get(f'/projects/{project_id}').data
+
+        authenticated_client.post(f'/tasks/{sample_task}/complete', data={'is_completed': 'true'})
+        assert authenticated_client.get(f'/projects/{project_id}/tasks/ready').get_json()['tasks'] == []
+        assert authenticated_client.get('/tasks/ready', headers={'Accept': 'application/json'}).get_json()['ready'] == []
+
+    def test_metrics_per_tier(self, authenticated_client, sample_project, app):
+        """Test hit, miss and size metrics are exported for each tier"""
+        registry = CollectorRegistry()
+        register_cache_metrics(app, registry)
+        authenticated_client.get(f'/projects/{sample_project}')
+        authenticated_client.get(f'/projects/{sample_project}')
+
+        assert registry.get_sample_value('app_cache_hits_total', {'tier': 'local'}) == 1
+        assert registry.get_sample_value('app_cache_misses_total', {'tier': 'local'}) == 1
+        assert registry.get_sample_value('app_cache_hit_ratio', {'tier': 'local'}) == 0.5
+        assert registry.get_sample_value('app_cache_entries', {'tier': 'local'}) == 1
@@ -0,0 +1,123 @@
+import pytest
+from datetime import datetime, date
+from models import db, Project, Task, TaskClosure, ProjectStats, UserStats, task_dependencies
+from dependencies import add_dependencies, set_completion
+from cloning import clone_project, template_offset
+import closure
+import stats
+
+
+def build_source(project_id):
+    """a <- b <- c plus d <- c, with a completed"""
+    tasks = [Task(title=title, project_id=project_id, importance='high',
+                  start_date=datetime(2026, 1, 5 + i), expected_completion_date=datetime(2026, 2, 1 + i))
+             for i, title in enumerate('abcd')]
+    db.session.add_all(tasks)
+    db.session.flush()
+    a, b, c, d = tasks
+    add_dependencies(project_id, b.id, [a.id])
+    add_dependencies(project_id, c.id, [b.id, d.id])
+    set_completion(a, True)
+    db.session.commit()
+    return tasks
+
+
+def edges(project_id):
+    rows = (db.session.query(task_dependencies.c.task_id, task_dependencies.c.depends_on_id)
+            .join(Task, Task.id == task_dependencies.c.task_id)
+            .filter(Task.project_id == project_id))
+    titles = dict(db.session.query(Task.id, Task.title).filter(Task.project_id == project_id))
+    return {(titles[task_id], titles[depends_on_id]) for task_id, depends_on_id in rows}
+
+
+@pytest.mark.unit
+class TestCloneProject:
+    @pytest.mark.parametrize('enabled', [True, False])
+    def test_copies_tasks_edges_and_closure(self, app, sample_user, sample_project, enabled):
+        """Test tasks and edges are remapped, dates shifted and completion reset"""
+        app.config['TASK_CLOSURE_ENABLED'] = enabled
+        build_source(sample_project)
+        source = db.session.get(Project, sample_project)
+        source.deadline = datetime(2026, 3, 1)
+
+        clone = clone_project(source, 'Copy', sample_user, shift_days=10)
+        db.session.commit()
+
+        copies = {task.title: task for task in Task.query.filter_by(project_id=clone.id)}
+        assert sorted(copies) == ['a', 'b', 'c', 'd']
+        assert edges(clone.id) == edges(sample_project) == {('b', 'a'), ('c', 'b'), ('c', 'd')}
+        assert copies['a'].start_date == datetime(2026, 1, 15)
+        assert copies['d'].expected_completion_date == datetime(2026, 2, 14)
+        assert clone.deadline == datetime(2026, 3, 11) and clone.cloned_from_id == sample_project
+        assert not any(task.is_completed or task.completed_at for task in copies.values())
+        assert {title: task.blocked_count for title, task in copies.items()} == {'a': 0, 'b': 1, 'c': 2, 'd': 0}
+        if enabled:
+            assert TaskClosure.query.filter_by(project_id=clone.id).count() == 4
+            assert closure.check(clone.id) == 0
+
+    def test_stats_and_source_untouched(self, app, sample_user, sample_project):
+        """Test the clone is counted into the owner's totals and the source keeps its state"""
+        build_source(sample_project)
+        stats.rebuild(sample_user)
+        source = db.session.get(Project, sample_project)
+        user_before = db.session.get(UserStats, sample_user).total_tasks
+
+        clone = clone_project(source, 'Copy', sample_user)
+        db.session.commit()
+
+        assert db.session.get(ProjectStats, clone.id).total_tasks == 4
+        assert db.session.get(ProjectStats, clone.id).completed_tasks == 0
+        assert db.session.get(UserStats, sample_user).total_tasks == user_before + 4
+        assert Task.query.filter_by(project_id=sample_project, is_completed=True).count() == 1
+
+        # A template keeps its own counts but stays out of the owner's totals
+        template = clone_project(source, 'Template', sample_user, as_template=True)
+        db.session.commit()
+        assert db.session.get(ProjectStats, template.id).total_tasks == 4
+        assert db.session.get(UserStats, sample_user).total_tasks == user_before + 4
+        assert stats.check() == []
+
+    def test_deleting_the_source_keeps_its_copies(self, app, sample_user, sample_project, foreign_keys):
+        """Test the delete job clears the copies' lineage instead of failing their foreign key"""
+        from projects import delete_project_job
+
+        build_source(sample_project)
+        clone = clone_project(db.session.get(Project, sample_project), 'Copy', sample_user)
+        db.session.commit()
+
+        delete_project_job(sample_project)
+        db.session.expire_all()
+        assert db.session.get(Project, sample_project) is None
+        assert db.session.get(Project, clone.id).cloned_from_id is None
+        assert Task.query.filter_by(project_id=clone.id).count() == 4
+
+    def test_template_offset(self, app, sample_project):
+        """Test a start date is turned into the shift that moves the earliest task onto it"""
+        build_source(sample_project)
+        source = db.session.get(Project, sample_project)
+        assert template_offset(source, date(2026, 1, 1)) == -4
+
+
+@pytest.mark.integration
+class TestCloneRoutes:
+    def test_template_then_instantiate(self, authenticated_client, app, sample_project):
+        """Test saving a template and starting a project from it"""
+        build_source(sample_project)
+
+        response = authenticated_client.post(f'/projects/{sample_project}/clone',
+                                             data={'name': 'Launch template', 'as_template': 'on'})
+        template = Project.query.filter_by(name='Launch template').one()
+        assert response.status_code == 302 and template.is_template
+
+        authenticated_client.post(f'/projects/{template.id}/clone',
+                                  data={'name': 'Launch Q3', 'start_date': '2026-07-06'})
+        project = Project.query.filter_by(name='Launch Q3').one()
+        assert not project.is_template and project.cloned_from_id == template.id
+        first = Task.query.filter_by(project_id=project.id).order_by(Task.start_date).first()
+        assert first.start_date.date() == date(2026, 7, 6)
+
+    def test_validation_and_ownership(self, authenticated_client, app, sample_project):
+        """Test bad input re-renders the form and unknown projects 404"""
+        response = authenticated_client.post(f'/projects/{sample_project}/clone', data={'name': 'x'})
+        assert response.status_code == 200 and b'at least 3 characters' in response.data
+        assert authenticated_client.get('/projects/99999/clone').status_code == 404
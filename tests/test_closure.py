@@ -0,0 +1,137 @@
+import pytest
+from models import db, Task, TaskClosure
+from dependencies import add_dependencies, remove_dependencies, validate_dependency_ids
+import closure
+
+
+def make_tasks(project_id, count):
+    tasks = [Task(title=f'Task {i}', project_id=project_id) for i in range(count)]
+    db.session.add_all(tasks)
+    db.session.commit()
+    return [task.id for task in tasks]
+
+
+def stored_closure(project_id):
+    return {
+        (row.ancestor_id, row.descendant_id): row.path_count
+        for row in TaskClosure.query.filter_by(project_id=project_id)
+    }
+
+
+@pytest.mark.unit
+class TestClosureMaintenance:
+    @pytest.fixture(autouse=True)
+    def closure_on(self, app):
+        app.config['TASK_CLOSURE_ENABLED'] = True
+
+    def test_diamond_path_counts(self, app, sample_project):
+        """Test incremental updates count both paths through a diamond"""
+        a, b, c, d = make_tasks(sample_project, 4)
+        add_dependencies(sample_project, b, [a])
+        add_dependencies(sample_project, c, [a])
+        add_dependencies(sample_project, d, [b, c])
+        db.session.commit()
+
+        stored = stored_closure(sample_project)
+        assert stored[(a, d)] == 2
+        assert stored == closure.compute_project_closure(sample_project)
+
+    def test_remove_edge_keeps_other_paths(self, app, sample_project):
+        """Test removing one side of a diamond keeps the ancestor reachable"""
+        a, b, c, d = make_tasks(sample_project, 4)
+        add_dependencies(sample_project, b, [a])
+        add_dependencies(sample_project, c, [a])
+        add_dependencies(sample_project, d, [b, c])
+        db.session.commit()
+
+        remove_dependencies(sample_project, d, [b])
+        db.session.commit()
+
+        stored = stored_closure(sample_project)
+        assert stored[(a, d)] == 1 and (b, d) not in stored
+        assert closure.check(sample_project) == 0
+
+    def test_saturated_path_count_rebuilds_on_removal(self, app, sample_project, monkeypatch):
+        """Test path counts stop at the cap and a removal through one falls back to a rebuild"""
+        monkeypatch.setattr(closure, 'PATH_COUNT_CAP', 2)
+        a, b, c, d = make_tasks(sample_project, 4)
+        add_dependencies(sample_project, b, [a])
+        add_dependencies(sample_project, c, [a])
+        add_dependencies(sample_project, d, [a, b, c])
+        db.session.commit()
+        assert stored_closure(sample_project)[(a, d)] == 2  # three paths, saturated
+
+        remove_dependencies(sample_project, d, [b])
+        db.session.commit()
+        assert stored_closure(sample_project)[(a, d)] == 2
+        remove_dependencies(sample_project, d, [c])
+        db.session.commit()
+        assert stored_closure(sample_project)[(a, d)] == 1
+        assert closure.check(sample_project) == 0
+
+    def test_rebuild_matches_incremental(self, app, sample_project):
+        """Test a bulk rebuild produces the same rows"""
+        ids = make_tasks(sample_project, 5)
+        for index in range(1, 5):
+            add_dependencies(sample_project, ids[index], ids[:index])
+        db.session.commit()
+
+        before = stored_closure(sample_project)
+        closure.rebuild(sample_project)
+        db.session.commit()
+
+        assert stored_closure(sample_project) == before
+
+    def test_cycle_check_uses_closure(self, app, sample_project):
+        """Test an indirect cycle is rejected from the closure table alone"""
+        a, b, c = make_tasks(sample_project, 3)
+        add_dependencies(sample_project, b, [a])
+        add_dependencies(sample_project, c, [b])
+        db.session.commit()
+
+        deps, errors = validate_dependency_ids(sample_project, [str(c)], task_id=a)
+        assert deps == {}
+        assert 'circular' in errors[0]
+
+    def test_cli_rebuild_and_check(self, app, runner, sample_project):
+        """Test the closure CLI commands"""
+        a, b = make_tasks(sample_project, 2)
+        app.config['TASK_CLOSURE_ENABLED'] = False
+        add_dependencies(sample_project, b, [a])
+        db.session.commit()
+
+        result = runner.invoke(args=['closure', 'check'])
+        assert 'need a rebuild' in result.output
+
+        result = runner.invoke(args=['closure', 'rebuild'])
+        assert '1 closure row(s)' in result.output
+        assert runner.invoke(args=['closure', 'check']).output.strip() == 'closure OK'
+
+
+@pytest.mark.integration
+class TestClosureRoutes:
+    @pytest.mark.parametrize('enabled', [True, False])
+    def test_blockers_and_impacted(self, authenticated_client, app, sample_project, enabled):
+        """Test upstream and downstream endpoints with and without the closure table"""
+        app.config['TASK_CLOSURE_ENABLED'] = enabled
+        a, b, c = make_tasks(sample_project, 3)
+        add_dependencies(sample_project, b, [a])
+        add_dependencies(sample_project, c, [b])
+        db.session.commit()
+
+        response = authenticated_client.get(f'/tasks/{c}/blockers')
+        assert [t['id'] for t in response.get_json()['blockers']] == [a, b]
+
+        response = authenticated_client.get(f'/tasks/{a}/impacted')
+        assert [t['id'] for t in response.get_json()['impacted']] == [b, c]
+
+    def test_delete_task_removes_closure_rows(self, authenticated_client, app, sample_project):
+        """Test deleting a leaf task clears its closure rows"""
+        a, b = make_tasks(sample_project, 2)
+        add_dependencies(sample_project, b, [a])
+        db.session.commit()
+
+        authenticated_client.post(f'/tasks/{b}/delete')
+
+        assert TaskClosure.query.count() == 0
+        assert db.session.get(Task, b) is None
@@ -0,0 +1,158 @@
+import os
+import threading
+import pytest
+from config import Config
+from models import db, User, Project, Task
+from dependencies import add_dependencies, repair_blocked_counts
+
+JSON = {'Accept': 'application/json'}
+
+
+def edit_form(task, **overrides):
+    data = {'title': task.title, 'description': task.description or '', 'importance': task.importance}
+    data.update(overrides)
+    return data
+
+
+@pytest.mark.integration
+class TestOptimisticConcurrency:
+    def test_edit_task_bumps_version(self, authenticated_client, sample_task, app):
+        """Test a successful edit increments the version"""
+        task = db.session.get(Task, sample_task)
+        response = authenticated_client.post(f'/tasks/{sample_task}/edit',
+                                             data=edit_form(task, title='Renamed', version=1))
+        assert response.status_code == 302
+
+        db.session.expire_all()
+        assert (task.title, task.version) == ('Renamed', 2)
+
+    def test_stale_edit_is_rejected(self, authenticated_client, sample_task, app):
+        """Test an edit based on an old version is not saved"""
+        task = db.session.get(Task, sample_task)
+        authenticated_client.post(f'/tasks/{sample_task}/edit', data=edit_form(task, title='First', version=1))
+
+        response = authenticated_client.post(f'/tasks/{sample_task}/edit',
+                                             data=edit_form(task, title='Second', version=1))
+        assert response.status_code == 303
+        assert response.location.endswith(f'/tasks/{sample_task}/edit')
+
+        response = authenticated_client.post(f'/tasks/{sample_task}/edit', headers=JSON,
+                                             data=edit_form(task, title='Second', version=1))
+        assert response.status_code == 409
+        assert response.get_json()['version'] == 2
+
+        db.session.expire_all()
+        assert task.title == 'First'
+
+    def test_stale_completion_leaves_counts_alone(self, authenticated_client, sample_task, app):
+        """Test a conflicting completion does not touch dependents' blocked_count"""
+        dependent = Task(title='Dependent', project_id=db.session.get(Task, sample_task).project_id)
+        db.session.add(dependent)
+        db.session.commit()
+        add_dependencies(dependent.project_id, dependent.id, [sample_task])
+        db.session.commit()
+
+        authenticated_client.post(f'/tasks/{sample_task}/edit',
+                                  data=edit_form(db.session.get(Task, sample_task), version=1))
+        response = authenticated_client.post(f'/tasks/{sample_task}/complete', headers=JSON,
+                                             data={'is_completed': 'true', 'version': 1})
+
+        assert response.status_code == 409
+        db.session.expire_all()
+        assert db.session.get(Task, sample_task).is_completed is False
+        assert dependent.blocked_count == 1
+
+    def test_stale_project_edit_is_rejected(self, authenticated_client, sample_project, app):
+        """Test project edits are version checked too"""
+        form = {'name': 'Renamed Project', 'description': '', 'version': 1}
+        assert authenticated_client.post(f'/projects/{sample_project}/edit', data=form).status_code == 302
+        assert authenticated_client.post(f'/projects/{sample_project}/edit', data=form).status_code == 303
+        assert db.session.get(Project, sample_project).version == 2
+
+
+@pytest.fixture
+def file_app(tmp_path, monkeypatch):
+    """An app on a file database, so threads get their own connections"""
+    os.environ["TESTING"] = "True"
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path / "race.db"}')
+    from run import create_app
+
+    app = create_app()
+    app.config.update({"TESTING": True, "WTF_CSRF_ENABLED": False, "JOBS_RUN_INLINE": True,
+                       "CACHE_SHARED_DIR": str(tmp_path / "cache")})
+    with app.app_context():
+        db.create_all()
+        user = User(username='racer', email='racer@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        project = Project(name='Hot Project', user_id=user.id)
+        db.session.add(project)
+        db.session.commit()
+        counter = Task(title='Counter', description='0', project_id=project.id)
+        prerequisite = Task(title='Toggled', project_id=project.id)
+        dependents = [Task(title=f'Dependent {i}', project_id=project.id) for i in range(3)]
+        db.session.add_all([counter, prerequisite, *dependents])
+        db.session.commit()
+        for dependent in dependents:
+            add_dependencies(project.id, dependent.id, [prerequisite.id])
+        db.session.commit()
+        app.config['RACE_IDS'] = (counter.id, prerequisite.id)
+        db.session.remove()
+
+    yield app
+
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.mark.integration
+@pytest.mark.slow
+def test_many_writers_on_one_project(file_app):
+    """Test concurrent edits and toggles lose no updates and keep blocked_count exact"""
+    threads, rounds = 8, 15
+    counter_id, prerequisite_id = file_app.config['RACE_IDS']
+    outcomes = {'saved': 0, 'conflict': 0, 'error': 0}
+    lock = threading.Lock()
+
+    def current(task_id):
+        with file_app.app_context():
+            task = db.session.get(Task, task_id)
+            return task.version, task.description, task.is_completed
+
+    def writer(index):
+        client = file_app.test_client()
+        client.post('/login', data={'username': 'racer', 'password': 'password123'})
+        for round_ in range(rounds):
+            if (index + round_) % 2:
+                version, description, _ = current(counter_id)
+                response = client.post(f'/tasks/{counter_id}/edit', headers=JSON, data={
+                    'title': 'Counter', 'description': str(int(description) + 1),
+                    'importance': 'medium', 'version': version})
+            else:
+                version, _, completed = current(prerequisite_id)
+                response = client.post(f'/tasks/{prerequisite_id}/complete', headers=JSON, data={
+                    'is_completed': 'false' if completed else 'true', 'version': version})
+            kind = {302: 'saved', 409: 'conflict'}.get(response.status_code, 'error')
+            with lock:
+                outcomes[kind] += 1
+
+    workers = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert outcomes['error'] == 0
+    assert outcomes['saved'] >= rounds  # every round of contention lets at least one writer through
+
+    with file_app.app_context():
+        counter = db.session.get(Task, counter_id)
+        prerequisite = db.session.get(Task, prerequisite_id)
+        # every saved edit incremented the counter exactly once
+        assert int(counter.description) == counter.version - 1
+        assert outcomes['saved'] == (counter.version - 1) + (prerequisite.version - 1)
+        # no toggle was applied twice to the dependents
+        assert repair_blocked_counts() == 0
+        db.session.rollback()
@@ -0,0 +1,82 @@
+import pytest
+from datetime import datetime, timedelta
+from models import db, User, Project, Task
+import deadlines
+
+JSON = {'Accept': 'application/json'}
+NOW = datetime(2026, 3, 2, 12, 0)
+
+
+def add_tasks(project_id, *offsets_in_days, **fields):
+    tasks = [Task(title=f'Due {offset:+}', project_id=project_id,
+                  expected_completion_date=NOW + timedelta(days=offset), **fields)
+             for offset in offsets_in_days]
+    db.session.add_all(tasks)
+    db.session.commit()
+    return tasks
+
+
+@pytest.mark.unit
+class TestUpcoming:
+    def test_window_and_filters(self, app, sample_user, sample_project):
+        """Test only the user's open items due before the horizon are listed, overdue flagged"""
+        project = db.session.get(Project, sample_project)
+        project.deadline = NOW + timedelta(days=3)
+        add_tasks(sample_project, -2, 1, 30)
+        add_tasks(sample_project, 2, is_completed=True)
+        other = User(username='other', email='other@example.com', password_hash='x')
+        db.session.add(other)
+        db.session.commit()
+        stranger = Project(name='Stranger', user_id=other.id)
+        deleting = Project(name='Deleting', user_id=sample_user, is_deleting=True)
+        db.session.add_all([stranger, deleting])
+        db.session.commit()
+        add_tasks(stranger.id, 1)
+        add_tasks(deleting.id, 1)
+
+        items, cursor = deadlines.upcoming(sample_user, within_days=7, now=NOW)
+        assert [(item['kind'], item['title'], item['overdue']) for item in items] == [
+            ('task', 'Due -2', True), ('task', 'Due +1', False), ('project', 'Test Project', False)]
+        assert cursor is None
+
+        items, _ = deadlines.upcoming(sample_user, within_days=7, include_overdue=False, now=NOW)
+        assert [item['title'] for item in items] == ['Due +1', 'Test Project']
+
+    def test_keyset_pages_cover_everything_once(self, app, sample_user, sample_project):
+        """Test paging with ties on the due date returns every row exactly once, in order"""
+        project = db.session.get(Project, sample_project)
+        project.deadline = NOW + timedelta(days=1)
+        tasks = add_tasks(sample_project, *([1] * 4 + [0, 2, -1] * 3))
+
+        seen, cursor = [], None
+        while True:
+            items, next_cursor = deadlines.upcoming(sample_user, cursor=cursor and deadlines.decode_cursor(cursor),
+                                                    limit=3, now=NOW)
+            seen.extend((item['due'], item['kind'], item['id']) for item in items)
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+
+        assert len(seen) == len(tasks) + 1 == len(set(seen))
+        assert seen == sorted(seen, key=lambda key: (key[0], deadlines.KINDS.index(key[1]), key[2]))
+
+
+@pytest.mark.integration
+class TestDeadlineRoutes:
+    def test_json_and_html(self, authenticated_client, sample_project, app):
+        """Test the API pages with `after` and the page renders"""
+        add_tasks(sample_project, *range(-3, 3))
+
+        first = authenticated_client.get('/deadlines?limit=4', headers=JSON).get_json()
+        assert len(first['items']) == 4 and first['next']
+        rest = authenticated_client.get(f'/deadlines?limit=4&after={first["next"]}', headers=JSON).get_json()
+        assert len(rest['items']) == 2 and rest['next'] is None
+
+        response = authenticated_client.get('/deadlines?within=30')
+        assert response.status_code == 200
+        assert response.data.count(b'overdue</span>') >= 3
+
+    def test_bad_cursor(self, authenticated_client, app):
+        """Test a tampered cursor is a 400, not a server error"""
+        response = authenticated_client.get('/deadlines?after=bm9wZQ', headers=JSON)
+        assert response.status_code == 400
@@ -0,0 +1,181 @@
+import pytest
+from sqlalchemy import event
+from models import db, Task
+from dependencies import (validate_dependency_ids, sync_dependencies, current_dependency_ids,
+                          dependency_candidates)
+
+
+def make_tasks(project_id, count):
+    tasks = [Task(title=f'Task {i}', project_id=project_id) for i in range(count)]
+    db.session.add_all(tasks)
+    db.session.commit()
+    return tasks
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures('closure_mode')
+class TestDependencyValidation:
+    def test_valid_ids(self, app, sample_project):
+        """Test valid dependencies are returned keyed by ID"""
+        tasks = make_tasks(sample_project, 3)
+        deps, errors = validate_dependency_ids(sample_project, [str(tasks[0].id), str(tasks[1].id)])
+
+        assert errors == []
+        assert set(deps) == {tasks[0].id, tasks[1].id}
+
+    def test_invalid_and_self_ids(self, app, sample_project):
+        """Test unknown, malformed and self dependencies are rejected"""
+        tasks = make_tasks(sample_project, 1)
+        deps, errors = validate_dependency_ids(
+            sample_project, ['99999', 'abc', str(tasks[0].id)], task_id=tasks[0].id)
+
+        assert deps == {}
+        assert 'Task cannot depend on itself' in errors
+        assert 'Invalid dependency task ID: 99999' in errors
+        assert 'Invalid dependency task ID: abc' in errors
+
+    def test_circular_dependency(self, app, sample_project):
+        """Test indirect cycles are detected"""
+        a, b, c = make_tasks(sample_project, 3)
+        sync_dependencies(sample_project, b.id, [a.id])
+        sync_dependencies(sample_project, c.id, [b.id])
+        db.session.commit()
+
+        deps, errors = validate_dependency_ids(sample_project, [str(c.id)], task_id=a.id)
+        assert deps == {}
+        assert 'would create circular dependency' in errors[0]
+
+
+@pytest.mark.unit
+@pytest.mark.usefixtures('closure_mode')
+class TestSyncDependencies:
+    def test_only_changed_rows_written(self, app, sample_project):
+        """Test unchanged edges are neither deleted nor re-inserted"""
+        tasks = make_tasks(sample_project, 4)
+        target = tasks[3]
+        sync_dependencies(sample_project, target.id, [tasks[0].id, tasks[1].id])
+        db.session.commit()
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if 'task_dependencies' in statement and not statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            added, removed = sync_dependencies(sample_project, target.id, [tasks[1].id, tasks[2].id])
+            db.session.commit()
+        finally:
+            event.remove(engine, 'before_cursor_execute', capture)
+
+        assert added == {tasks[2].id}
+        assert removed == {tasks[0].id}
+        assert len(statements) == 2
+        assert current_dependency_ids(target.id) == {tasks[1].id, tasks[2].id}
+
+    def test_no_changes_writes_nothing(self, app, sample_project):
+        """Test saving identical dependencies is a no-op"""
+        tasks = make_tasks(sample_project, 2)
+        sync_dependencies(sample_project, tasks[1].id, [tasks[0].id])
+        db.session.commit()
+
+        assert sync_dependencies(sample_project, tasks[1].id, [tasks[0].id]) == (set(), set())
+
+
+@pytest.mark.unit
+class TestBlockedCount:
+    def test_edges_and_completion_update_count(self, app, sample_project):
+        """Test blocked_count follows edge changes and completion toggles"""
+        from dependencies import set_completion
+
+        a, b, c = make_tasks(sample_project, 3)
+        sync_dependencies(sample_project, c.id, [a.id, b.id])
+        db.session.commit()
+        assert db.session.get(Task, c.id).blocked_count == 2
+
+        set_completion(a, True)
+        db.session.commit()
+        db.session.refresh(c)
+        assert c.blocked_count == 1
+
+        sync_dependencies(sample_project, c.id, [a.id])
+        db.session.commit()
+        db.session.refresh(c)
+        assert c.blocked_count == 0
+
+        set_completion(a, False)
+        db.session.commit()
+        db.session.refresh(c)
+        assert c.blocked_count == 1
+
+    def test_repair_blocked_counts(self, app, sample_project, runner):
+        """Test the repair command fixes drifted counts"""
+        a, b = make_tasks(sample_project, 2)
+        b.dependencies.append(a)  # bypasses bookkeeping
+        db.session.commit()
+        assert b.blocked_count == 0
+
+        result = runner.invoke(args=['tasks', 'repair-blocked-counts'])
+        assert '1 task(s) repaired' in result.output
+        db.session.refresh(b)
+        assert b.blocked_count == 1
+
+
+@pytest.mark.unit
+class TestDependencyCandidates:
+    def test_prefix_match_and_limit(self, app, sample_project):
+        """Test titles are matched case-insensitively from the start, LIKE wildcards literally"""
+        for title in ['Deploy API', 'deploy docs', 'Design review', 'Redeploy', '100% done', '1000 rows']:
+            db.session.add(Task(title=title, project_id=sample_project))
+        db.session.commit()
+
+        titles = [row['title'] for row in dependency_candidates(sample_project, 'DEPL')]
+        assert titles == ['Deploy API', 'deploy docs']
+        assert [row['title'] for row in dependency_candidates(sample_project, '100%')] == ['100% done']
+        assert len(dependency_candidates(sample_project, 'de', limit=2)) == 2
+        assert len(dependency_candidates(sample_project, '')) == 6
+
+    @pytest.mark.parametrize('enabled', [True, False])
+    def test_cycles_excluded(self, app, sample_project, enabled):
+        """Test the task itself and everything downstream of it are not offered"""
+        app.config['TASK_CLOSURE_ENABLED'] = enabled
+        a, b, c, d = make_tasks(sample_project, 4)
+        sync_dependencies(sample_project, b.id, [a.id])
+        sync_dependencies(sample_project, c.id, [b.id])
+        db.session.commit()
+
+        ids = [row['id'] for row in dependency_candidates(sample_project, 'Task', task_id=a.id)]
+        assert ids == [d.id]
+        ids = [row['id'] for row in dependency_candidates(sample_project, 'Task', task_id=c.id)]
+        assert ids == [a.id, b.id, d.id]
+
+
+@pytest.mark.integration
+@pytest.mark.usefixtures('closure_mode')
+class TestDependencyPicker:
+    def test_search_route(self, authenticated_client, app, sample_project):
+        """Test the typeahead endpoint filters, limits and checks ownership"""
+        a, b, c = make_tasks(sample_project, 3)
+        sync_dependencies(sample_project, b.id, [a.id])
+        db.session.commit()
+
+        response = authenticated_client.get(
+            f'/projects/{sample_project}/tasks/dependency-candidates?q=task&task_id={a.id}&limit=1')
+        assert response.status_code == 200
+        assert response.get_json()['candidates'] == [{'id': c.id, 'title': 'Task 2', 'is_completed': False}]
+        assert authenticated_client.get('/projects/99999/tasks/dependency-candidates').status_code == 404
+
+    def test_forms_only_embed_selected_tasks(self, authenticated_client, app, sample_project):
+        """Test the task forms render the picked dependencies, not every task in the project"""
+        a, b, _ = make_tasks(sample_project, 3)
+        sync_dependencies(sample_project, b.id, [a.id])
+        db.session.commit()
+
+        page = authenticated_client.get(f'/projects/{sample_project}/tasks/create').data
+        assert b'name="dependencies"' not in page and b'dependency-candidates' in page
+
+        page = authenticated_client.get(f'/tasks/{b.id}/edit').data
+        assert page.count(b'name="dependencies"') == 1
+        assert f'value="{a.id}" checked'.encode() in page
@@ -0,0 +1,156 @@
+import time
+
+import pytest
+from datetime import datetime, timedelta
+from models import db, User, Job
+import jobs
+
+calls = []
+
+
+@jobs.job_handler('test.echo', concurrency=1)
+def echo_job(value):
+    calls.append(value)
+    return {'value': value}
+
+
+@jobs.job_handler('test.flaky', max_attempts=2)
+def flaky_job():
+    raise RuntimeError('boom')
+
+
+@jobs.job_handler('test.slow')
+def slow_job(seconds):
+    """Reports whether its heartbeat moved locked_at on while it ran"""
+    job = Job.query.filter_by(job_type='test.slow').one()
+    claimed_at = job.locked_at
+    db.session.commit()
+    time.sleep(seconds)
+    db.session.expire_all()
+    return {'refreshed': Job.query.filter_by(job_type='test.slow').one().locked_at > claimed_at}
+
+
+@pytest.fixture
+def queued_app(app):
+    """App with inline job execution turned off so jobs stay queued"""
+    app.config['JOBS_RUN_INLINE'] = False
+    app.config['JOB_RETRY_BACKOFF'] = 0
+    calls.clear()
+    return app
+
+
+@pytest.mark.unit
+class TestJobQueue:
+    def test_enqueue_unknown_type(self, queued_app):
+        """Test enqueueing an unregistered job type fails"""
+        with pytest.raises(ValueError):
+            jobs.enqueue('test.missing')
+
+    def test_run_pending_succeeds(self, queued_app):
+        """Test queued job is run and its result recorded"""
+        job = jobs.enqueue('test.echo', {'value': 42})
+        assert job.status == 'queued'
+
+        assert jobs.run_pending() == 1
+
+        job = db.session.get(Job, job.id)
+        assert job.status == 'succeeded'
+        assert job.attempts == 1
+        assert job.result == {'value': 42}
+        assert calls == [42]
+
+    def test_failed_job_is_retried_then_failed(self, queued_app):
+        """Test failing job is retried up to max_attempts"""
+        job = jobs.enqueue('test.flaky')
+
+        assert jobs.run_pending() == 2
+
+        job = db.session.get(Job, job.id)
+        assert job.status == 'failed'
+        assert job.attempts == 2
+        assert 'boom' in job.last_error
+
+    def test_retry_is_delayed_by_backoff(self, queued_app):
+        """Test a failed attempt is rescheduled in the future"""
+        queued_app.config['JOB_RETRY_BACKOFF'] = 60
+        job = jobs.enqueue('test.flaky')
+
+        assert jobs.run_pending() == 1
+
+        job = db.session.get(Job, job.id)
+        assert job.status == 'queued'
+        assert job.run_at > datetime.utcnow()
+
+    def test_stale_jobs_are_requeued_until_out_of_attempts(self, queued_app):
+        """Test a job whose worker vanished goes back on the queue, or fails once its attempts are used"""
+        spare = jobs.enqueue('test.echo', {'value': 1}, max_attempts=3)
+        spent = jobs.enqueue('test.echo', {'value': 2}, max_attempts=1)
+        for job in (spare, spent):
+            assert jobs.claim_job(job.id, 'gone')
+        Job.query.update({'locked_at': datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+
+        assert jobs.requeue_stale_jobs() == 1
+        assert db.session.get(Job, spare.id).status == 'queued'
+        assert db.session.get(Job, spent.id).status == 'failed'
+        assert jobs.run_pending() == 1 and calls == [1]
+
+    def test_heartbeat_keeps_a_long_job_locked(self, queued_app):
+        """Test a running job's lock is refreshed, so it is not handed to another worker"""
+        queued_app.config['JOB_LOCK_TIMEOUT'] = 0.3
+        job = jobs.enqueue('test.slow', {'seconds': 0.5})
+
+        assert jobs.run_pending() == 1
+        assert db.session.get(Job, job.id).result == {'refreshed': True}
+
+    def test_concurrency_limit(self, queued_app):
+        """Test no job is claimed while its type is at the concurrency limit"""
+        first = jobs.enqueue('test.echo', {'value': 1})
+        jobs.enqueue('test.echo', {'value': 2})
+
+        assert jobs.claim_next('worker-a') == first.id
+        assert jobs.claim_next('worker-b') is None
+
+    def test_inline_mode_runs_immediately(self, queued_app):
+        """Test inline mode runs the job inside enqueue"""
+        queued_app.config['JOBS_RUN_INLINE'] = True
+        job = jobs.enqueue('test.echo', {'value': 'now'})
+
+        assert job.status == 'succeeded'
+        assert calls == ['now']
+
+    def test_cli_run_pending(self, queued_app, runner):
+        """Test the run-pending CLI command drains the queue"""
+        jobs.enqueue('test.echo', {'value': 'cli'})
+
+        result = runner.invoke(args=['jobs', 'run-pending'])
+        assert '1 job(s) run' in result.output
+
+
+@pytest.mark.integration
+class TestJobRoutes:
+    def test_job_status(self, authenticated_client, queued_app):
+        """Test owner can poll job status"""
+        user = User.query.filter_by(username='testuser').first()
+        job = jobs.enqueue('test.echo', {'value': 1}, user_id=user.id)
+
+        response = authenticated_client.get(f'/jobs/{job.id}')
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'queued'
+
+    def test_job_status_hides_traceback(self, authenticated_client, queued_app):
+        """Test a failed job reports its error class, not the stored traceback"""
+        user = User.query.filter_by(username='testuser').first()
+        job = jobs.enqueue('test.flaky', user_id=user.id)
+        jobs.run_pending()
+
+        body = authenticated_client.get(f'/jobs/{job.id}').get_json()
+        assert body['error'] == 'RuntimeError'
+        assert 'last_error' not in body and 'Traceback' not in str(body)
+
+    def test_job_status_other_user(self, authenticated_client, queued_app):
+        """Test jobs of other users are not visible"""
+        job = jobs.enqueue('test.echo', {'value': 1})
+
+        response = authenticated_client.get(f'/jobs/{job.id}')
+        assert response.status_code == 404
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+from models import db, LeaderLease
+from jobs import job_handler
+from leader import Scheduler, acquire, release
+
+NOW = datetime(2030, 3, 1, 9, 0)
+runs = []
+
+
+@job_handler('test.periodic')
+def periodic_job():
+    runs.append(1)
+    return {'runs': len(runs)}
+
+
+@pytest.mark.unit
+class TestLeaderLease:
+    def test_one_holder_until_the_lease_runs_out(self, app):
+        """Test the first process leads, renews the same term, and is replaced only after expiry"""
+        assert acquire('cleanup', 'node-a:1', 30, NOW) == 1
+        assert acquire('cleanup', 'node-b:7', 30, NOW + timedelta(seconds=5)) is None
+        assert acquire('cleanup', 'node-a:1', 30, NOW + timedelta(seconds=20)) == 1
+
+        # node-a goes quiet: its last renewal lapses 30s later and node-b takes over
+        assert acquire('cleanup', 'node-b:7', 30, NOW + timedelta(seconds=49)) is None
+        assert acquire('cleanup', 'node-b:7', 30, NOW + timedelta(seconds=51)) == 2
+        assert acquire('cleanup', 'node-a:1', 30, NOW + timedelta(seconds=52)) is None
+
+    def test_release_hands_over_at_once(self, app):
+        """Test a released lease can be taken before it would have run out"""
+        acquire('cleanup', 'node-a:1', 30, NOW)
+        release('cleanup', 'node-a:1', NOW + timedelta(seconds=1))
+        assert acquire('cleanup', 'node-b:7', 30, NOW + timedelta(seconds=2)) == 2
+        assert db.session.get(LeaderLease, 'cleanup').holder == 'node-b:7'
+
+
+@pytest.mark.integration
+class TestScheduler:
+    def test_only_the_leader_runs_periodic_jobs(self, app):
+        """Test two schedulers share one schedule, with failover counted as transitions"""
+        runs.clear()
+        first = Scheduler(app, jobs={'test.periodic': 60}, holder='node-a:1')
+        second = Scheduler(app, jobs={'test.periodic': 60}, holder='node-b:7')
+
+        assert first.tick(NOW) == ['test.periodic']
+        assert second.tick(NOW + timedelta(seconds=1)) == []
+        first.join()
+        assert runs == [1] and first.is_leader('test.periodic') and not second.is_leader('test.periodic')
+
+        # Not due again until the interval has passed, whoever leads by then
+        assert first.tick(NOW + timedelta(seconds=20)) == []
+        assert second.tick(NOW + timedelta(seconds=45)) == []  # first's lease runs until +50
+        # first stops renewing; second takes over and keeps to the same schedule
+        assert second.tick(NOW + timedelta(seconds=55)) == []
+        assert second.tick(NOW + timedelta(seconds=61)) == ['test.periodic']
+        second.join()
+        assert len(runs) == 2
+
+        first.tick(NOW + timedelta(seconds=62))
+        assert first.transitions == {('test.periodic', 'acquired'): 1, ('test.periodic', 'lost'): 1}
+        assert second.terms == {'test.periodic': 2}
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+from models import db, AuditEvent, Project, Task, User
+from metrics import BusinessCollector, WorkerMetrics, take_snapshot
+from stats import rebuild
+
+
+def samples(collector):
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in collector.collect() for sample in family.samples}
+
+
+@pytest.mark.integration
+class TestBusinessMetrics:
+    def test_snapshot_from_rollups_and_audit_log(self, app, sample_user, sample_project):
+        """Test the snapshot counts tasks from the rollups and active users from the audit log"""
+        now = datetime.utcnow()
+        db.session.add_all([
+            Task(title='Open', project_id=sample_project),
+            Task(title='Late', project_id=sample_project, expected_completion_date=now - timedelta(days=1)),
+            Task(title='Done', project_id=sample_project, is_completed=True),
+            Project(name='Template', user_id=sample_user, is_template=True),
+        ])
+        db.session.commit()
+        rebuild()
+        db.session.add(AuditEvent(occurred_at=now - timedelta(hours=2), written_at=now - timedelta(hours=2),
+                                  user_id=sample_user, project_id=sample_project, action='create'))
+        db.session.commit()
+
+        values = take_snapshot(now)
+        assert values == {'tasks_open': 2, 'tasks_completed': 1, 'tasks_overdue': 1, 'users': 1,
+                          'projects': 1, 'templates': 1, 'users_active_1d': 1, 'users_active_7d': 1}
+        assert db.session.get(User, sample_user).last_active_at == now - timedelta(hours=2)
+
+        # Served from the snapshot rows, not recounted
+        Task.query.delete()
+        db.session.commit()
+        served = samples(BusinessCollector(app))
+        assert served[('app_tasks', (('state', 'open'),))] == 2
+        assert served[('app_users_active', (('window', '1d'),))] == 1
+        assert served[('app_projects', (('kind', 'template'),))] == 1
+
+        assert take_snapshot(now + timedelta(days=2))['users_active_1d'] == 0
+
+    def test_nothing_served_before_the_first_snapshot(self, app):
+        """Test an empty snapshot table yields no business samples"""
+        assert samples(BusinessCollector(app)) == {}
+
+
+class FakeCollector:
+    def __init__(self):
+        self.hits = 0
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+        yield CounterMetricFamily('test_bridge_hits', 'Hits', value=self.hits)
+        depth = GaugeMetricFamily('test_bridge_depth', 'Depth', labels=['queue'])
+        depth.add_metric(['a'], self.hits * 2)
+        yield depth
+
+
+@pytest.mark.unit
+class TestWorkerMetrics:
+    def test_publish_moves_counters_by_the_difference(self, app):
+        """Test counters are copied as increments and gauges as current values"""
+        collector = FakeCollector()
+        worker_metrics = WorkerMetrics(interval=60)
+        worker_metrics.register(collector)
+
+        collector.hits = 3
+        worker_metrics.publish()
+        collector.hits = 5
+        worker_metrics.publish()
+        worker_metrics.publish()
+
+        published = {}
+        for metric in worker_metrics._metrics.values():
+            for family in metric.collect():
+                for sample in family.samples:
+                    published[sample.name, tuple(sample.labels.values())] = sample.value
+        assert published['test_bridge_hits_total', ()] == 5
+        assert published['test_bridge_depth', ('a',)] == 10
@@ -0,0 +1,166 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from models import db, Job, Project, Subscription, Task, Watermark
+from notifications import dispatch_pending, sign
+
+LATER = timedelta(minutes=1)
+
+
+@pytest.fixture
+def receiver(app):
+    """Local HTTP endpoint that records each POST; set .failures to answer 500 first"""
+    app.config['NOTIFY_ALLOW_PRIVATE_URLS'] = True
+    posts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            posts.append({'body': body, 'signature': self.headers['X-Signature']})
+            status = 500 if server.failures > 0 else 204
+            server.failures -= 1
+            self.send_response(status)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.failures = 0
+    server.posts = posts
+    server.url = f'http://127.0.0.1:{server.server_port}/hook'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def subscribe(client, project_id, url, **extra):
+    response = client.post(f'/projects/{project_id}/subscriptions', json={'url': url, **extra})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+@pytest.mark.integration
+class TestNotifications:
+    def test_coalesced_signed_delivery(self, authenticated_client, app, sample_task, receiver):
+        """Test a burst of changes to one task arrives as one signed notification per type"""
+        created = subscribe(authenticated_client, Task.query.get(sample_task).project_id, receiver.url)
+        for state in ('true', 'false', 'true'):
+            authenticated_client.post(f'/tasks/{sample_task}/complete', data={'is_completed': state})
+
+        assert dispatch_pending() == 0  # still inside the coalescing window
+        assert dispatch_pending(datetime.utcnow() + LATER) == 1
+
+        assert len(receiver.posts) == 1
+        post = receiver.posts[0]
+        assert post['signature'] == sign(created['secret'], post['body'])
+        events = json.loads(post['body'])['events']
+        assert [(event['type'], event['task_id']) for event in events] == \
+            [('task.completed', sample_task), ('task.reopened', sample_task)]
+        assert events[0]['coalesced'] == 2
+
+        # The watermark moved, so nothing is sent twice
+        assert dispatch_pending(datetime.utcnow() + LATER) == 0
+        assert db.session.get(Watermark, 'notifications').last_id > 0
+
+    def test_failed_delivery_is_retried_with_backoff(self, authenticated_client, app, sample_task, receiver):
+        """Test a 500 leaves the batch queued for a later attempt, which then succeeds"""
+        project_id = Task.query.get(sample_task).project_id
+        subscribe(authenticated_client, project_id, receiver.url, events=['task.deadline_changed'])
+        task = Task.query.get(sample_task)
+        authenticated_client.post(f'/tasks/{sample_task}/edit', data={
+            'title': task.title, 'importance': task.importance, 'version': task.version,
+            'expected_completion_date': '2030-01-31'})
+        authenticated_client.post(f'/tasks/{sample_task}/complete', data={'is_completed': 'true'})
+
+        receiver.failures = 1
+        dispatch_pending(datetime.utcnow() + LATER)
+        job = Job.query.filter_by(job_type='notifications.deliver').one()
+        assert job.status == 'queued' and job.attempts == 1 and job.run_at > datetime.utcnow()
+
+        from jobs import claim_job, execute_job
+        assert claim_job(job.id, 'test') and execute_job(job.id)
+        assert len(receiver.posts) == 2
+        events = json.loads(receiver.posts[1]['body'])['events']
+        assert [event['type'] for event in events] == ['task.deadline_changed']
+        assert events[0]['expected_completion_date'].startswith('2030-01-31')
+
+    def test_gone_deactivates_subscription(self, app, sample_project):
+        """Test a 410 from the receiver turns the subscription off instead of retrying"""
+        from unittest import mock
+        import urllib.error
+        from notifications import deliver_job
+
+        app.config['NOTIFY_ALLOW_PRIVATE_URLS'] = True
+        subscription = Subscription(project_id=sample_project, url='http://127.0.0.1:9/gone',
+                                    events=['task.completed'], secret='s')
+        db.session.add(subscription)
+        db.session.commit()
+        gone = urllib.error.HTTPError(subscription.url, 410, 'Gone', {}, None)
+        with mock.patch('urllib.request.urlopen', side_effect=gone):
+            assert deliver_job(subscription.id, [{'type': 'task.completed'}]) == {'deactivated': True}
+        assert db.session.get(Subscription, subscription.id).is_active is False
+
+    def test_subscription_routes(self, authenticated_client, app, sample_project):
+        """Test subscriptions are validated, listed without their secret and deleted"""
+        url = f'/projects/{sample_project}/subscriptions'
+        assert authenticated_client.post(url, json={'url': 'ftp://example.com'}).status_code == 400
+        assert authenticated_client.post(url, json={'url': 'https://93.184.215.14/hook',
+                                                    'events': ['task.exploded']}).status_code == 400
+        created = subscribe(authenticated_client, sample_project, 'https://93.184.215.14/hook')
+        assert len(created['secret']) == 64
+
+        listed = authenticated_client.get(url).get_json()['subscriptions']
+        assert [row['id'] for row in listed] == [created['id']] and 'secret' not in listed[0]
+        assert authenticated_client.get('/projects/99999/subscriptions').status_code == 404
+
+        assert authenticated_client.delete(f'{url}/{created["id"]}').status_code == 204
+        assert Subscription.query.count() == 0
+
+    def test_private_addresses_are_refused(self, authenticated_client, app, sample_project, receiver):
+        """Test internal receivers are refused when subscribing and again when delivering"""
+        from notifications import DeliveryError, deliver_job
+
+        app.config['NOTIFY_ALLOW_PRIVATE_URLS'] = False
+        for url in ('http://127.0.0.1/hook', 'http://169.254.169.254/latest', 'https://10.0.0.8/hook',
+                    'http://[::1]:8080/hook', 'http://[::ffff:127.0.0.1]/hook'):
+            response = authenticated_client.post(f'/projects/{sample_project}/subscriptions', json={'url': url})
+            assert response.status_code == 400
+            assert response.get_json()['error'] == 'url must point at a public address'
+
+        # Say the name pointed somewhere public when it was subscribed
+        subscription = Subscription(project_id=sample_project, url=receiver.url, events=['task.completed'],
+                                    secret='s')
+        db.session.add(subscription)
+        db.session.commit()
+        with pytest.raises(DeliveryError, match='non-public address'):
+            deliver_job(subscription.id, [{'type': 'task.completed'}])
+        assert receiver.posts == []
+
+    def test_project_delete_removes_subscriptions(self, authenticated_client, app, sample_project, foreign_keys):
+        """Test deleting a project drops its subscriptions at once, so the delete job can remove it"""
+        from projects import delete_project_job
+
+        app.config['JOBS_RUN_INLINE'] = False
+        db.session.add(Subscription(project_id=sample_project, url='https://93.184.215.14/hook',
+                                    events=['task.completed'], secret='s'))
+        db.session.commit()
+
+        authenticated_client.post(f'/projects/{sample_project}/delete')
+        assert Subscription.query.count() == 0
+        delete_project_job(sample_project)
+        db.session.expire_all()
+        assert db.session.get(Project, sample_project) is None
+
+    def test_no_subscriptions_without_the_audit_log(self, authenticated_client, app, sample_project):
+        """Test subscribing is refused while the audit log that feeds notifications is off"""
+        app.config['AUDIT_ENABLED'] = False
+        response = authenticated_client.post(f'/projects/{sample_project}/subscriptions',
+                                             json={'url': 'https://example.com/hook'})
+        assert response.status_code == 409
+        assert Subscription.query.count() == 0
@@ -0,0 +1,105 @@
+import os
+import time
+import pytest
+from config import Config
+from models import db, User, Project
+from profiler import list_profiles
+
+
+@pytest.fixture
+def profiled_app(monkeypatch, tmp_path):
+    """Build an app with profiler settings; they are read when the app is created"""
+    os.environ["TESTING"] = "True"
+    apps = []
+
+    def build(**settings):
+        settings = {'PROFILE_DIR': str(tmp_path / 'profiles'), 'PROFILE_MAX_FILES': 3,
+                    'PROFILE_SAMPLE_INTERVAL_MS': 1, **settings}
+        for name, value in settings.items():
+            monkeypatch.setattr(Config, name, value)
+        from run import create_app
+
+        app = create_app()
+        app.config.update({'TESTING': True, 'CACHE_BACKEND': 'local'})
+        apps.append(app)
+        # No app context is left pushed, so each request gets its own `g` (and logged-in user)
+        with app.app_context():
+            db.create_all()
+            for username in ('admin', 'someone'):
+                user = User(username=username, email=f'{username}@example.com', is_admin=username == 'admin')
+                user.set_password('password123')
+                db.session.add(user)
+            db.session.commit()
+        return app
+
+    yield build
+
+    for app in apps:
+        with app.app_context():
+            db.drop_all()
+
+
+def logged_in(app, username):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': 'password123'})
+    return client
+
+
+@pytest.mark.integration
+class TestProfiler:
+    def test_idle_by_default(self, app):
+        """Test no request hooks are installed unless a profiling mode is on"""
+        assert 'profiler' not in app.extensions
+
+    def test_sampled_requests_kept_in_ring_buffer(self, profiled_app):
+        """Test sampled requests are saved with their tags and only the newest are kept"""
+        app = profiled_app(PROFILE_SAMPLE_RATE=1.0)
+        with app.app_context():
+            project = Project(name='Profiled', user_id=User.query.filter_by(username='admin').one().id)
+            db.session.add(project)
+            db.session.commit()
+            project_id = project.id
+        client = logged_in(app, 'admin')
+
+        for page in range(5):
+            client.get(f'/projects/{project_id}?page={page}')
+
+        profiles = list_profiles(Config.PROFILE_DIR)
+        assert len(profiles) == 3
+        assert len(os.listdir(Config.PROFILE_DIR)) == 6
+        newest = profiles[0]
+        assert (newest['endpoint'], newest['reason']) == ('view_project', 'sampled')
+        assert newest['view_args'] == {'project_id': project_id}
+        assert newest['args'] == {'page': ['4']}
+
+        listed = client.get('/admin/profiles').get_json()['profiles']
+        assert [profile['name'] for profile in listed] == [profile['name'] for profile in profiles]
+        assert len(client.get('/admin/profiles?limit=-2').get_json()['profiles']) == 1
+        assert len(client.get('/admin/profiles?limit=1000000').get_json()['profiles']) == 3
+        assert b'cumulative' in client.get(f'/admin/profiles/{newest["file"]}?format=text').data
+        assert client.get(f'/admin/profiles/{newest["name"]}.json').status_code == 404
+
+    def test_only_slow_requests_kept(self, profiled_app):
+        """Test stack samples are saved for requests over the threshold only"""
+        app = profiled_app(PROFILE_SLOW_MS=30)
+
+        @app.route('/slow')
+        def slow_view():
+            time.sleep(0.06)
+            return 'done'
+
+        client = app.test_client()
+        client.get('/login')
+        client.get('/slow')
+
+        [profile] = list_profiles(Config.PROFILE_DIR)
+        assert (profile['endpoint'], profile['reason']) == ('slow_view', 'slow')
+        folded = logged_in(app, 'admin').get(f'/admin/profiles/{profile["file"]}').data.decode()
+        assert 'slow_view (test_profiler.py:' in folded
+
+    def test_admin_only(self, profiled_app):
+        """Test other users can't tell the profile routes exist"""
+        app = profiled_app(PROFILE_SAMPLE_RATE=0.5)
+        assert app.test_client().get('/admin/profiles').status_code == 302
+        assert logged_in(app, 'someone').get('/admin/profiles').status_code == 404
+        assert logged_in(app, 'admin').get('/admin/profiles').status_code == 200
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+from models import db, Job, Project, Reminder, Subscription, Task
+from reminders import scan_due
+from audit import get_audit_log
+
+NOW = datetime(2030, 3, 1, 9, 0)
+
+
+def add_task(project_id, title, due, **fields):
+    task = Task(title=title, project_id=project_id, expected_completion_date=due, **fields)
+    db.session.add(task)
+    db.session.commit()
+    return task.id
+
+
+def reminded():
+    return sorted((row.kind, row.target_id) for row in Reminder.query)
+
+
+@pytest.mark.integration
+class TestReminders:
+    def test_each_slice_is_scanned_once(self, app, sample_project):
+        """Test tasks and deadlines are reminded when they come within the lead, and only once"""
+        soon = add_task(sample_project, 'Soon', NOW + timedelta(hours=2))
+        later = add_task(sample_project, 'Later', NOW + timedelta(days=3))
+        add_task(sample_project, 'Done', NOW + timedelta(hours=3), is_completed=True)
+        db.session.get(Project, sample_project).deadline = NOW + timedelta(hours=20)
+        db.session.commit()
+
+        assert scan_due(NOW) == 2
+        assert reminded() == [('project', sample_project), ('task', soon)]
+        assert scan_due(NOW + timedelta(minutes=1)) == 0
+
+        assert scan_due(NOW + timedelta(days=2, hours=1)) == 1
+        assert reminded()[-1] == ('task', later)
+
+    def test_moved_due_date_reminds_again(self, app, sample_project):
+        """Test a due date moved into an already scanned slice is found through the audit log"""
+        task_id = add_task(sample_project, 'Soon', NOW + timedelta(hours=2))
+        assert scan_due(NOW) == 1
+
+        # Bulk edits are audited like single ones; the reminder table keys on the due date
+        from bulk import bulk_update
+        bulk_update(db.session.get(Project, sample_project), [task_id],
+                    expected_completion_date=NOW + timedelta(hours=5))
+        db.session.commit()
+        get_audit_log().flush()  # outside a request nothing flushes the writer queue
+        assert scan_due(NOW + timedelta(minutes=1)) == 1
+        assert Reminder.query.filter_by(target_id=task_id).count() == 2
+
+    def test_deadline_set_inside_a_scanned_slice(self, authenticated_client, app, sample_project):
+        """Test project deadlines from creates and edits, and tasks moved out of a template, are found"""
+        assert scan_due(NOW) == 0
+        authenticated_client.post(f'/projects/{sample_project}/edit', data={
+            'name': 'Test Project', 'deadline': '2030-03-02'})
+        authenticated_client.post('/projects/create', data={'name': 'Launch', 'deadline': '2030-03-02'})
+        created = Project.query.filter_by(name='Launch').one().id
+
+        from bulk import bulk_move
+        template = Project(name='Template', user_id=db.session.get(Project, sample_project).user_id,
+                           is_template=True)
+        db.session.add(template)
+        db.session.commit()
+        task_id = add_task(template.id, 'Step', NOW + timedelta(hours=4))
+        bulk_move(template, [task_id], db.session.get(Project, sample_project))
+        db.session.commit()
+        get_audit_log().flush()
+
+        assert scan_due(NOW + timedelta(minutes=1)) == 3
+        assert reminded() == sorted([('project', sample_project), ('project', created), ('task', task_id)])
+
+    def test_reminders_are_delivered_to_subscribers(self, app, sample_project):
+        """Test due-soon reminders are queued as notifications for subscriptions that want them"""
+        db.session.add(Subscription(project_id=sample_project, url='http://127.0.0.1:9/hook',
+                                    events=['task.due_soon'], secret='s'))
+        db.session.commit()
+        task_id = add_task(sample_project, 'Soon', NOW + timedelta(hours=2))
+        db.session.get(Project, sample_project).deadline = NOW + timedelta(hours=3)
+        db.session.commit()
+
+        assert scan_due(NOW) == 2
+        job = Job.query.filter_by(job_type='notifications.deliver').one()
+        assert [(event['type'], event['task_id']) for event in job.payload['events']] == \
+            [('task.due_soon', task_id)]
@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import inspect, text
+from models import db, Task
+import schema
+
+# Tables as they were before schema versioning was introduced
+LEGACY_DDL = [
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, '
+    'email VARCHAR(120) NOT NULL UNIQUE, password_hash VARCHAR(255) NOT NULL, created_at DATETIME)',
+    'CREATE TABLE project (id INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, description TEXT, '
+    'created_at DATETIME, deadline DATETIME, user_id INTEGER NOT NULL REFERENCES user (id))',
+    'CREATE TABLE task (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, description TEXT, '
+    'start_date DATETIME, expected_completion_date DATETIME, importance VARCHAR(20), '
+    'is_completed BOOLEAN, completed_at DATETIME, project_id INTEGER NOT NULL REFERENCES project (id))',
+    'CREATE TABLE task_dependencies (task_id INTEGER NOT NULL REFERENCES task (id), '
+    'depends_on_id INTEGER NOT NULL REFERENCES task (id), PRIMARY KEY (task_id, depends_on_id))',
+]
+
+
+@pytest.fixture
+def empty_db(app):
+    db.drop_all()
+    yield
+    db.session.rollback()
+
+
+@pytest.mark.unit
+class TestSchemaVersioning:
+    def test_check_fails_when_unversioned(self, app):
+        """Test startup check rejects a database with no version row"""
+        with pytest.raises(schema.SchemaError, match='db upgrade'):
+            schema.check_schema()
+
+    def test_upgrade_fresh_database(self, app, empty_db):
+        """Test an empty database is created and stamped at HEAD"""
+        assert schema.upgrade() == [schema.HEAD]
+        assert schema.current_version() == schema.HEAD
+        schema.check_schema()
+
+    def test_upgrade_legacy_database(self, app, empty_db):
+        """Test pre-versioning tables are upgraded step by step"""
+        for statement in LEGACY_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO user (id, username, email, password_hash) VALUES (1, 'u', 'u@x', 'h')"))
+        db.session.execute(text("INSERT INTO project (id, name, user_id) VALUES (1, 'p', 1)"))
+        db.session.execute(text("INSERT INTO task (id, title, project_id, is_completed) VALUES (1, 'a', 1, 0)"))
+        db.session.execute(text("INSERT INTO task (id, title, project_id, is_completed) VALUES (2, 'b', 1, 0)"))
+        db.session.execute(text("INSERT INTO task_dependencies (task_id, depends_on_id) VALUES (2, 1)"))
+        db.session.commit()
+
+        assert schema.upgrade() == [version for version, _, _ in schema.MIGRATIONS]
+
+        columns = {column['name'] for column in inspect(db.engine).get_columns('task')}
+        assert 'blocked_count' in columns
+        assert db.session.get(Task, 2).blocked_count == 1
+        schema.check_schema()
+
+    def test_upgrade_is_idempotent(self, app, empty_db):
+        """Test running upgrade twice applies nothing the second time"""
+        schema.upgrade()
+        assert schema.upgrade() == []
+
+    def test_check_rejects_old_version(self, app, empty_db):
+        """Test startup check rejects a database behind the code"""
+        schema.upgrade()
+        db.session.execute(text('UPDATE schema_version SET version = 1'))
+        db.session.commit()
+
+        with pytest.raises(schema.SchemaError, match='version 1'):
+            schema.check_schema()
+
+    def test_cli_upgrade(self, app, runner, empty_db):
+        """Test the db upgrade and current commands"""
+        assert f'created schema at version {schema.HEAD}' in runner.invoke(args=['db', 'upgrade']).output
+        assert f'database: {schema.HEAD}' in runner.invoke(args=['db', 'current']).output
@@ -0,0 +1,120 @@
+import pytest
+from datetime import datetime, timedelta
+from models import db, User, Project, Task, UserStats, ProjectStats
+import stats
+
+
+@pytest.mark.unit
+class TestStatsRollup:
+    def test_rebuild_counts(self, app, sample_project):
+        """Test bulk rebuild aggregates completion, importance and due dates"""
+        now = datetime.utcnow()
+        db.session.add_all([
+            Task(title='Done', project_id=sample_project, importance='high', is_completed=True),
+            Task(title='Late', project_id=sample_project, importance='high',
+                 expected_completion_date=now - timedelta(days=1)),
+            Task(title='Soon', project_id=sample_project, importance='low',
+                 expected_completion_date=now + timedelta(days=2)),
+        ])
+        db.session.commit()
+
+        stats.rebuild()
+        db.session.commit()
+
+        user_stats = UserStats.query.one()
+        assert user_stats.total_tasks == 3
+        assert user_stats.completed_tasks == 1
+        assert user_stats.overdue_tasks == 1
+        assert user_stats.due_this_week == 1
+        assert (user_stats.high_completed, user_stats.high_total) == (1, 2)
+        assert db.session.get(ProjectStats, sample_project).get_completion_percentage() == 33
+
+    def test_check_detects_drift(self, app, sample_project):
+        """Test the consistency check flags stale rows"""
+        stats.rebuild()
+        db.session.commit()
+        assert stats.check() == []
+
+        db.session.add(Task(title='Untracked', project_id=sample_project))
+        db.session.commit()
+        assert ('project', sample_project) in stats.check()
+
+    def test_time_dependent_counts_do_not_drift(self, app, sample_user, sample_project):
+        """Test a task that fell due since the last refresh is counted as of that refresh"""
+        now = datetime.utcnow()
+        task = Task(title='Slipped', project_id=sample_project, expected_completion_date=now - timedelta(hours=1))
+        db.session.add(task)
+        db.session.commit()
+        stats.rebuild()
+        # As if the refresh ran two hours ago, when the task was still due this week
+        for model in (UserStats, ProjectStats):
+            model.query.update({'refreshed_at': now - timedelta(hours=2), 'overdue_tasks': 0, 'due_this_week': 1})
+        db.session.commit()
+        assert stats.check() == []
+
+        before = stats.snapshot(task)
+        task.is_completed = True
+        stats.record_change(sample_project, sample_user, before, stats.snapshot(task))
+        db.session.commit()
+        db.session.expire_all()
+        user_stats = db.session.get(UserStats, sample_user)
+        assert (user_stats.overdue_tasks, user_stats.due_this_week, user_stats.completed_tasks) == (0, 0, 1)
+        assert stats.check() == []
+
+    def test_templates_stay_out_of_user_totals(self, app, sample_user):
+        """Test a template's tasks are counted on its own row only"""
+        template = Project(name='Template', user_id=sample_user, is_template=True)
+        db.session.add(template)
+        db.session.commit()
+        stats.rebuild()
+        task = Task(title='Step', project_id=template.id)
+        db.session.add(task)
+        db.session.flush()
+        stats.record_change(template.id, sample_user, None, stats.snapshot(task))
+        db.session.commit()
+
+        assert db.session.get(ProjectStats, template.id).total_tasks == 1
+        assert db.session.get(UserStats, sample_user).total_tasks == 0
+        assert stats.check() == []
+
+
+@pytest.mark.integration
+class TestStatsMaintenance:
+    def test_write_paths_keep_rollup_consistent(self, authenticated_client, sample_project, app):
+        """Test create, edit, complete and delete update the rollup incrementally"""
+        authenticated_client.get('/dashboard')  # builds the rollup rows
+
+        authenticated_client.post(f'/projects/{sample_project}/tasks/create', data={
+            'title': 'Tracked Task', 'importance': 'low',
+            'expected_completion_date': (datetime.utcnow() - timedelta(days=3)).strftime('%Y-%m-%d')
+        })
+        task_id = Task.query.filter_by(title='Tracked Task').one().id
+        assert db.session.get(UserStats, User.query.one().id).overdue_tasks == 1
+
+        authenticated_client.post(f'/tasks/{task_id}/edit', data={
+            'title': 'Tracked Task', 'importance': 'high'
+        })
+        authenticated_client.post(f'/tasks/{task_id}/complete', data={'is_completed': 'true'})
+        db.session.expire_all()
+
+        user_stats = db.session.get(UserStats, User.query.one().id)
+        assert (user_stats.high_completed, user_stats.low_total, user_stats.overdue_tasks) == (1, 0, 0)
+        assert stats.check() == []
+
+        authenticated_client.post(f'/tasks/{task_id}/complete', data={'is_completed': 'false'})
+        authenticated_client.post(f'/tasks/{task_id}/delete')
+        db.session.expire_all()
+        assert db.session.get(UserStats, User.query.one().id).total_tasks == 0
+        assert stats.check() == []
+
+    def test_dashboard_shows_rollup(self, sample_task, authenticated_client):
+        """Test the dashboard renders account-level numbers"""
+        response = authenticated_client.get('/dashboard')
+        assert b'Due this week' in response.data
+        assert b'High importance' in response.data
+
+    def test_cli_refresh(self, app, runner, sample_project):
+        """Test the periodic refresh command"""
+        result = runner.invoke(args=['stats', 'refresh'])
+        assert 'statistics row(s) rebuilt' in result.output
+        assert runner.invoke(args=['stats', 'check']).output.strip() == 'statistics OK'
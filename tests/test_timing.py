@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+import pytest
+from flask import g
+from config import Config
+from timing import DroppingQueueHandler, TimingLog
+
+
+def phases(header):
+    """{'sql': {'dur': '1.20', 'desc': '"3 queries"'}, ...} from a Server-Timing header"""
+    parsed = {}
+    for entry in header.split(', '):
+        name, *params = entry.split(';')
+        parsed[name] = dict(param.split('=', 1) for param in params)
+    return parsed
+
+
+@pytest.mark.integration
+class TestServerTiming:
+    def test_project_page_breakdown(self, authenticated_client, sample_task, sample_project, app):
+        """Test the header splits a page into user load, ownership, SQL and render"""
+        # The fixture's app context outlives requests; drop the user it cached so this request loads it
+        g.pop('_login_user', None)
+        response = authenticated_client.get(f'/projects/{sample_project}')
+        timing = phases(response.headers['Server-Timing'])
+
+        assert set(timing) == {'load_user', 'ownership', 'sql', 'render', 'total'}
+        assert timing['render']['desc'] == '"view_project.html"'
+        assert int(timing['sql']['desc'].strip('"').split()[0]) >= 3
+        assert all(float(params['dur']) >= 0 for params in timing.values())
+
+    def test_log_line_written_off_the_request_thread(self, monkeypatch, tmp_path):
+        """Test one JSON line per request reaches the log file"""
+        os.environ["TESTING"] = "True"
+        monkeypatch.setattr(Config, 'TIMING_LOG_ENABLED', True)
+        monkeypatch.setattr(Config, 'TIMING_LOG_PATH', str(tmp_path / 'timing.log'))
+        from run import create_app
+
+        app = create_app()
+        app.test_client().get('/login')
+        app.extensions['timing_log'].stop()
+
+        [line] = (tmp_path / 'timing.log').read_text().splitlines()
+        entry = json.loads(line)
+        assert (entry['endpoint'], entry['status'], entry['templates']) == ('login', 200, ['login.html'])
+        assert entry['total_ms'] >= entry['render_ms']
+
+
+@pytest.mark.unit
+def test_full_buffer_drops_instead_of_blocking():
+    """Test a backed-up log writer never makes a request wait"""
+    timing_log = TimingLog(path='', buffer_size=1)
+    handler = timing_log.handler
+    record = logging.makeLogRecord({'msg': {'path': '/'}})
+    handler.handle(record)
+    handler.handle(record)
+
+    assert isinstance(handler, DroppingQueueHandler)
+    assert (timing_log.queue.qsize(), handler.dropped) == (1, 1)
@@ -0,0 +1,202 @@
+"""Per-request timing: a Server-Timing header and one structured log line per request
+
+Phases are collected in `g` while the request runs:
+
+  load_user   Flask-Login loading the current user
+  ownership   loading the project/task a route checks ownership of
+  sql         time inside cursor.execute, with the statement count
+  render      Jinja rendering, with the template name
+
+Phases may overlap (the queries run by load_user also count towards sql), so
+they are not meant to add up to `total`.
+
+The log line is handed to a QueueHandler; formatting and writing happen on a
+QueueListener thread, so a slow disk or pipe never holds up a response. If
+the queue is full the line is dropped rather than waiting.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('taskapp.timing')
+
+PHASES = ('load_user', 'ownership', 'sql', 'render')
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # name -> [seconds, count]
+        self.templates = []
+
+    def add(self, name, seconds):
+        phase = self.phases.setdefault(name, [0.0, 0])
+        phase[0] += seconds
+        phase[1] += 1
+
+    def header(self, total):
+        parts = []
+        for name in PHASES:
+            if name in self.phases:
+                seconds, count = self.phases[name]
+                part = f'{name};dur={seconds * 1000:.2f}'
+                if name == 'sql':
+                    part += f';desc="{count} queries"'
+                elif name == 'render' and self.templates:
+                    part += f';desc="{self.templates[0]}"'
+                parts.append(part)
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def _current():
+    return g.get('timing') if has_request_context() else None
+
+
+@contextmanager
+def timed(name):
+    """Add the block's wall time to the current request's `name` phase (no-op outside a request)"""
+    timing = _current()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info['timing_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('timing_started', None)
+    timing = _current()
+    if started is not None and timing is not None:
+        timing.add('sql', time.perf_counter() - started)
+
+
+def _before_render(sender, template, context, **extra):
+    timing = _current()
+    if timing is not None:
+        timing.templates.append(template.name)
+        g.timing_render_started = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    timing = _current()
+    started = g.pop('timing_render_started', None) if timing is not None else None
+    if started is not None:
+        timing.add('render', time.perf_counter() - started)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: full queue means the record is dropped"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Leave the dict in record.msg; the listener thread serialises it
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, separators=(',', ':'), default=str)
+
+
+class TimingLog:
+    """Buffered writer for the per-request lines; the listener thread starts in each worker"""
+
+    def __init__(self, path, buffer_size):
+        self.path = path
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self._listener = None
+        self._pid = None
+
+    def _ensure_listener(self):
+        # Threads don't survive fork, so a preloaded app starts one per worker
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            target = logging.FileHandler(self.path) if self.path else logging.StreamHandler(sys.stderr)
+            target.setFormatter(JSONFormatter())
+            self._listener = QueueListener(self.queue, target)
+            self._listener.start()
+            # Flush what is still queued when the worker exits
+            atexit.register(self.stop)
+
+    def write(self, line):
+        self._ensure_listener()
+        self.handler.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 0, line, None, None))
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+
+
+def init_timing(app):
+    """Time each request; add Server-Timing and/or log a line depending on config"""
+    send_header = app.config['SERVER_TIMING_HEADER']
+    timing_log = TimingLog(app.config['TIMING_LOG_PATH'], app.config['TIMING_LOG_BUFFER']) \
+        if app.config['TIMING_LOG_ENABLED'] else None
+    if not send_header and timing_log is None:
+        return None
+
+    @app.before_request
+    def start_timing():
+        g.timing = RequestTiming()
+
+    @app.after_request
+    def finish_timing(response):
+        timing = g.pop('timing', None)
+        if timing is None:
+            return response
+        total = time.perf_counter() - timing.started
+        if send_header:
+            response.headers['Server-Timing'] = timing.header(total)
+        if timing_log is not None:
+            line = {
+                'ts': round(time.time(), 3),
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 2),
+            }
+            for name, (seconds, count) in timing.phases.items():
+                line[f'{name}_ms'] = round(seconds * 1000, 2)
+            line['sql_count'] = timing.phases.get('sql', (0, 0))[1]
+            if timing.templates:
+                line['templates'] = timing.templates
+            timing_log.write(line)
+        return response
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.extensions['timing_log'] = timing_log
+    return timing_log